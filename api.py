@@ -1,18 +1,189 @@
 """WordCard REST API — FastAPI"""
 
-import os, sys
+import asyncio, collections, datetime, functools, hashlib, json, os, sys, threading, time, uuid
 sys.path.insert(0, os.path.dirname(__file__) or '.')
-import engine, importer
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+import engine, engine_service, importer
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Optional
 
-app = FastAPI(title='WordCard', version='4.0')
+DB_PATH = os.environ.get('WORDCARD_DB', 'data/wordcard.db')
+FLUSH_INTERVAL_MS = int(os.environ.get('WORDCARD_FLUSH_MS', '200'))
+FLUSH_MAX_PENDING = int(os.environ.get('WORDCARD_FLUSH_N', '256'))
+USE_MMAP = os.environ.get('WORDCARD_MMAP', '0') == '1'
+MAX_BATCH_REVIEWS = 1000
+MAX_QUEUE_ITEMS = 500          # 单次取队列上限，缓冲区按 max_count 分配
+ENGINE_WORKERS = int(os.environ.get('WORDCARD_ENGINE_WORKERS', '4'))
+IMPORT_WORKERS = int(os.environ.get('WORDCARD_IMPORT_WORKERS', '1'))
+MAX_IMPORT_JOBS = 256          # 保留的已结束导入任务数，超出按提交先后丢弃
+ENGINE_SOCKET = os.environ.get('WORDCARD_ENGINE_SOCKET', '')
+API_WORKERS = int(os.environ.get('WORDCARD_API_WORKERS', '1'))
+BODY_CACHE_SIZE = int(os.environ.get('WORDCARD_BODY_CACHE', '4096'))
+
+# ── Import jobs ────────────────────────────────────────────
+
+class ImportJobs:
+    """后台导入任务表：提交即返回 job_id，导入在独立线程池里跑，
+    长时间的提取/OCR 不占用处理复习请求的引擎线程。
+    remote 为 RemoteDB 时状态同步到引擎服务，其他 worker 也能查到"""
+
+    def __init__(self, workers, keep=MAX_IMPORT_JOBS, remote=None):
+        self.pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix='wc-import')
+        self.keep = keep
+        self.remote = remote
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, **info):
+        job = dict(info, job_id=uuid.uuid4().hex, status='queued',
+                   created_at=int(time.time()), started_at=0, finished_at=0,
+                   added=0, error='')
+        with self._lock:
+            self._jobs[job['job_id']] = job
+            self._prune()
+            snapshot = dict(job)
+        self._publish(snapshot)
+        self.pool.submit(self._run, job, fn)
+        return snapshot
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        return self.remote.get_job(job_id) if self.remote else None
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def _run(self, job, fn):
+        with self._lock:
+            job.update(status='running', started_at=int(time.time()))
+            snapshot = dict(job)
+        self._publish(snapshot)
+        try:
+            added = fn()
+            update = {'status': 'done', 'added': added}
+        except Exception as e:
+            update = {'status': 'failed', 'error': str(e)}
+        with self._lock:
+            job.update(update, finished_at=int(time.time()))
+            snapshot = dict(job)
+        self._publish(snapshot)
+
+    def _publish(self, job):
+        if self.remote:
+            try:
+                self.remote.put_job(job)
+            except (OSError, RuntimeError):
+                pass            # 状态同步失败不影响导入本身，本 worker 仍可查询
+
+    def _prune(self):
+        # 只丢弃已结束的任务，排队/运行中的一直保留到结束
+        extra = len(self._jobs) - self.keep
+        for job_id in [k for k, j in self._jobs.items()
+                       if j['status'] in ('done', 'failed')][:max(extra, 0)]:
+            del self._jobs[job_id]
+
+# ── Response cache ─────────────────────────────────────────
+
+class BodyCache:
+    """已编码 JSON 响应体的 LRU，键为 (表, 行 id)，值为 (ETag, 响应体)"""
+
+    def __init__(self, size=BODY_CACHE_SIZE):
+        self.size = size
+        self._bodies = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._bodies.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._bodies[key] = body
+            self._bodies.move_to_end(key)
+            while len(self._bodies) > self.size:
+                self._bodies.popitem(last=False)
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+def _cached_json(request, db, bodies, kind, key, build):
+    """ETag 取响应体内容的摘要：If-None-Match 命中回 304，否则优先用缓存的响应体，
+    未命中才调 build() 取数据并编码。在引擎线程里执行。
+
+    学习项与用户建好后引擎里没有修改接口（add_item 按题面去重，重复时不覆盖），
+    同一行的内容不变，所以按 (表, 行 id) 缓存；ETag 由内容算出，重启后依然有效"""
+    cached = bodies.get((kind, key))
+    if cached is None:
+        # 没缓存才取数据：行不存在时 build() 抛 404，If-None-Match: * 也不会回 304
+        # 与 FastAPI 默认 JSONResponse 的编码一致
+        body = json.dumps(build(), ensure_ascii=False, allow_nan=False,
+                          separators=(',', ':')).encode('utf-8')
+        etag = f'"{kind}-{key}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        bodies.put((kind, key), (etag, body))
+    else:
+        etag, body = cached
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
+
+# ── Lifespan ───────────────────────────────────────────────
+
+@asynccontextmanager
+async def lifespan(app):
+    if ENGINE_SOCKET:
+        # 多进程部署：数据库归引擎服务进程所有，本 worker 只转发调用，组提交也在那边
+        app.state.db = engine_service.RemoteDB(ENGINE_SOCKET)
+        app.state.flusher = engine_service.RemoteFlusher(app.state.db)
+    else:
+        # 进程内只加载一次，所有路由共享同一份内存数据库；
+        # open() 加的锁文件挡住第二个进程打开同一个库（多 worker 须走引擎服务）。
+        # WORDCARD_MMAP=1 时锁被占用则只读映射：只服务查询，写路由回 503
+        app.state.db = engine.WordCardDB.open(DB_PATH, mmap=USE_MMAP)
+        # 写操作只标记脏数据，由后台线程按窗口组提交；退出时同步刷盘
+        app.state.flusher = None if app.state.db.readonly else engine.WriteBehind(
+            app.state.db, FLUSH_INTERVAL_MS / 1000.0, FLUSH_MAX_PENDING).start()
+    # 引擎调用（含加载/落盘等阻塞 I/O）在固定大小的线程池里执行，不占事件循环；
+    # 导入任务另开线程池，互不挤占
+    app.state.engine_pool = ThreadPoolExecutor(max(1, ENGINE_WORKERS),
+                                               thread_name_prefix='wc-engine')
+    app.state.bodies = BodyCache(BODY_CACHE_SIZE)
+    app.state.imports = ImportJobs(IMPORT_WORKERS,
+                                   remote=app.state.db if ENGINE_SOCKET else None)
+    try:
+        yield
+    finally:
+        app.state.imports.close()
+        app.state.engine_pool.shutdown(wait=True)
+        if app.state.flusher:
+            app.state.flusher.close()
+        app.state.db.close()
+
+app = FastAPI(title='WordCard', version='4.0', lifespan=lifespan)
 
 # ── Models ─────────────────────────────────────────────────
 
 class ImportReq(BaseModel):
     book_path: str
+    rank: str = 'frequency'
+    force: bool = False
 
 class UserCreate(BaseModel):
     dingtalk_uid: str
@@ -24,151 +195,230 @@ class ItemCreate(BaseModel):
     explanation: str = ''
     source_id: int = 0
 
+# 与 C 端 uint32/uint8 字段一致，越界直接 422，不在 ctypes 里截断
+Id = Annotated[int, Field(ge=1, le=engine.U32_MAX)]
+
 class ReviewReq(BaseModel):
-    user_id: int
-    item_id: int
-    quality: int  # 0-5
+    user_id: Id
+    item_id: Id
+    quality: int = Field(ge=0, le=5)
+
+class BatchReview(ReviewReq):
+    reviewed_at: int = Field(0, ge=0, le=engine.U32_MAX)   # 客户端复习时间（Unix 秒），0 = 服务器时间
+    time_spent: int = Field(5, ge=0, le=engine.U32_MAX)
+
+class BatchReviewReq(BaseModel):
+    reviews: List[BatchReview]
 
 # ── Dependencies ───────────────────────────────────────────
 
-def get_db():
-    db = engine.WordCardDB.open('data/wordcard.db')
-    try:
-        yield db
-    finally:
-        db.close()
+async def get_db(request: Request):
+    return request.app.state.db
+
+def _writable(request):
+    if not request.app.state.flusher:
+        raise HTTPException(503, 'read-only worker: database is open in another process')
+
+async def get_flusher(request: Request):
+    """写路由都依赖它：只读打开的 worker 在这里回 503"""
+    _writable(request)
+    return request.app.state.flusher
+
+async def get_imports(request: Request):
+    return request.app.state.imports
+
+async def get_bodies(request: Request):
+    return request.app.state.bodies
+
+async def get_run(request: Request):
+    """返回 run(fn, *args)：在引擎线程池里执行阻塞调用并等待结果"""
+    pool = request.app.state.engine_pool
+    async def run(fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+    return run
 
 # ── Routes ─────────────────────────────────────────────────
+#
+# 路由都是 async：引擎调用打包成同步函数交给 run() 在引擎线程池里执行，
+# 其中抛出的 HTTPException 原样传回
 
 @app.get('/')
-def root():
+async def root():
     return {'service': 'WordCard', 'version': '4.0'}
 
 @app.post('/api/v1/user')
-def create_user(req: UserCreate):
-    db = engine.WordCardDB.open('data/wordcard.db')
-    try:
-        uid = db.create_user(req.dingtalk_uid, req.name)
-        if not uid:
-            existing = db.find_user(dingtalk_uid=req.dingtalk_uid)
-            if existing:
-                return {'user_id': existing.id, 'name': existing.name.decode('utf-8')}
-            raise HTTPException(400, 'User exists')
-        db.save()
-        return {'user_id': uid}
-    finally:
-        db.close()
+async def create_user(req: UserCreate, db=Depends(get_db), flusher=Depends(get_flusher),
+                      run=Depends(get_run)):
+    def work():
+        with db.lock:
+            uid = db.create_user(req.dingtalk_uid, req.name)
+            if not uid:
+                existing = db.find_user(dingtalk_uid=req.dingtalk_uid)
+                if existing:
+                    return {'user_id': existing.id, 'name': existing.name.decode('utf-8')}
+                raise HTTPException(400, 'User exists')
+            flusher.touch()
+            return {'user_id': uid}
+    return await run(work)
 
 @app.get('/api/v1/user/{uid}')
-def get_user(uid: int):
-    db = engine.WordCardDB.open('data/wordcard.db')
-    try:
-        u = db.find_user(user_id=uid)
-        if not u:
-            raise HTTPException(404, 'User not found')
-        return {
-            'id': u.id, 'name': u.name.decode('utf-8'),
-            'daily_new_limit': u.daily_new_limit,
-            'daily_review_limit': u.daily_review_limit,
-            'created_at': u.created_at,
-        }
-    finally:
-        db.close()
+async def get_user(uid: int, request: Request, db=Depends(get_db),
+                   bodies=Depends(get_bodies), run=Depends(get_run)):
+    def build():
+        with db.lock:
+            u = db.find_user(user_id=uid)
+            if not u:
+                raise HTTPException(404, 'User not found')
+            return {
+                'id': u.id, 'name': u.name.decode('utf-8'),
+                'daily_new_limit': u.daily_new_limit,
+                'daily_review_limit': u.daily_review_limit,
+                'created_at': u.created_at,
+            }
+    return await run(_cached_json, request, db, bodies, 'user', uid, build)
 
 @app.post('/api/v1/item')
-def create_item(req: ItemCreate):
-    db = engine.WordCardDB.open('data/wordcard.db')
-    try:
-        item_id = db.add_item(req.question, req.answer, req.explanation,
-                               source_id=req.source_id)
-        if not item_id:
-            existing = db.find_item(question=req.question)
-            if existing:
-                return {'item_id': existing.id}
-            raise HTTPException(400, 'Failed to add')
-        db.save()
-        return {'item_id': item_id}
-    finally:
-        db.close()
+async def create_item(req: ItemCreate, db=Depends(get_db), flusher=Depends(get_flusher),
+                      run=Depends(get_run)):
+    def work():
+        with db.lock:
+            item_id = db.add_item(req.question, req.answer, req.explanation,
+                                   source_id=req.source_id)
+            if not item_id:
+                existing = db.find_item(question=req.question)
+                if existing:
+                    return {'item_id': existing.id}
+                raise HTTPException(400, 'Failed to add')
+            flusher.touch()
+            return {'item_id': item_id}
+    return await run(work)
 
 @app.get('/api/v1/item/{item_id}')
-def get_item(item_id: int):
-    db = engine.WordCardDB.open('data/wordcard.db')
-    try:
-        item = db.find_item(item_id=item_id)
-        if not item:
-            raise HTTPException(404)
-        return {
-            'id': item.id,
-            'question': item.question.decode('utf-8'),
-            'answer': item.answer.decode('utf-8'),
-            'explanation': item.explanation.decode('utf-8'),
-        }
-    finally:
-        db.close()
+async def get_item(item_id: int, request: Request, db=Depends(get_db),
+                   bodies=Depends(get_bodies), run=Depends(get_run)):
+    def build():
+        with db.lock:
+            item = db.find_item(item_id=item_id)
+            if not item:
+                raise HTTPException(404)
+            return {
+                'id': item.id,
+                'question': item.question.decode('utf-8'),
+                'answer': item.answer.decode('utf-8'),
+                'explanation': item.explanation.decode('utf-8'),
+            }
+    return await run(_cached_json, request, db, bodies, 'item', item_id, build)
 
 @app.post('/api/v1/review')
-def submit_review(req: ReviewReq):
-    db = engine.WordCardDB.open('data/wordcard.db')
+async def submit_review(req: ReviewReq, db=Depends(get_db), flusher=Depends(get_flusher),
+                        run=Depends(get_run)):
     try:
-        m = db.find_mastery(req.user_id, req.item_id)
-        if not m:
-            m = db.get_or_create_mastery(req.user_id, req.item_id)
-        db.sm2_update(m, req.quality)
-        db.record_activity(req.user_id, False, req.quality >= 3, 5)
-        db.save()
-        return {
+        m = await run(db.review, req.user_id, req.item_id, req.quality, 5)
+    except LookupError as e:
+        raise HTTPException(404, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    flusher.touch()
+    return {
+        'next_review': m.next_review,
+        'interval_days': m.interval_days,
+        'repetitions': m.repetitions,
+        'ease_factor': m.ease_factor,
+        'overall': m.overall,
+    }
+
+@app.post('/api/v1/reviews:batch')
+async def submit_reviews(req: BatchReviewReq, db=Depends(get_db),
+                         flusher=Depends(get_flusher), run=Depends(get_run)):
+    """离线/会话结束时的批量同步：按顺序应用，一次引擎调用 + 一次组提交"""
+    if len(req.reviews) > MAX_BATCH_REVIEWS:
+        raise HTTPException(413, f'At most {MAX_BATCH_REVIEWS} reviews per batch')
+    results = await run(db.review_batch, [
+        (r.user_id, r.item_id, r.quality, r.reviewed_at, r.time_spent)
+        for r in req.reviews])
+    out = []
+    applied = 0
+    for r, (rc, m) in zip(req.reviews, results):
+        if rc != 0:
+            out.append({'item_id': r.item_id, 'error': rc})
+            continue
+        applied += 1
+        out.append({
+            'item_id': r.item_id,
             'next_review': m.next_review,
             'interval_days': m.interval_days,
             'repetitions': m.repetitions,
             'ease_factor': m.ease_factor,
             'overall': m.overall,
-        }
-    finally:
-        db.close()
+        })
+    if applied:
+        flusher.touch(applied)
+    return {'applied': applied, 'results': out}
 
 @app.get('/api/v1/queue/{user_id}')
-def get_queue(user_id: int, max_count: int = 20):
-    db = engine.WordCardDB.open('data/wordcard.db')
-    try:
-        now = engine.WordCardDB.now()
-        queue = db.daily_queue(user_id, now, max_count)
-        items = []
-        for item_id, mode in queue:
-            item = db.find_item(item_id=item_id)
-            if item:
-                items.append({
-                    'item_id': item_id,
-                    'question': item.question.decode('utf-8'),
-                    'mode': mode,
-                })
-        return {'items': items, 'total': len(items)}
-    finally:
-        db.close()
+async def get_queue(user_id: int,
+                    max_count: Annotated[int, Query(ge=1, le=MAX_QUEUE_ITEMS)] = 20,
+                    db=Depends(get_db), run=Depends(get_run)):
+    now = engine.WordCardDB.now()
+    queue = await run(db.daily_queue_items, user_id, now, max_count)
+    items = [{'item_id': it.item_id, 'question': it.question, 'mode': it.mode}
+             for it in queue]
+    return {'items': items, 'total': len(items)}
 
-@app.post('/api/v1/import')
-def import_book(req: ImportReq):
-    try:
-        count = importer.import_book(req.book_path)
-        return {'added': count}
-    except Exception as e:
-        raise HTTPException(400, str(e))
+@app.post('/api/v1/import', status_code=202)
+async def import_book(req: ImportReq, request: Request, db=Depends(get_db),
+                      imports=Depends(get_imports), run=Depends(get_run)):
+    """提交后台导入任务，立即返回 job_id；进度用 GET /api/v1/import/{job_id} 查询"""
+    _writable(request)
+    if req.rank not in importer.RANKS:
+        raise HTTPException(400, f'rank must be one of {", ".join(importer.RANKS)}')
+    if not os.path.isfile(req.book_path):
+        raise HTTPException(400, f'File not found: {req.book_path}')
+    fn = functools.partial(importer.import_book, req.book_path, db=db,
+                           rank=req.rank, force=req.force)
+    # 有引擎服务时 submit/get 要走一趟 socket，放到引擎线程里别堵事件循环
+    return await run(imports.submit, fn, book_path=req.book_path)
+
+@app.get('/api/v1/import/{job_id}')
+async def get_import(job_id: str, imports=Depends(get_imports), run=Depends(get_run)):
+    job = await run(imports.get, job_id)
+    if not job:
+        raise HTTPException(404, 'Import job not found')
+    return job
 
 @app.get('/api/v1/stats/{user_id}')
-def get_stats(user_id: int):
-    db = engine.WordCardDB.open('data/wordcard.db')
-    try:
-        now = engine.WordCardDB.now()
-        due = db.get_due_items(user_id, now, 9999)
-        new = db.get_new_items(user_id, 0, 9999)
-        return {
-            'user_id': user_id,
-            'due_review': len(due),
-            'new_available': len(new),
-        }
-    finally:
-        db.close()
+async def get_stats(user_id: int, db=Depends(get_db), run=Depends(get_run)):
+    c = await run(db.user_counts, user_id)
+    return {
+        'user_id': user_id,
+        'due_review': c['due_now'],
+        'due_today': c['due_today'],
+        'new_available': c['new_available'],
+        'learning': c['learning'],
+        'mastered': c['mastered'],
+    }
+
+@app.get('/api/v1/forecast/{user_id}')
+async def get_forecast(user_id: int, days: int = 30, db=Depends(get_db),
+                       run=Depends(get_run)):
+    if not 1 <= days <= 365:
+        raise HTTPException(400, 'days must be 1-365')
+    counts = await run(db.forecast, user_id, days)
+    today = datetime.date.today()
+    return {
+        'user_id': user_id,
+        'days': [{'date': (today + datetime.timedelta(days=d)).isoformat(), 'due': n}
+                 for d, n in enumerate(counts)],
+        'total': sum(counts),
+    }
 
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host='0.0.0.0', port=8000)
+    if API_WORKERS > 1:
+        if not ENGINE_SOCKET:
+            sys.exit('WORDCARD_API_WORKERS > 1 needs the engine service: '
+                     'run engine_service.py and set WORDCARD_ENGINE_SOCKET')
+        uvicorn.run('api:app', host='0.0.0.0', port=8000, workers=API_WORKERS)
+    else:
+        uvicorn.run(app, host='0.0.0.0', port=8000)
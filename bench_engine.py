@@ -0,0 +1,86 @@
+"""engine.py 绑定开销微基准
+
+对比每次调用都重设 argtypes/restype（旧写法）与 _load() 时一次性绑定原型，
+覆盖 find_item / sm2_update / daily_queue 三个高频小调用。
+
+用法: python bench_engine.py [次数]
+"""
+
+import sys, time
+from ctypes import POINTER, byref, c_int, c_size_t, c_uint8, c_uint32, c_void_p
+
+import engine
+from engine import ItemEntry, Mastery
+
+N_ITEMS = 2000
+USER = 1
+
+def setup():
+    db = engine.WordCardDB()
+    db.add_items_bulk((f'word{i}', f'释义{i}') for i in range(N_ITEMS))
+    for i in range(1, N_ITEMS // 4):
+        db.review(USER, i, 4)
+    return db
+
+# ── 旧写法：每次调用重设原型 ────────────────────────────────
+
+def legacy_find_item(db, item_id):
+    lib = db._lib
+    out = ItemEntry()
+    lib.wc_get_item.argtypes = [c_void_p, c_uint32, POINTER(ItemEntry)]
+    lib.wc_get_item.restype = c_int
+    rc = lib.wc_get_item(db._handle, item_id, byref(out))
+    return out if rc == 0 else None
+
+def legacy_sm2_update(db, mastery, quality):
+    lib = db._lib
+    lib.wc_sm2_update_db.argtypes = [c_void_p, POINTER(Mastery), c_uint8]
+    lib.wc_sm2_update_db(db._handle, mastery, quality)
+
+def legacy_daily_queue(db, user_id, now, max_count=50):
+    lib = db._lib
+    ids = (c_uint32 * max_count)()
+    modes = (c_uint8 * max_count)()
+    lib.wc_generate_daily_queue.argtypes = [
+        c_void_p, c_uint32, c_uint32,
+        POINTER(c_uint32), POINTER(c_uint8), c_size_t]
+    lib.wc_generate_daily_queue.restype = c_size_t
+    n = lib.wc_generate_daily_queue(db._handle, user_id, now, ids, modes, max_count)
+    return [(ids[i], modes[i]) for i in range(n)]
+
+# ── 计时 ───────────────────────────────────────────────────
+
+def timeit(fn, n):
+    t = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t) / n * 1e6
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    db = setup()
+    now = engine.WordCardDB.now()
+    m = db.get_or_create_mastery(USER, 1)
+
+    cases = [
+        ('find_item',
+         lambda i: legacy_find_item(db, i % N_ITEMS + 1),
+         lambda i: db.find_item(item_id=i % N_ITEMS + 1)),
+        ('sm2_update',
+         lambda i: legacy_sm2_update(db, m, 4),
+         lambda i: db.sm2_update(m, 4)),
+        ('daily_queue',
+         lambda i: legacy_daily_queue(db, USER, now),
+         lambda i: db.daily_queue(USER, now)),
+    ]
+    print(f'{"call":<14}{"per-call":>12}{"bound":>12}{"saved":>10}   ({n} calls, µs/call)')
+    for name, legacy, bound in cases:
+        # 交替预热，避免首次 CDLL 属性查找计入
+        legacy(0); bound(0)
+        a = timeit(legacy, n)
+        b = timeit(bound, n)
+        print(f'{name:<14}{a:>12.2f}{b:>12.2f}{(a - b) / a * 100:>9.0f}%')
+    db.close()
+
+if __name__ == '__main__':
+    main()
@@ -5,31 +5,57 @@ import sys, os
 sys.path.insert(0, os.path.dirname(__file__) or '.')
 import engine, importer
 
+def _import_opts(args):
+    """解析 --jobs N / --rank R / --force，返回 (位置参数, 选项)"""
+    opts = {'jobs': None, 'rank': 'frequency', 'force': False}
+    rest = []
+    it = iter(args)
+    for a in it:
+        name, eq, val = a.partition('=')
+        if a == '--force':
+            opts['force'] = True
+        elif name in ('--jobs', '-j', '--rank'):
+            if not eq:
+                val = next(it, '')
+            if name == '--rank':
+                opts['rank'] = val
+            else:
+                opts['jobs'] = int(val or '0') or None
+        else:
+            rest.append(a)
+    if opts['rank'] not in importer.RANKS:
+        raise SystemExit(f'--rank must be one of: {", ".join(importer.RANKS)}')
+    return rest, opts
+
 def cmd_import(args):
-    path = args[0] if args else None
-    if not path:
-        print('Usage: wordcard import <book.pdf|.mobi|.md>')
+    rest, opts = _import_opts(args)
+    if not rest:
+        print('Usage: wordcard import <book.pdf|.mobi|.md> [--rank frequency|rarity|first] [--force]')
+        return
+    importer.import_book(rest[0], rank=opts['rank'], force=opts['force'])
+
+def cmd_import_dir(args):
+    rest, opts = _import_opts(args)
+    if not rest:
+        print('Usage: wordcard import-dir <dir> [--jobs N] [--rank frequency|rarity|first] [--force]')
         return
-    importer.import_book(path)
+    importer.import_dir(rest[0], jobs=opts['jobs'], rank=opts['rank'], force=opts['force'])
 
 def cmd_review(args):
     db = engine.WordCardDB.open('data/wordcard.db')
+    flusher = engine.WriteBehind(db).start()
     try:
         uid = 1
         now = engine.WordCardDB.now()
-        queue = db.daily_queue(uid, now, 20)
+        queue = db.daily_queue_items(uid, now, 20,
+                                     fields=('question', 'answer', 'explanation'))
         if not queue:
             print('No items to review today!')
             return
         total = len(queue)
-        for idx, (item_id, mode) in enumerate(queue, 1):
-            item = db.find_item(item_id=item_id)
-            if not item:
-                continue
-            m = db.get_or_create_mastery(uid, item_id)
-            q = item.question.decode('utf-8')
-            a = item.answer.decode('utf-8')
-            ex = item.explanation.decode('utf-8')
+        for idx, item in enumerate(queue, 1):
+            item_id = item.item_id
+            q, a, ex = item.question, item.answer, item.explanation
             print(f'\n[{idx}/{total}] {q}')
             if ex:
                 print(f'  Context: {ex[:120]}')
@@ -41,14 +67,14 @@ def cmd_review(args):
                 continue
             correct = ans.lower().strip('.!?') == q.lower().strip('.!?')
             ql = 4 if correct else 1
-            db.sm2_update(m, ql)
-            db.record_activity(uid, False, correct, 5)
+            m = db.review(uid, item_id, ql, 5)
             if correct:
                 print(f'  Correct  (q={ql})  Next: {m.interval_days}d')
             else:
                 print(f'  Wrong, answer: {q}  Next: {m.interval_days}d')
-            db.save()
+            flusher.touch()
     finally:
+        flusher.close()
         db.close()
 
 def cmd_stats(args):
@@ -56,11 +82,11 @@ def cmd_stats(args):
     try:
         uid = 1
         today = engine.WordCardDB.today()
-        now = engine.WordCardDB.now()
-        due = db.get_due_items(uid, now, 9999)
-        new = db.get_new_items(uid, 0, 9999)
-        print(f'  Due for review: {len(due)}')
-        print(f'  New items available: {len(new)}')
+        c = db.user_counts(uid)
+        print(f'  Due for review: {c["due_now"]} (today: {c["due_today"]})')
+        print(f'  New items available: {c["new_available"]}')
+        print(f'  Learning: {c["learning"]}')
+        print(f'  Mastered: {c["mastered"]}')
         user = db.find_user(user_id=uid)
         if user:
             print(f'  Daily new limit: {user.daily_new_limit}')
@@ -111,7 +137,10 @@ def cmd_help(args=None):
     print('''WordCard CLI
 Usage: wordcard <command> [args]
 Commands:
-  import <file>   Import ebook (pdf/mobi/md)
+  import <file> [--rank frequency|rarity|first] [--force]
+                  Import ebook (pdf/mobi/md); unchanged files are skipped
+  import-dir <dir> [--jobs N] [--rank ...] [--force]
+                  Import all ebooks under dir in parallel
   review           Interactive review session
   stats           Show learning statistics
   card <id>       Generate card PNG for item
@@ -121,6 +150,7 @@ Commands:
 def main():
     cmds = {
         'import': cmd_import,
+        'import-dir': cmd_import_dir,
         'review': cmd_review,
         'stats':  cmd_stats,
         'card':   cmd_card,
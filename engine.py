@@ -1,9 +1,9 @@
 """SM-2 引擎 ctypes 绑定 — libwordcard.so"""
 
-import ctypes, os
+import ctypes, fcntl, hashlib, itertools, os, threading, time
 from ctypes import (c_char, c_uint8, c_uint16, c_uint32, c_uint64,
-                    c_int, c_float, c_size_t, c_char_p, c_void_p,
-                    POINTER, Structure, byref, memmove)
+                    c_int, c_int32, c_int64, c_float, c_size_t,
+                    c_char_p, c_void_p, POINTER, Structure, byref, memmove)
 
 _lib = None
 _lib_paths = [
@@ -18,7 +18,9 @@ def _load():
     for p in _lib_paths:
         fp = os.path.join(d, p)
         if os.path.exists(fp):
-            _lib = ctypes.CDLL(fp)
+            lib = ctypes.CDLL(fp)
+            _bind(lib)
+            _lib = lib
             return _lib
     raise RuntimeError(f'libwordcard.so not found in {_lib_paths}')
 
@@ -47,8 +49,31 @@ class ContentSource(Structure):
         ('item_start',  c_uint32),
         ('item_count',  c_uint32),
         ('created_at',  c_uint32),
+        ('page_count',  c_uint32),
+        ('page_hashes', c_uint32),      # 字符串堆偏移，用 source_page_hashes() 取副本
+        ('updated_at',  c_uint32),
+        ('content_hash', c_uint64),
+        ('file_size',   c_uint64),
+        ('file_mtime',  c_uint32),
+        ('reserved',    c_uint32),
     ]
 
+# 载体类型（source_type_t）
+SOURCE_PDF, SOURCE_WORDLIST, SOURCE_ARTICLE = 1, 2, 3
+
+def _utf8_cut(b, n):
+    """bytes 截到至多 n 字节，不切开 UTF-8 字符"""
+    return b[:n].decode('utf-8', 'ignore').encode('utf-8') if len(b) > n else b
+
+def _source_path_key(file_path):
+    """载体路径 → 库内 file_path 字段。放得下原样存；超长时取字符边界上的前缀，
+    拼上全路径哈希，写入与查找用同一规则，长路径也能再次命中"""
+    b = file_path.encode('utf-8')
+    if len(b) <= 255:
+        return b
+    digest = hashlib.blake2b(b, digest_size=8).hexdigest().encode('ascii')
+    return _utf8_cut(b, 255 - 1 - len(digest)) + b'#' + digest
+
 class User(Structure):
     _fields_ = [
         ('id',               c_uint32),
@@ -101,60 +126,324 @@ class DailyStat(Structure):
         ('study_time_sec', c_uint32),
     ]
 
+class ReviewReq(Structure):
+    _fields_ = [
+        ('user_id',     c_uint32),
+        ('item_id',     c_uint32),
+        ('reviewed_at', c_uint32),      # 0 = 服务器当前时间
+        ('time_spent',  c_uint32),
+        ('quality',     c_uint8),
+        ('reserved',    c_uint8 * 3),
+    ]
+
+class UserCounts(Structure):
+    _fields_ = [
+        ('due_now',       c_uint32),
+        ('due_today',     c_uint32),
+        ('new_available', c_uint32),
+        ('learning',      c_uint32),
+        ('mastered',      c_uint32),
+    ]
+
+# 队列项的文本字段，顺序与 C 端 WC_FIELD_* 位序一致
+QUEUE_FIELDS = ('question', 'answer', 'explanation', 'hint', 'tags')
+
+def _queue_field(name):
+    def get(self):
+        raw, offs, cols = self._packed
+        col = cols.get(name)
+        if col is None:
+            raise AttributeError(f'{name} was not requested')
+        k = self._base + col
+        return raw[offs[k]:offs[k + 1]].decode('utf-8', 'replace')
+    return property(get)
+
+class QueueItem:
+    """daily_queue_items 的一项。整条队列的文本共用一块打包缓冲区，
+    访问字段时才解码；未请求的字段抛 AttributeError"""
+    __slots__ = ('item_id', 'mode', '_packed', '_base')
+
+    def __init__(self, item_id, mode, packed, base):
+        self.item_id = item_id
+        self.mode = mode
+        self._packed = packed
+        self._base = base
+
+for _name in QUEUE_FIELDS:
+    setattr(QueueItem, _name, _queue_field(_name))
+del _name
+
+U32_MAX = 0xFFFFFFFF
+WC_ERR_MEMORY = -1
+WC_ERR_NOT_FOUND = -4
+
+def _check_review(user_id, item_id, quality, reviewed_at=0, time_spent=5):
+    """ctypes 赋值会静默截断越界整数，入库前先按 C 字段范围检查"""
+    if not (1 <= user_id <= U32_MAX and 1 <= item_id <= U32_MAX):
+        raise ValueError(f'user_id/item_id out of range: {user_id}/{item_id}')
+    if not 0 <= quality <= 5:
+        raise ValueError(f'quality must be 0-5: {quality}')
+    if not (0 <= reviewed_at <= U32_MAX and 0 <= time_spent <= U32_MAX):
+        raise ValueError(f'reviewed_at/time_spent out of range: {reviewed_at}/{time_spent}')
+
+def _review_reqs(reviews):
+    """review_batch 的参数 → ReviewReq 数组"""
+    reviews = list(reviews)
+    reqs = (ReviewReq * len(reviews))()
+    for r, spec in zip(reqs, reviews):
+        if isinstance(spec, dict):
+            spec = (spec['user_id'], spec['item_id'], spec['quality'],
+                    spec.get('reviewed_at', 0), spec.get('time_spent', 5))
+        spec = (spec[0], spec[1], spec[2],
+                spec[3] if len(spec) > 3 else 0, spec[4] if len(spec) > 4 else 5)
+        _check_review(*spec)
+        r.user_id, r.item_id, r.quality, r.reviewed_at, r.time_spent = spec
+    return reqs
+
+def _queue_mask(fields):
+    """fields → (WC_FIELD_* 位掩码, 按位序排列的字段名)"""
+    mask = 0
+    for f in fields:
+        if f not in QUEUE_FIELDS:
+            raise ValueError(f'unknown queue field: {f}')
+        mask |= 1 << QUEUE_FIELDS.index(f)
+    return mask, [f for f in QUEUE_FIELDS if f in fields]
+
+def _queue_items(ids, modes, offs, raw, order):
+    nf = len(order)
+    packed = (raw, offs, {f: i for i, f in enumerate(order)})
+    return [QueueItem(item_id, mode, packed, i * nf)
+            for i, (item_id, mode) in enumerate(zip(ids, modes))]
+
+# ── C 函数原型 ────────────────────────────────────────────────
+# name → (restype, argtypes)。只在 _load() 中设置一次：调用路径上不再改写
+# 共享的函数对象，多线程共用同一个 CDLL 也不会互相覆盖
+
+_PROTOTYPES = {
+    # 生命周期 / 持久化
+    'wc_db_init':               (c_void_p, []),
+    'wc_db_free':               (None, [c_void_p]),
+    'wc_load_db':               (c_void_p, [c_char_p]),
+    'wc_map_db':                (c_void_p, [c_char_p]),
+    'wc_save_db':               (c_int, [c_void_p, c_char_p]),
+    'wc_journal_open':          (c_int, [c_void_p, c_char_p]),
+    'wc_journal_replay':        (c_int, [c_void_p, c_char_p]),
+    'wc_checkpoint':            (c_int, [c_void_p]),
+    'wc_commit':                (c_int, [c_void_p, c_uint64]),
+    # 学习项
+    'wc_add_item':              (c_uint32, [c_void_p, POINTER(ItemEntry)]),
+    'wc_add_items_bulk':        (c_int, [c_void_p, POINTER(ItemEntry), c_size_t,
+                                         POINTER(c_uint32)]),
+    'wc_get_item':              (c_int, [c_void_p, c_uint32, POINTER(ItemEntry)]),
+    'wc_get_item_by_question':  (c_int, [c_void_p, c_char_p, POINTER(ItemEntry)]),
+    'wc_item_frequencies':      (c_int, [c_void_p, POINTER(c_char_p), c_size_t,
+                                         POINTER(c_uint32), POINTER(c_uint64)]),
+    # 载体
+    'wc_add_source':            (c_uint32, [c_void_p, POINTER(ContentSource)]),
+    'wc_get_source':            (c_int, [c_void_p, c_uint32, POINTER(ContentSource)]),
+    'wc_get_source_by_path':    (c_int, [c_void_p, c_char_p, POINTER(ContentSource)]),
+    'wc_update_source':         (c_int, [c_void_p, POINTER(ContentSource), c_char_p]),
+    'wc_get_source_page_hashes': (c_int, [c_void_p, c_uint32, c_char_p, c_size_t,
+                                          POINTER(c_size_t)]),
+    # 用户
+    'wc_create_user':           (c_uint32, [c_void_p, c_char_p, c_char_p]),
+    'wc_get_user':              (c_int, [c_void_p, c_uint32, POINTER(User)]),
+    'wc_get_user_by_uid':       (c_int, [c_void_p, c_char_p, POINTER(User)]),
+    # 掌握度
+    'wc_get_mastery':           (c_int, [c_void_p, c_uint32, c_uint32, POINTER(Mastery)]),
+    'wc_get_or_create_mastery': (POINTER(Mastery), [c_void_p, c_uint32, c_uint32]),
+    'wc_mastery_acquire':       (c_void_p, [c_void_p, POINTER(c_size_t)]),
+    'wc_mastery_release':       (None, [c_void_p, c_int]),
+    'wc_mastery_rows':          (c_int, [c_void_p, POINTER(c_uint32), POINTER(c_uint32),
+                                         c_size_t, c_int, POINTER(c_int64)]),
+    'wc_mark_dirty':            (None, [c_void_p]),
+    'wc_sm2_update_db':         (None, [c_void_p, POINTER(Mastery), c_uint8]),
+    'wc_review':                (c_int, [c_void_p, c_uint32, c_uint32, c_uint8,
+                                         c_uint32, POINTER(Mastery)]),
+    'wc_submit_reviews':        (c_int, [c_void_p, POINTER(ReviewReq), c_size_t,
+                                         POINTER(Mastery), POINTER(c_int32)]),
+    'wc_update_mastery_dimension': (None, [c_void_p, POINTER(Mastery), c_char,
+                                           c_int, c_uint8]),
+    'wc_notify_mastery_changed': (None, [c_void_p]),
+    # 队列 / 统计
+    'wc_get_due_items':         (c_size_t, [c_void_p, c_uint32, c_uint32,
+                                            POINTER(c_uint32), c_size_t]),
+    'wc_get_new_items':         (c_size_t, [c_void_p, c_uint32, c_uint32,
+                                            POINTER(c_uint32), c_size_t]),
+    'wc_get_user_counts':       (c_int, [c_void_p, c_uint32, c_uint32,
+                                         POINTER(UserCounts)]),
+    'wc_forecast':              (c_int, [c_void_p, c_uint32, c_uint32, c_uint32,
+                                         POINTER(c_uint32)]),
+    'wc_day_ends':              (c_int, [c_uint32, c_uint32, POINTER(c_uint32)]),
+    'wc_generate_daily_queue':  (c_size_t, [c_void_p, c_uint32, c_uint32,
+                                            POINTER(c_uint32), POINTER(c_uint8),
+                                            c_size_t]),
+    'wc_daily_queue_items':     (c_size_t, [c_void_p, c_uint32, c_uint32, c_uint32,
+                                            POINTER(c_uint32), POINTER(c_uint8),
+                                            POINTER(c_uint32), c_void_p, c_size_t,
+                                            POINTER(c_size_t), c_size_t]),
+    'wc_record_activity':       (None, [c_void_p, c_uint32, c_int, c_int, c_uint32]),
+}
+
+def _bind(lib):
+    for name, (restype, argtypes) in _PROTOTYPES.items():
+        fn = getattr(lib, name, None)
+        if fn is None:
+            continue            # 旧版库缺少的符号：调用时再报错
+        fn.restype = restype
+        fn.argtypes = argtypes
+
 # ── 数据库 ────────────────────────────────────────────────────
 
+def _claim(path):
+    """对 <path>.lock 加独占 flock，返回持有锁的文件对象（关闭即释放）。
+    同一数据库已被其他进程打开时抛 RuntimeError，而不是各写各的互相覆盖"""
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    f = open(path + '.lock', 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise RuntimeError(f'{path} is already open in another process; '
+                           f'run engine_service.py and set WORDCARD_ENGINE_SOCKET '
+                           f'for multi-worker deployments') from None
+    return f
+
 class WordCardDB:
-    def __init__(self):
+    """内存数据库句柄。
+
+    C 层每个调用自带全局锁，查询返回的都是在锁内拷出的副本；但"查找 → 修改 →
+    读结果"这类组合操作不是原子的，多线程共享同一个句柄时需在 ``with db.lock:``
+    内完成。get_or_create_mastery 例外，返回指向 C 数组的行（供 sm2_update 原地改写）。
+    """
+
+    def __init__(self, path=None):
         self._lib = _load()
-        self._lib.wc_db_init.restype = c_void_p
         self._handle = self._lib.wc_db_init()
         if not self._handle:
             raise RuntimeError('wc_db_init failed')
+        self.path = path
+        self.lock = threading.RLock()
+        self._journal = False
+        self._owner = None
+        self.readonly = False
 
     @classmethod
-    def open(cls, path):
+    def open(cls, path, journal=True, mmap=False, readonly=False):
+        """加载快照；journal=True 时重放并续写 <path>.wal 预写日志。
+
+        mmap=True 时以 MAP_PRIVATE 映射快照，表直接指向文件页，启动不拷贝，
+        多个进程共享同一份页缓存；修改在本进程内写时复制。
+
+        journal=True 时先对 <path>.lock 加独占 flock，close() 释放：
+        同一个库同时只能有一个进程写（CLI、导入、API 都经过这里）。
+        readonly=True 不加锁，只重放日志不续写，save()/commit() 写回本库时报错；
+        mmap=True 时锁已被其他进程持有则自动按只读打开，多个进程可映射同一份快照。
+        """
         lib = _load()
-        lib.wc_load_db.restype = c_void_p
-        h = lib.wc_load_db(path.encode('utf-8'))
-        if not h:
-            db = cls.__new__(cls)
-            db._lib = lib
-            db._handle = None
-            return db.open_new(path)
-        db = cls.__new__(cls)
-        db._lib = lib
-        db._handle = h
-        db._dirty = True
+        owner = None
+        if journal and not readonly:
+            try:
+                owner = _claim(path)
+            except RuntimeError:
+                if not mmap:
+                    raise
+                readonly = True
+        try:
+            loader = lib.wc_map_db if mmap else lib.wc_load_db
+            h = loader(path.encode('utf-8'))
+            if not h:
+                if os.path.exists(path):
+                    # 版本未知/截断/损坏：不能当空库打开，否则下次保存会覆盖原文件
+                    raise RuntimeError(f'cannot load {path}: unknown version or corrupt file')
+                # 文件不存在：新建空库，save() 时写回 path
+                db = cls(path)
+            else:
+                db = cls.__new__(cls)
+                db._lib = lib
+                db._handle = h
+                db.path = path
+                db.lock = threading.RLock()
+                db._journal = False
+                db._owner = None
+        except BaseException:
+            if owner:
+                owner.close()
+            raise
+        db._owner = owner
+        db.readonly = readonly
+        if journal and readonly:
+            # 看到写者已写进日志的修改；写者正在追加的半条记录校验不过，自然跳过
+            ret = lib.wc_journal_replay(db._handle, path.encode('utf-8'))
+            if ret != 0:
+                db.close()
+                raise RuntimeError(f'wc_journal_replay failed ({ret}): {path}.wal')
+        elif journal:
+            db._open_journal(path)
         return db
 
+    def _open_journal(self, path):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        ret = self._lib.wc_journal_open(self._handle, path.encode('utf-8'))
+        if ret != 0:
+            self.close()
+            raise RuntimeError(f'wc_journal_open failed ({ret}): {path}.wal')
+        self._journal = True
+
     def open_new(self, path):
         # Already called wc_db_init via cls()
-        self._lib.wc_load_db.restype = c_void_p
         h = self._lib.wc_load_db(path.encode('utf-8'))
         if h:
             self._lib.wc_db_free(self._handle)
             self._handle = h
+        elif os.path.exists(path):
+            raise RuntimeError(f'cannot load {path}: unknown version or corrupt file')
+        self.path = path
         return self
 
     def save(self, path=None):
-        self._lib.wc_save_db.argtypes = [c_void_p, c_char_p]
-        self._lib.wc_save_db.restype = c_int
-        return self._lib.wc_save_db(self._handle,
-                                     path.encode('utf-8') if path else None)
+        """写完整快照；写回自身路径时同时清空预写日志"""
+        path = path or self.path
+        if self.readonly and path == self.path:
+            raise RuntimeError(f'{path} is opened read-only')
+        if path:
+            d = os.path.dirname(path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+        with self.lock:
+            if self._journal and path == self.path:
+                return self._lib.wc_checkpoint(self._handle)
+            return self._lib.wc_save_db(self._handle,
+                                         path.encode('utf-8') if path else None)
+
+    def commit(self, compact_bytes=0):
+        """组提交：已写日志的修改只做 fdatasync；有未入日志的修改或
+        日志超过 compact_bytes（0 = 默认 16MB）时折叠为新快照"""
+        if not self._journal:
+            return self.save()
+        with self.lock:
+            return self._lib.wc_commit(self._handle, compact_bytes)
 
     def close(self):
-        if self._handle:
+        if getattr(self, '_handle', None):
             self._lib.wc_db_free(self._handle)
             self._handle = None
+        if getattr(self, '_owner', None):
+            self._owner.close()
+            self._owner = None
 
     def __del__(self):
         self.close()
 
     # ── 学习项 ────────────────────────────────────────────────
 
-    def add_item(self, question, answer, explanation='', hint='',
-                 difficulty=1, category=1, source_id=0, tags=''):
-        item = ItemEntry()
+    @staticmethod
+    def _fill_item(item, question, answer='', explanation='', hint='',
+                   difficulty=1, category=1, source_id=0, tags='', frequency=0):
         item.question = question.encode('utf-8')[:511]
         item.answer = answer.encode('utf-8')[:511]
         item.explanation = explanation.encode('utf-8')[:1023]
@@ -163,69 +452,184 @@ class WordCardDB:
         item.category = category
         item.source_id = source_id
         item.tags = tags.encode('utf-8')[:127]
-        item.frequency = 0
-        self._lib.wc_add_item.argtypes = [c_void_p, POINTER(ItemEntry)]
-        self._lib.wc_add_item.restype = c_uint32
+        item.frequency = frequency
+        return item
+
+    def add_item(self, question, answer, explanation='', hint='',
+                 difficulty=1, category=1, source_id=0, tags=''):
+        item = self._fill_item(ItemEntry(), question, answer, explanation, hint,
+                               difficulty, category, source_id, tags)
         return self._lib.wc_add_item(self._handle, byref(item))
 
+    def add_items_bulk(self, items, chunk=4096):
+        """批量添加；items 为 add_item 参数的 dict 或元组。
+        返回与输入一一对应的 ID 列表，重复项为 0"""
+        ids = []
+        it = iter(items)
+        while True:
+            # 按块提交：每项约 2.4KB，避免整表一次性展开；缓冲区按本块实际条数分配
+            batch = list(itertools.islice(it, chunk))
+            if not batch:
+                break
+            n = len(batch)
+            buf = (ItemEntry * n)()
+            for i, spec in enumerate(batch):
+                if isinstance(spec, dict):
+                    self._fill_item(buf[i], **spec)
+                else:
+                    self._fill_item(buf[i], *spec)
+            out = (c_uint32 * n)()
+            rc = self._lib.wc_add_items_bulk(self._handle, buf, n, out)
+            if rc < 0:
+                raise RuntimeError(f'wc_add_items_bulk failed: {rc}')
+            ids.extend(out)
+            if n < chunk:
+                break
+        return ids
+
     def find_item(self, question=None, item_id=None):
+        # 库内为紧凑行 + 字符串堆，这里取回展开后的定长副本
+        out = ItemEntry()
         if question:
-            self._lib.wc_find_item_by_question.argtypes = [c_void_p, c_char_p]
-            self._lib.wc_find_item_by_question.restype = POINTER(ItemEntry)
-            p = self._lib.wc_find_item_by_question(self._handle,
-                                                    question.encode('utf-8'))
-            return p.contents if p else None
+            rc = self._lib.wc_get_item_by_question(self._handle,
+                                                   question.encode('utf-8'),
+                                                   byref(out))
+            return out if rc == 0 else None
         if item_id is not None:
-            self._lib.wc_find_item_by_id.argtypes = [c_void_p, c_uint32]
-            self._lib.wc_find_item_by_id.restype = POINTER(ItemEntry)
-            p = self._lib.wc_find_item_by_id(self._handle, item_id)
-            return p.contents if p else None
+            rc = self._lib.wc_get_item(self._handle, item_id, byref(out))
+            return out if rc == 0 else None
         return None
 
+    def item_frequencies(self, questions):
+        """已存词频：返回 (与 questions 对应的频次列表, 全库频次之和)，不存在的为 0"""
+        qs = [q.encode('utf-8') for q in questions]
+        n = len(qs)
+        arr = (c_char_p * n)(*qs)
+        out = (c_uint32 * n)()
+        total = c_uint64()
+        rc = self._lib.wc_item_frequencies(self._handle, arr, n, out, byref(total))
+        if rc < 0:
+            raise RuntimeError(f'wc_item_frequencies failed: {rc}')
+        return list(out), total.value
+
+    # ── 载体 ──────────────────────────────────────────────────
+
+    def add_source(self, name, file_path='', type=SOURCE_ARTICLE):
+        """新建载体，返回 ID；同名已存在时返回 0"""
+        src = ContentSource()
+        src.name = _utf8_cut(name.encode('utf-8'), 127)
+        src.file_path = _source_path_key(file_path)
+        src.type = type
+        src.created_at = self.now()
+        return self._lib.wc_add_source(self._handle, byref(src))
+
+    def find_source(self, source_id=None, file_path=None):
+        """返回载体行的副本（不受后续扩容影响）"""
+        out = ContentSource()
+        if file_path:
+            key = _source_path_key(file_path)
+            rc = self._lib.wc_get_source_by_path(self._handle, key, byref(out))
+            raw = file_path.encode('utf-8')
+            if rc != 0 and len(raw) > 255:
+                # 旧版按字节硬截断存的长路径
+                rc = self._lib.wc_get_source_by_path(self._handle, raw[:255], byref(out))
+        elif source_id is not None:
+            rc = self._lib.wc_get_source(self._handle, source_id, byref(out))
+        else:
+            return None
+        return out if rc == 0 else None
+
+    def update_source(self, src, page_hashes=None):
+        """按 src.id 覆盖载体行；page_hashes 为 None 时保留原页指纹"""
+        rc = self._lib.wc_update_source(
+            self._handle, byref(src),
+            page_hashes.encode('ascii') if page_hashes is not None else None)
+        if rc < 0:
+            raise RuntimeError(f'wc_update_source failed: {rc}')
+
+    def source_page_hashes(self, source_id):
+        n = c_size_t()
+        cap = 0
+        while True:
+            buf = ctypes.create_string_buffer(cap) if cap else None
+            rc = self._lib.wc_get_source_page_hashes(self._handle, source_id,
+                                                     buf, cap, byref(n))
+            if rc != WC_ERR_MEMORY:
+                break
+            cap = n.value + 1           # 两次调用之间可能被改写变长，按新长度重试
+        return buf.value.decode('ascii') if rc == 0 else ''
+
     # ── 用户 ──────────────────────────────────────────────────
 
     def create_user(self, dingtalk_uid, name=''):
-        self._lib.wc_create_user.argtypes = [c_void_p, c_char_p, c_char_p]
-        self._lib.wc_create_user.restype = c_uint32
         return self._lib.wc_create_user(self._handle,
                                          dingtalk_uid.encode('utf-8'),
                                          name.encode('utf-8'))
 
     def find_user(self, dingtalk_uid=None, user_id=None):
+        out = User()
         if dingtalk_uid:
-            self._lib.wc_find_user.argtypes = [c_void_p, c_char_p]
-            self._lib.wc_find_user.restype = POINTER(User)
-            p = self._lib.wc_find_user(self._handle,
-                                        dingtalk_uid.encode('utf-8'))
-            return p.contents if p else None
-        if user_id is not None:
-            self._lib.wc_find_user_by_id.argtypes = [c_void_p, c_uint32]
-            self._lib.wc_find_user_by_id.restype = POINTER(User)
-            p = self._lib.wc_find_user_by_id(self._handle, user_id)
-            return p.contents if p else None
-        return None
+            rc = self._lib.wc_get_user_by_uid(self._handle,
+                                              dingtalk_uid.encode('utf-8'), byref(out))
+        elif user_id is not None:
+            rc = self._lib.wc_get_user(self._handle, user_id, byref(out))
+        else:
+            return None
+        return out if rc == 0 else None
 
     # ── 掌握度 ────────────────────────────────────────────────
 
     def get_mastery(self, user_id, item_id):
-        self._lib.wc_find_mastery.argtypes = [c_void_p, c_uint32, c_uint32]
-        self._lib.wc_find_mastery.restype = POINTER(Mastery)
-        p = self._lib.wc_find_mastery(self._handle, user_id, item_id)
-        return p.contents if p else None
+        out = Mastery()
+        rc = self._lib.wc_get_mastery(self._handle, user_id, item_id, byref(out))
+        return out if rc == 0 else None
 
     def get_or_create_mastery(self, user_id, item_id):
-        self._lib.wc_get_or_create_mastery.argtypes = [c_void_p, c_uint32, c_uint32]
-        self._lib.wc_get_or_create_mastery.restype = POINTER(Mastery)
         p = self._lib.wc_get_or_create_mastery(self._handle, user_id, item_id)
         return p.contents if p else None
 
     def sm2_update(self, mastery, quality):
-        self._lib.wc_sm2_update.argtypes = [POINTER(Mastery), c_uint8]
-        self._lib.wc_sm2_update(mastery, quality)
+        # 同时增量调整该用户的到期堆
+        self._lib.wc_sm2_update_db(self._handle, mastery, quality)
+
+    def review(self, user_id, item_id, quality, time_spent=5):
+        """提交一次复习（建档 + SM-2 + 当日统计 + 写日志），返回掌握度副本"""
+        _check_review(user_id, item_id, quality, 0, time_spent)
+        out = Mastery()
+        ret = self._lib.wc_review(self._handle, user_id, item_id, quality,
+                                  time_spent, byref(out))
+        if ret == WC_ERR_NOT_FOUND:
+            raise LookupError(f'user {user_id} or item {item_id} not found')
+        if ret != 0:
+            raise ValueError(f'wc_review failed ({ret})')
+        return out
+
+    def review_batch(self, reviews):
+        """按顺序提交一批复习，一次 C 调用、日志一次写入。
+        reviews: (user_id, item_id, quality[, reviewed_at[, time_spent]]) 元组
+        或同名键的 dict。返回 [(rc, Mastery)]，rc 非 0 时该条未生效"""
+        reqs = _review_reqs(reviews)
+        n = len(reqs)
+        if n == 0:
+            return []
+        out = (Mastery * n)()
+        rcs = (c_int32 * n)()
+        ret = self._lib.wc_submit_reviews(self._handle, reqs, n, out, rcs)
+        if ret < 0:
+            raise ValueError(f'wc_submit_reviews failed ({ret})')
+        return list(zip(rcs, out))
+
+    def mastery_array(self):
+        """掌握度表的 NumPy 结构化数组副本；零拷贝读写用 wc_schedule.mastery_table"""
+        import wc_schedule
+        return wc_schedule.mastery_copy(self)
+
+    def sm2_update_many(self, user_ids, item_ids, qualities, now=None):
+        """向量化批量 SM-2（需要 NumPy，见 wc_schedule.sm2_update_many）"""
+        import wc_schedule
+        return wc_schedule.sm2_update_many(self, user_ids, item_ids, qualities, now)
 
     def update_dimension(self, mastery, dimension, correct, score=0):
-        self._lib.wc_update_mastery_dimension.argtypes = [
-            c_void_p, POINTER(Mastery), c_char, c_int, c_uint8]
         self._lib.wc_update_mastery_dimension(
             self._handle, mastery, dimension.encode('utf-8'),
             1 if correct else 0, score)
@@ -236,37 +640,82 @@ class WordCardDB:
         if now is None:
             now = int(__import__('time').time())
         ids = (c_uint32 * max_count)()
-        self._lib.wc_get_due_items.argtypes = [
-            c_void_p, c_uint32, c_uint32, POINTER(c_uint32), c_size_t]
-        self._lib.wc_get_due_items.restype = c_size_t
         n = self._lib.wc_get_due_items(self._handle, user_id, now, ids, max_count)
         return list(ids[:n])
 
     def get_new_items(self, user_id, source_id=0, max_count=20):
         ids = (c_uint32 * max_count)()
-        self._lib.wc_get_new_items.argtypes = [
-            c_void_p, c_uint32, c_uint32, POINTER(c_uint32), c_size_t]
-        self._lib.wc_get_new_items.restype = c_size_t
         n = self._lib.wc_get_new_items(self._handle, user_id, source_id, ids, max_count)
         return list(ids[:n])
 
+    def user_counts(self, user_id, now=None):
+        """到期/新项/学习中/已掌握计数（C 端计数器，不构建队列）"""
+        if now is None:
+            now = int(__import__('time').time())
+        out = UserCounts()
+        ret = self._lib.wc_get_user_counts(self._handle, user_id, now, byref(out))
+        if ret != 0:
+            raise RuntimeError(f'wc_get_user_counts failed ({ret})')
+        return {name: getattr(out, name) for name, _ in UserCounts._fields_}
+
+    def forecast(self, user_id, days=30, now=None):
+        """未来 days 天每天到期的复习数；[0] 含已过期与今天到期"""
+        if now is None:
+            now = int(__import__('time').time())
+        counts = (c_uint32 * days)()
+        ret = self._lib.wc_forecast(self._handle, user_id, now, days, counts)
+        if ret != 0:
+            raise ValueError(f'wc_forecast failed ({ret})')
+        return list(counts)
+
+    def day_ends(self, now, days):
+        """从 now 所在的本地自然日起 days 天，每天最后一秒的时间戳（与 forecast 分桶一致）"""
+        ends = (c_uint32 * days)()
+        ret = self._lib.wc_day_ends(now, days, ends)
+        if ret != 0:
+            raise ValueError(f'wc_day_ends failed ({ret})')
+        return list(ends)
+
     def daily_queue(self, user_id, now=None, max_count=50):
         if now is None:
             now = int(__import__('time').time())
         ids = (c_uint32 * max_count)()
         modes = (c_uint8 * max_count)()
-        self._lib.wc_generate_daily_queue.argtypes = [
-            c_void_p, c_uint32, c_uint32,
-            POINTER(c_uint32), POINTER(c_uint8), c_size_t]
-        self._lib.wc_generate_daily_queue.restype = c_size_t
         n = self._lib.wc_generate_daily_queue(self._handle, user_id, now,
                                                ids, modes, max_count)
         return [(ids[i], modes[i]) for i in range(n)]
 
+    def daily_queue_items(self, user_id, now=None, max_count=50, fields=('question',)):
+        """daily_queue 连同 fields（取自 QUEUE_FIELDS）一次 C 调用取回，返回 QueueItem 列表。
+        文本打包在一块缓冲区里，预估不足时按 C 端报告的大小重试一次"""
+        mask, order = _queue_mask(fields)
+        return _queue_items(*self.daily_queue_packed(user_id, now, max_count, mask),
+                            order)
+
+    def daily_queue_packed(self, user_id, now, max_count, mask):
+        """daily_queue_items 的原始结果：(ids, modes, offsets, 打包文本 bytes)"""
+        if now is None:
+            now = int(__import__('time').time())
+        nf = bin(mask).count('1')
+        ids = (c_uint32 * max_count)()
+        modes = (c_uint8 * max_count)()
+        offs = (c_uint32 * (max_count * nf + 1))()
+        used = c_size_t()
+        cap = max_count * nf * 64
+        while True:
+            buf = (c_char * max(cap, 1))()
+            n = self._lib.wc_daily_queue_items(self._handle, user_id, now, mask,
+                                               ids, modes, offs, buf, cap,
+                                               byref(used), max_count)
+            if used.value <= cap:
+                break
+            cap = used.value
+        return (ids[:n], modes[:n], offs[:n * nf + 1],
+                ctypes.string_at(buf, used.value))
+
     # ── 统计 ──────────────────────────────────────────────────
 
     def record_activity(self, user_id, is_new, is_correct, time_spent=0):
-        self._lib.wc_record_activity.argtypes = [c_void_p, c_uint32, c_int, c_int, c_uint32]
         self._lib.wc_record_activity(self._handle, user_id,
                                      1 if is_new else 0,
                                      1 if is_correct else 0,
@@ -283,3 +732,80 @@ class WordCardDB:
         import time
         t = time.localtime()
         return t.tm_year * 10000 + t.tm_mon * 100 + t.tm_mday
+
+
+# ── 后台组提交 ────────────────────────────────────────────────
+
+class WriteBehind:
+    """写回缓冲：修改只调用 touch() 计数，后台线程每攒满一个窗口
+    （interval 秒或 max_pending 次修改，先到为准）调用一次 db.commit()。
+
+    崩溃时最多丢失一个窗口的修改；close() 会同步刷完剩余修改。
+    """
+
+    def __init__(self, db, interval=0.2, max_pending=256):
+        self.db = db
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self.last_error = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='wc-flusher',
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def touch(self, n=1):
+        with self._cond:
+            self._pending += n
+            if self._pending == n or self._pending >= self.max_pending:
+                self._cond.notify()
+
+    def flush(self):
+        """立即同步落盘"""
+        with self._cond:
+            self._pending = 0
+        self._commit()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _commit(self):
+        ret = self.db.commit()
+        if ret != 0:
+            self.last_error = ret
+        return ret
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # 窗口：从第一次修改起最多等待 interval 秒
+                deadline = time.monotonic() + self.interval
+                while (self._pending < self.max_pending and not self._closed):
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                self._pending = 0
+            self._commit()
@@ -0,0 +1,569 @@
+"""单写者引擎服务 — 一个进程独占数据库，API worker 经 Unix 套接字调用
+
+多个 uvicorn worker 各自打开 wordcard.db 时，每个进程都有一份私有内存库，
+落盘时互相覆盖。多 worker 部署时由本服务独占数据库（加载、预写日志、组提交都在这里），
+API 进程设置 WORDCARD_ENGINE_SOCKET 后改用 RemoteDB，HTTP 与 JSON 的开销分散到各 worker。
+
+协议：请求帧 <负载长度 u32><操作码 u8><参数>，响应帧 <负载长度 u32><状态 u8><结果>，
+同一连接上一问一答。仅限同机通信，一律本机字节序：标量用 struct 定长编码，
+字符串为 <长度 u32> + UTF-8，C 结构体（用户、载体、掌握度、复习请求）按原始字节传输。
+
+用法: python engine_service.py [--db data/wordcard.db] [--socket data/wordcard.sock]
+"""
+
+import argparse, collections, json, os, signal, socket, socketserver, struct, sys, threading, time
+from ctypes import byref, c_int32, c_uint32, sizeof
+
+sys.path.insert(0, os.path.dirname(__file__) or '.')
+import engine
+from engine import ContentSource, ItemEntry, Mastery, ReviewReq, User, UserCounts
+
+DB_PATH = os.environ.get('WORDCARD_DB', 'data/wordcard.db')
+SOCKET_PATH = os.environ.get('WORDCARD_ENGINE_SOCKET', 'data/wordcard.sock')
+MAX_FRAME = 64 << 20           # 单帧上限，超出视为协议错误并断开
+MAX_JOBS = 256                 # 保留的已结束导入任务数
+
+# ── 协议 ───────────────────────────────────────────────────
+
+_REQ = struct.Struct('=IB')            # 负载长度, 操作码
+_RESP = struct.Struct('=IB')           # 负载长度, 状态
+_U32 = struct.Struct('=I')
+_REVIEW = struct.Struct('=IIBI')       # user_id, item_id, quality, time_spent
+_ITEM = struct.Struct('=IBIII')        # id, difficulty, source_id, category, frequency
+_ITEM_TEXT = ('question', 'answer', 'explanation', 'hint', 'tags')
+_COUNTS = [name for name, _ in UserCounts._fields_]
+
+OK, ERR_VALUE, ERR_RUNTIME, ERR_LOOKUP = 0, 1, 2, 3
+_ERRORS = {ERR_VALUE: ValueError, ERR_RUNTIME: RuntimeError, ERR_LOOKUP: LookupError}
+
+(OP_PING, OP_CREATE_USER, OP_FIND_USER, OP_ADD_ITEM, OP_ADD_ITEMS, OP_FIND_ITEM,
+ OP_ITEM_FREQ, OP_ADD_SOURCE, OP_FIND_SOURCE, OP_UPDATE_SOURCE, OP_PAGE_HASHES,
+ OP_REVIEW, OP_REVIEW_BATCH, OP_QUEUE, OP_COUNTS, OP_FORECAST, OP_COMMIT,
+ OP_PUT_JOB, OP_GET_JOB) = range(19)
+
+# 按 id / 按字符串键查找
+BY_ID, BY_KEY = 0, 1
+
+def _pack_str(s):
+    b = s if isinstance(s, bytes) else s.encode('utf-8')
+    return _U32.pack(len(b)) + b
+
+def _unpack_str(buf, pos):
+    """→ (bytes, 下一字段位置)"""
+    n, = _U32.unpack_from(buf, pos)
+    pos += _U32.size
+    return bytes(buf[pos:pos + n]), pos + n
+
+def _pack_key(key_id, key):
+    return bytes([BY_KEY]) + _pack_str(key) if key else bytes([BY_ID]) + _U32.pack(key_id)
+
+def _unpack_key(buf):
+    """→ (id, None) 或 (None, str)"""
+    if buf[0] == BY_ID:
+        return _U32.unpack_from(buf, 1)[0], None
+    return None, _unpack_str(buf, 1)[0].decode('utf-8')
+
+def _pack_item(item):
+    # 定长 ItemEntry 约 2.4KB，大半是填充；文本按实际长度传
+    return (_ITEM.pack(item.id, item.difficulty, item.source_id, item.category,
+                       item.frequency)
+            + b''.join(_pack_str(getattr(item, f)) for f in _ITEM_TEXT))
+
+def _unpack_item(buf, pos=0, item=None):
+    """→ (ItemEntry, 下一项位置)；item 给定时就地填充"""
+    if item is None:
+        item = ItemEntry()
+    (item.id, item.difficulty, item.source_id, item.category,
+     item.frequency) = _ITEM.unpack_from(buf, pos)
+    pos += _ITEM.size
+    for f in _ITEM_TEXT:
+        val, pos = _unpack_str(buf, pos)
+        setattr(item, f, val)
+    return item, pos
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while view:
+        k = sock.recv_into(view)
+        if not k:
+            raise ConnectionError('engine service connection closed')
+        view = view[k:]
+    return buf
+
+# ── 服务端 ─────────────────────────────────────────────────
+
+class EngineService:
+    """把请求落到同一个 WordCardDB 上执行。每个连接一个线程：
+    复习/查询直接进 C 引擎（读写锁 + 用户分片锁下并行），
+    返回 C 数组内指针的用户/载体操作在 db.lock 内完成并拷出；写入由 WriteBehind 组提交"""
+
+    def __init__(self, db, flusher, keep_jobs=MAX_JOBS):
+        self.db = db
+        self.flusher = flusher
+        self.keep_jobs = keep_jobs
+        self._jobs = collections.OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._handlers = {
+            OP_PING: lambda p: b'',
+            OP_CREATE_USER: self._create_user,
+            OP_FIND_USER: self._find_user,
+            OP_ADD_ITEM: self._add_item,
+            OP_ADD_ITEMS: self._add_items,
+            OP_FIND_ITEM: self._find_item,
+            OP_ITEM_FREQ: self._item_freq,
+            OP_ADD_SOURCE: self._add_source,
+            OP_FIND_SOURCE: self._find_source,
+            OP_UPDATE_SOURCE: self._update_source,
+            OP_PAGE_HASHES: self._page_hashes,
+            OP_REVIEW: self._review,
+            OP_REVIEW_BATCH: self._review_batch,
+            OP_QUEUE: self._queue,
+            OP_COUNTS: self._counts,
+            OP_FORECAST: self._forecast,
+            OP_COMMIT: self._commit,
+            OP_PUT_JOB: self._put_job,
+            OP_GET_JOB: self._get_job,
+        }
+
+    def handle(self, op, payload):
+        """执行一次请求，返回 (状态, 结果 bytes)"""
+        fn = self._handlers.get(op)
+        if fn is None:
+            return ERR_RUNTIME, f'unknown op {op}'.encode('utf-8')
+        try:
+            return OK, fn(payload)
+        except ValueError as e:
+            return ERR_VALUE, str(e).encode('utf-8')
+        except LookupError as e:
+            return ERR_LOOKUP, str(e).encode('utf-8')
+        except Exception as e:
+            return ERR_RUNTIME, f'{type(e).__name__}: {e}'.encode('utf-8')
+
+    # 用户
+
+    def _create_user(self, p):
+        uid, pos = _unpack_str(p, 0)
+        name, _ = _unpack_str(p, pos)
+        with self.db.lock:
+            user_id = self.db.create_user(uid.decode('utf-8'), name.decode('utf-8'))
+        if user_id:
+            self.flusher.touch()
+        return _U32.pack(user_id)
+
+    def _find_user(self, p):
+        user_id, uid = _unpack_key(p)
+        with self.db.lock:
+            u = self.db.find_user(dingtalk_uid=uid, user_id=user_id)
+            return bytes(u) if u else b''
+
+    # 学习项
+
+    def _add_item(self, p):
+        item, _ = _unpack_item(p)
+        item_id = self.db._lib.wc_add_item(self.db._handle, byref(item))
+        if item_id:
+            self.flusher.touch()
+        return _U32.pack(item_id)
+
+    def _add_items(self, p):
+        n, = _U32.unpack_from(p, 0)
+        items = (ItemEntry * n)()
+        pos = _U32.size
+        for i in range(n):
+            _, pos = _unpack_item(p, pos, items[i])
+        out = (c_uint32 * n)()
+        rc = self.db._lib.wc_add_items_bulk(self.db._handle, items, n, out)
+        if rc < 0:
+            raise RuntimeError(f'wc_add_items_bulk failed: {rc}')
+        added = sum(1 for i in out if i)
+        if added:
+            self.flusher.touch(added)
+        return bytes(out)
+
+    def _find_item(self, p):
+        item_id, question = _unpack_key(p)
+        item = self.db.find_item(question=question, item_id=item_id)
+        return _pack_item(item) if item else b''
+
+    def _item_freq(self, p):
+        n, = _U32.unpack_from(p, 0)
+        pos, qs = _U32.size, []
+        for _ in range(n):
+            q, pos = _unpack_str(p, pos)
+            qs.append(q.decode('utf-8'))
+        freqs, total = self.db.item_frequencies(qs)
+        return struct.pack(f'={n}IQ', *freqs, total)
+
+    # 载体
+
+    def _add_source(self, p):
+        name, pos = _unpack_str(p, 0)
+        path, pos = _unpack_str(p, pos)
+        type_, = _U32.unpack_from(p, pos)
+        with self.db.lock:
+            sid = self.db.add_source(name.decode('utf-8'), path.decode('utf-8'), type_)
+        if sid:
+            self.flusher.touch()
+        return _U32.pack(sid)
+
+    def _find_source(self, p):
+        source_id, path = _unpack_key(p)
+        with self.db.lock:
+            src = self.db.find_source(source_id=source_id, file_path=path)
+        return bytes(src) if src else b''
+
+    def _update_source(self, p):
+        size = sizeof(ContentSource)
+        src = ContentSource.from_buffer_copy(p[:size])
+        hashes = _unpack_str(p, size + 1)[0].decode('ascii') if p[size] else None
+        with self.db.lock:
+            self.db.update_source(src, hashes)
+        self.flusher.touch()
+        return b''
+
+    def _page_hashes(self, p):
+        with self.db.lock:
+            return self.db.source_page_hashes(_U32.unpack(p)[0]).encode('ascii')
+
+    # 复习 / 队列
+
+    def _review(self, p):
+        m = self.db.review(*_REVIEW.unpack(p))
+        self.flusher.touch()
+        return bytes(m)
+
+    def _review_batch(self, p):
+        n = len(p) // sizeof(ReviewReq)
+        reqs = (ReviewReq * n).from_buffer_copy(p)
+        out = (Mastery * n)()
+        rcs = (c_int32 * n)()
+        ret = self.db._lib.wc_submit_reviews(self.db._handle, reqs, n, out, rcs)
+        if ret < 0:
+            raise ValueError(f'wc_submit_reviews failed ({ret})')
+        applied = sum(1 for rc in rcs if rc == 0)
+        if applied:
+            self.flusher.touch(applied)
+        return bytes(rcs) + bytes(out)
+
+    def _queue(self, p):
+        user_id, now, max_count, mask = struct.unpack('=IIII', p)
+        ids, modes, offs, raw = self.db.daily_queue_packed(user_id, now, max_count, mask)
+        n = len(ids)
+        return (struct.pack(f'=I{n}I{n}B{len(offs)}I', n, *ids, *modes, *offs) + raw)
+
+    def _counts(self, p):
+        c = self.db.user_counts(*struct.unpack('=II', p))
+        return struct.pack(f'={len(_COUNTS)}I', *(c[k] for k in _COUNTS))
+
+    def _forecast(self, p):
+        user_id, now, days = struct.unpack('=III', p)
+        counts = self.db.forecast(user_id, days, now)
+        return struct.pack(f'={len(counts)}I', *counts)
+
+    def _commit(self, p):
+        return struct.pack('=i', self.db.commit())
+
+    # 导入任务：API worker 各自执行导入，状态集中存在这里，任一 worker 都能查到
+
+    def _put_job(self, p):
+        job = json.loads(bytes(p))
+        with self._jobs_lock:
+            self._jobs[job['job_id']] = job
+            self._jobs.move_to_end(job['job_id'])
+            extra = len(self._jobs) - self.keep_jobs
+            for job_id in [k for k, j in self._jobs.items()
+                           if j['status'] in ('done', 'failed')][:max(extra, 0)]:
+                del self._jobs[job_id]
+        return b''
+
+    def _get_job(self, p):
+        with self._jobs_lock:
+            job = self._jobs.get(bytes(p).decode('utf-8'))
+            return json.dumps(job).encode('utf-8') if job else b''
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock, service = self.request, self.server.service
+        with self.server.conns_lock:
+            self.server.conns.add(sock)
+        try:
+            while True:
+                n, op = _REQ.unpack(_recv_exact(sock, _REQ.size))
+                if n > MAX_FRAME:
+                    return
+                status, out = service.handle(op, _recv_exact(sock, n))
+                sock.sendall(_RESP.pack(len(out), status) + out)
+        except OSError:
+            pass                # 对端断开，或关闭服务时被 shutdown 唤醒
+        finally:
+            with self.server.conns_lock:
+                self.server.conns.discard(sock)
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # 关闭时先断开全部连接再等处理线程退出，之后才能释放数据库
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, path, service):
+        self.service = service
+        self.conns = set()
+        self.conns_lock = threading.Lock()
+        super().__init__(path, _Handler)
+
+    def close_connections(self):
+        with self.conns_lock:
+            for sock in self.conns:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+def _socket_alive(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+def serve(db_path=DB_PATH, sock_path=SOCKET_PATH, mmap=False,
+          flush_interval=0.2, flush_max_pending=256):
+    """加载数据库并在 sock_path 上服务，直到 SIGINT/SIGTERM；退出前刷盘"""
+    db = engine.WordCardDB.open(db_path, mmap=mmap)   # 独占库文件锁，close() 释放
+    if os.path.exists(sock_path):
+        if _socket_alive(sock_path):
+            db.close()
+            raise RuntimeError(f'engine service already listening on {sock_path}')
+        os.unlink(sock_path)            # 上次异常退出留下的
+    flusher = engine.WriteBehind(db, flush_interval, flush_max_pending).start()
+    server = _Server(sock_path, EngineService(db, flusher))
+    stop = lambda *_: threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f'WordCard engine on {sock_path} ({db_path})', flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.close_connections()
+        server.server_close()
+        os.unlink(sock_path)
+        flusher.close()
+        db.close()
+
+# ── 客户端 ─────────────────────────────────────────────────
+
+class RemoteDB:
+    """WordCardDB 的远程替身：API 与导入用到的方法同名、同返回类型，调用转发给引擎服务。
+    连接按需建立，空闲后放回池里复用，并发调用各用一条。
+    lock 只在本进程内互斥；单个调用在服务端是原子的，跨进程的组合操作不是"""
+
+    now = staticmethod(engine.WordCardDB.now)
+    today = staticmethod(engine.WordCardDB.today)
+
+    def __init__(self, path=SOCKET_PATH, timeout=10.0):
+        self.path = path
+        self.lock = threading.RLock()
+        self._idle = []
+        # 与引擎服务同时启动时等它就绪
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._call(OP_PING)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _call(self, op, payload=b''):
+        try:
+            sock = self._idle.pop()
+        except IndexError:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+        try:
+            sock.sendall(_REQ.pack(len(payload), op) + payload)
+            n, status = _RESP.unpack(_recv_exact(sock, _RESP.size))
+            out = _recv_exact(sock, n)
+        except BaseException:
+            sock.close()                # 帧可能只读了一半，连接不再复用
+            raise
+        self._idle.append(sock)
+        if status != OK:
+            raise _ERRORS.get(status, RuntimeError)(out.decode('utf-8', 'replace'))
+        return out
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    def save(self, path=None):
+        """落盘由引擎服务负责，这里请求一次同步组提交"""
+        return self.commit()
+
+    def commit(self, compact_bytes=0):
+        return struct.unpack('=i', self._call(OP_COMMIT))[0]
+
+    # 用户
+
+    def create_user(self, dingtalk_uid, name=''):
+        return _U32.unpack(self._call(OP_CREATE_USER,
+                                      _pack_str(dingtalk_uid) + _pack_str(name)))[0]
+
+    def find_user(self, dingtalk_uid=None, user_id=None):
+        if not dingtalk_uid and user_id is None:
+            return None
+        out = self._call(OP_FIND_USER, _pack_key(user_id, dingtalk_uid))
+        return User.from_buffer_copy(out) if out else None
+
+    # 学习项
+
+    def add_item(self, question, answer, explanation='', hint='',
+                 difficulty=1, category=1, source_id=0, tags=''):
+        item = engine.WordCardDB._fill_item(ItemEntry(), question, answer, explanation,
+                                            hint, difficulty, category, source_id, tags)
+        return _U32.unpack(self._call(OP_ADD_ITEM, _pack_item(item)))[0]
+
+    def add_items_bulk(self, items, chunk=4096):
+        ids = []
+        it = iter(items)
+        while True:
+            parts = []
+            for spec in it:
+                item = ItemEntry()
+                if isinstance(spec, dict):
+                    engine.WordCardDB._fill_item(item, **spec)
+                else:
+                    engine.WordCardDB._fill_item(item, *spec)
+                parts.append(_pack_item(item))
+                if len(parts) == chunk:
+                    break
+            if not parts:
+                break
+            out = self._call(OP_ADD_ITEMS, _U32.pack(len(parts)) + b''.join(parts))
+            ids.extend(struct.unpack(f'={len(parts)}I', out))
+            if len(parts) < chunk:
+                break
+        return ids
+
+    def find_item(self, question=None, item_id=None):
+        if not question and item_id is None:
+            return None
+        out = self._call(OP_FIND_ITEM, _pack_key(item_id, question))
+        return _unpack_item(out)[0] if out else None
+
+    def item_frequencies(self, questions):
+        qs = list(questions)
+        out = self._call(OP_ITEM_FREQ,
+                         _U32.pack(len(qs)) + b''.join(_pack_str(q) for q in qs))
+        vals = struct.unpack(f'={len(qs)}IQ', out)
+        return list(vals[:-1]), vals[-1]
+
+    # 载体
+
+    def add_source(self, name, file_path='', type=engine.SOURCE_ARTICLE):
+        return _U32.unpack(self._call(OP_ADD_SOURCE, _pack_str(name) + _pack_str(file_path)
+                                      + _U32.pack(type)))[0]
+
+    def find_source(self, source_id=None, file_path=None):
+        if not file_path and source_id is None:
+            return None
+        out = self._call(OP_FIND_SOURCE, _pack_key(source_id, file_path))
+        return ContentSource.from_buffer_copy(out) if out else None
+
+    def update_source(self, src, page_hashes=None):
+        tail = (b'\x01' + _pack_str(page_hashes)) if page_hashes is not None else b'\x00'
+        self._call(OP_UPDATE_SOURCE, bytes(src) + tail)
+
+    def source_page_hashes(self, source_id):
+        return self._call(OP_PAGE_HASHES, _U32.pack(source_id)).decode('ascii')
+
+    # 复习 / 队列
+
+    def review(self, user_id, item_id, quality, time_spent=5):
+        engine._check_review(user_id, item_id, quality, 0, time_spent)
+        out = self._call(OP_REVIEW, _REVIEW.pack(user_id, item_id, quality, time_spent))
+        return Mastery.from_buffer_copy(out)
+
+    def review_batch(self, reviews):
+        reqs = engine._review_reqs(reviews)
+        n = len(reqs)
+        if n == 0:
+            return []
+        out = self._call(OP_REVIEW_BATCH, bytes(reqs))
+        rcs = (c_int32 * n).from_buffer_copy(out)
+        ms = (Mastery * n).from_buffer_copy(out, sizeof(rcs))
+        return list(zip(rcs, ms))
+
+    def daily_queue_items(self, user_id, now=None, max_count=50, fields=('question',)):
+        if now is None:
+            now = self.now()
+        mask, order = engine._queue_mask(fields)
+        out = self._call(OP_QUEUE, struct.pack('=IIII', user_id, now, max_count, mask))
+        n, = _U32.unpack_from(out, 0)
+        m = n * len(order) + 1
+        fmt = struct.Struct(f'={n}I{n}B{m}I')
+        vals = fmt.unpack_from(out, _U32.size)
+        return engine._queue_items(vals[:n], vals[n:2 * n], vals[2 * n:],
+                                   bytes(out[_U32.size + fmt.size:]), order)
+
+    def user_counts(self, user_id, now=None):
+        if now is None:
+            now = self.now()
+        out = self._call(OP_COUNTS, struct.pack('=II', user_id, now))
+        return dict(zip(_COUNTS, struct.unpack(f'={len(_COUNTS)}I', out)))
+
+    def forecast(self, user_id, days=30, now=None):
+        if now is None:
+            now = self.now()
+        out = self._call(OP_FORECAST, struct.pack('=III', user_id, now, days))
+        return list(struct.unpack(f'={len(out) // 4}I', out))
+
+    # 导入任务状态
+
+    def put_job(self, job):
+        self._call(OP_PUT_JOB, json.dumps(job).encode('utf-8'))
+
+    def get_job(self, job_id):
+        out = self._call(OP_GET_JOB, job_id.encode('utf-8'))
+        return json.loads(bytes(out)) if out else None
+
+class RemoteFlusher:
+    """API 侧的 WriteBehind 替身：组提交由引擎服务完成，touch() 无需做事"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def touch(self, n=1):
+        pass
+
+    def flush(self):
+        self.db.commit()
+
+    def close(self):
+        pass
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--db', default=DB_PATH)
+    ap.add_argument('--socket', default=SOCKET_PATH)
+    ap.add_argument('--mmap', action='store_true', help='以只读映射方式打开快照')
+    ap.add_argument('--flush-ms', type=int,
+                    default=int(os.environ.get('WORDCARD_FLUSH_MS', '200')))
+    ap.add_argument('--flush-n', type=int,
+                    default=int(os.environ.get('WORDCARD_FLUSH_N', '256')))
+    args = ap.parse_args()
+    try:
+        serve(args.db, args.socket, args.mmap, args.flush_ms / 1000.0, args.flush_n)
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+if __name__ == '__main__':
+    main()
@@ -78,14 +78,29 @@ static int l_wc_create_user(lua_State *L) {
     return 1;
 }
 
-/* wc_sm2_update(mastery, quality) */
-static int l_wc_sm2_update(lua_State *L) {
-    user_item_mastery_t *m = (user_item_mastery_t *)lua_touserdata(L, 1);
-    int quality = (int)luaL_checkinteger(L, 2);
-    wc_sm2_update(m, quality);
+/* wc_sm2_update_db(db, mastery, quality)
+ * 经引擎更新：同步维护该用户的到期堆与计数，裸 wc_sm2_update 会让它们过期 */
+static int l_wc_sm2_update_db(lua_State *L) {
+    wordcard_db_t *db = (wordcard_db_t *)lua_touserdata(L, 1);
+    user_item_mastery_t *m = (user_item_mastery_t *)lua_touserdata(L, 2);
+    lua_Integer quality = luaL_checkinteger(L, 3);
+    luaL_argcheck(L, quality >= 0 && quality <= 5, 3, "quality must be 0-5");
+    wc_sm2_update_db(db, m, (uint8_t)quality);
     return 0;
 }
 
+/* wc_review(db, user_id, item_id, quality, time_spent) → rc（0 成功，负数为错误码） */
+static int l_wc_review(lua_State *L) {
+    wordcard_db_t *db = (wordcard_db_t *)lua_touserdata(L, 1);
+    uint32_t uid = (uint32_t)luaL_checkinteger(L, 2);
+    uint32_t iid = (uint32_t)luaL_checkinteger(L, 3);
+    lua_Integer quality = luaL_checkinteger(L, 4);
+    luaL_argcheck(L, quality >= 0 && quality <= 5, 4, "quality must be 0-5");
+    uint32_t spent = (uint32_t)luaL_optinteger(L, 5, 0);
+    lua_pushinteger(L, wc_review(db, uid, iid, (uint8_t)quality, spent, NULL));
+    return 1;
+}
+
 /* wc_get_or_create_mastery(db, user_id, item_id) → userdata | nil */
 static int l_wc_get_or_create_mastery(lua_State *L) {
     wordcard_db_t *db = (wordcard_db_t *)lua_touserdata(L, 1);
@@ -158,7 +173,8 @@ static const luaL_Reg wordcard_lib[] = {
     {"wc_db_free", l_wc_db_free},
     {"wc_add_item", l_wc_add_item},
     {"wc_create_user", l_wc_create_user},
-    {"wc_sm2_update", l_wc_sm2_update},
+    {"wc_sm2_update_db", l_wc_sm2_update_db},
+    {"wc_review", l_wc_review},
     {"wc_get_or_create_mastery", l_wc_get_or_create_mastery},
     {"wc_now", l_wc_now},
     {"wc_today", l_wc_today},
@@ -1,6 +1,10 @@
 """电子书导入 — PDF / MOBI / MD → 提取词汇 → wordcard.db"""
 
-import os, re, sys, time, json
+import base64, codecs, collections, ctypes, hashlib, heapq, math, multiprocessing
+import os, re, sys, threading, time, json, zlib
+from ctypes import POINTER, byref, c_char, c_char_p, c_int, c_size_t, c_void_p
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                wait)
 from pathlib import Path
 
 sys.path.insert(0, os.path.dirname(__file__) or '.')
@@ -19,7 +23,10 @@ because until while i you he she it we they me him his her its our your
 them their this that these those what which who whom am
 """.split())
 
-# ── 导入路径 ────────────────────────────────────────────────
+# ── 解析库 ────────────────────────────────────────────────
+#
+# libmobiparse.so / libpdfparse.so 按需加载，进程内只加载一次、原型只声明一次；
+# 批量导入成千上万个小文件时不再反复 dlopen 和重设 argtypes。
 
 def _find_lib(name):
     d = os.path.dirname(os.path.abspath(__file__))
@@ -31,23 +38,95 @@ def _find_lib(name):
             return p
     return None
 
-# ── 文本提取 ────────────────────────────────────────────────
+_MOBI_PROTOTYPES = {
+    'mobi_open':          (c_void_p, [c_char_p]),
+    'mobi_extract_text':  (c_int, [c_void_p, POINTER(c_void_p), POINTER(c_size_t)]),
+    'mobi_get_metadata':  (c_int, [c_void_p, c_char_p, c_size_t, c_char_p, c_size_t]),
+    'mobi_close':         (None, [c_void_p]),
+}
 
-def extract_mobi(path):
-    lib = _find_lib('libmobiparse.so')
-    if not lib:
+_PDF_PROTOTYPES = {
+    'pdf_open':           (c_void_p, [c_char_p]),
+    'pdf_get_page_count': (c_int, [c_void_p]),
+    'pdf_extract_range':  (c_int, [c_void_p, c_int, c_int, POINTER(c_void_p), POINTER(c_size_t)]),
+    'pdf_free_range_text': (None, [c_void_p]),
+    'pdf_close':          (None, [c_void_p]),
+}
+
+_libs = {}
+_libs_lock = threading.Lock()
+
+def _load_lib(name, prototypes):
+    """加载并绑定解析库（进程内单例）；未编译时返回 None，编译后下次调用即可加载"""
+    lib = _libs.get(name)
+    if lib:
+        return lib
+    path = _find_lib(name)
+    if not path:
+        return None
+    with _libs_lock:
+        lib = _libs.get(name)
+        if not lib:
+            lib = ctypes.CDLL(path)
+            for fn, (restype, argtypes) in prototypes.items():
+                f = getattr(lib, fn)
+                f.restype = restype
+                f.argtypes = argtypes
+            _libs[name] = lib
+    return lib
+
+def _open_mobilib():
+    cdll = _load_lib('libmobiparse.so', _MOBI_PROTOTYPES)
+    if not cdll:
         raise RuntimeError('libmobiparse.so not built; run: cd importer/wrappers && make')
-    ctypes = __import__('ctypes')
-    cdll = ctypes.CDLL(lib)
-    cdll.mobi_open.argtypes = [ctypes.c_char_p]
-    cdll.mobi_open.restype = ctypes.c_void_p
-    cdll.mobi_extract_text.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_size_t)]
-    cdll.mobi_extract_text.restype = ctypes.c_int
-    cdll.mobi_get_metadata.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p, ctypes.c_size_t]
-    cdll.mobi_get_metadata.restype = ctypes.c_int
-    cdll.mobi_close.argtypes = [ctypes.c_void_p]
-    cdll.mobi_close.restype = None
+    return cdll
+
+def _open_pdflib():
+    return _load_lib('libpdfparse.so', _PDF_PROTOTYPES)
+
+def _c_view(addr, size):
+    """C 缓冲区上的只读零拷贝视图。按 text_len 取长度，内嵌 NUL 不会截断；
+    仅在缓冲区释放前有效，调用方须在 free/close 之前解码完"""
+    return memoryview((c_char * size).from_address(addr)).cast('B').toreadonly()
+
+_deps = {}
 
+def _dep(name):
+    """可选依赖（fitz / requests）按需导入一次；未安装时返回 None"""
+    if name not in _deps:
+        try:
+            _deps[name] = __import__(name)
+        except ImportError:
+            _deps[name] = None
+    return _deps[name]
+
+# ── 文本提取 ────────────────────────────────────────────────
+#
+# stream_*(path) 返回 {'title', 'author', 'chunks'}，chunks 为文本块生成器：
+# 文件句柄在生成器内部打开、耗尽或 close() 时释放；MOBI 的书名/作者
+# 在开始迭代后才填入。extract_*(path) 为整本读入的便捷封装。
+
+CHUNK_CHARS = 64 * 1024
+
+def _iter_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(CHUNK_CHARS)
+            if not chunk:
+                return
+            yield chunk
+
+def _iter_buffer(view):
+    """按块增量解码 C 端 UTF-8 缓冲区视图，不整体拷贝"""
+    dec = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for off in range(0, len(view), CHUNK_CHARS):
+        yield dec.decode(view[off:off + CHUNK_CHARS])
+    tail = dec.decode(b'', final=True)
+    if tail:
+        yield tail
+
+def _mobi_chunks(path, info):
+    cdll = _open_mobilib()
     h = cdll.mobi_open(path.encode('utf-8'))
     if not h:
         raise RuntimeError(f'Cannot open MOBI: {path}')
@@ -55,98 +134,393 @@ def extract_mobi(path):
         title = ctypes.create_string_buffer(256)
         author = ctypes.create_string_buffer(256)
         cdll.mobi_get_metadata(h, title, 256, author, 256)
-        text_p = ctypes.c_char_p()
-        text_len = ctypes.c_size_t()
-        cdll.mobi_extract_text(h, ctypes.byref(text_p), ctypes.byref(text_len))
-        text = text_p.value.decode('utf-8', errors='replace') if text_p.value else ''
-        return {
-            'title': title.value.decode('utf-8', errors='replace') if title.value else Path(path).stem,
-            'author': author.value.decode('utf-8', errors='replace') if author.value else '',
-            'text': text,
-        }
+        if title.value:
+            info['title'] = title.value.decode('utf-8', errors='replace')
+        if author.value:
+            info['author'] = author.value.decode('utf-8', errors='replace')
+        text_p = c_void_p()
+        text_len = c_size_t()
+        cdll.mobi_extract_text(h, byref(text_p), byref(text_len))
+        if text_p.value and text_len.value:
+            # 文本缓冲区归句柄所有，mobi_close 之前逐块解码完
+            yield from _iter_buffer(_c_view(text_p.value, text_len.value))
     finally:
         cdll.mobi_close(h)
 
-def extract_pdf(path):
-    lib = _find_lib('libpdfparse.so')
-    if lib:
-        ctypes = __import__('ctypes')
-        cdll = ctypes.CDLL(lib)
-        cdll.pdf_open.argtypes = [ctypes.c_char_p]
-        cdll.pdf_open.restype = ctypes.c_void_p
-        cdll.pdf_extract_text.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_size_t)]
-        cdll.pdf_extract_text.restype = ctypes.c_int
-        cdll.pdf_close.argtypes = [ctypes.c_void_p]
-        cdll.pdf_close.restype = None
-        h = cdll.pdf_open(path.encode('utf-8'))
-        if h:
-            try:
-                text_p = ctypes.c_char_p()
-                text_len = ctypes.c_size_t()
-                cdll.pdf_extract_text(h, ctypes.byref(text_p), ctypes.byref(text_len))
-                text = text_p.value.decode('utf-8', errors='replace') if text_p.value else ''
-                if len(text.strip()) > 50:
-                    return {'title': Path(path).stem, 'author': '', 'text': text}
-            finally:
-                cdll.pdf_close(h)
-
-    # Fallback: OCR via /opt/Unlimited-OCR (Baidu SGLang)
-    import requests, base64, tempfile, os as _os
-    import fitz
-    try:
-        _sr = requests.get('http://127.0.0.1:10000/health', timeout=2)
-        if _sr.status_code == 200:
-            doc = fitz.open(path)
-            mat = fitz.Matrix(300/72, 300/72)
-            texts = []
-            for i, page in enumerate(doc):
-                png = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-                page.get_pixmap(matrix=mat).save(png.name)
-                with open(png.name, 'rb') as f:
-                    b64 = base64.b64encode(f.read()).decode()
-                _os.unlink(png.name)
-                payload = {
-                    'model': 'Unlimited-OCR',
-                    'messages': [{'role': 'user', 'content': [
-                        {'type': 'text', 'text': 'document parsing.'},
-                        {'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{b64}'}}
-                    ]}],
-                    'temperature': 0,
-                }
-                r = requests.post('http://127.0.0.1:10000/v1/chat/completions',
-                                  json=payload, timeout=300)
-                text = r.json()['choices'][0]['message']['content']
-                if text.strip():
-                    texts.append(f'--- Page {i+1} ---\n{text}')
-            doc.close()
-            full = '\n\n'.join(texts)
-            if full.strip():
-                return {'title': Path(path).stem, 'author': '', 'text': full}
-    except Exception:
-        pass
+def stream_mobi(path):
+    info = {'title': Path(path).stem, 'author': ''}
+    info['chunks'] = _mobi_chunks(path, info)
+    return info
 
-    raise RuntimeError(f'Cannot extract text from PDF: {path}')
+def _pdf_pages(cdll, h, pages):
+    """逐页提取文本层；pages 为页号序列（从 0 开始）"""
+    for i in pages:
+        text_p = c_void_p()
+        text_len = c_size_t()
+        if cdll.pdf_extract_range(h, i, i + 1, byref(text_p), byref(text_len)) != 0:
+            continue
+        text = ''
+        try:
+            if text_p.value and text_len.value:
+                # 直接从 C 缓冲区解码，不经中间 bytes 拷贝
+                text = str(_c_view(text_p.value, text_len.value), 'utf-8', 'replace')
+        finally:
+            cdll.pdf_free_range_text(text_p)
+        yield text
 
-def extract_md(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        text = f.read()
-    return {'title': Path(path).stem, 'author': '', 'text': text}
+def _pdf_chunks(path, pages=None):
+    cdll = _open_pdflib()
+    h = cdll.pdf_open(path.encode('utf-8')) if cdll else None
+    held = []
+    if h:
+        try:
+            if pages is None:
+                todo = range(max(cdll.pdf_get_page_count(h), 0))
+            else:
+                todo = pages
+            # 先攒够 50 个非空字符确认有文本层，之后逐页直出
+            got = 0
+            for text in _pdf_pages(cdll, h, todo):
+                if held is None:
+                    yield text
+                    continue
+                held.append(text)
+                got += len(text.strip())
+                if got > 50:
+                    yield from held
+                    held = None
+            if held is None:
+                return
+            # 只取几页时字少（目录、插图页）不说明是扫描版，有字就直接交出
+            if pages is not None and any(t.strip() for t in held):
+                yield from held
+                return
+        finally:
+            cdll.pdf_close(h)
 
-def extract(path):
+    # 无文本层（扫描版）；只提取部分页时允许为空（如插图页）
+    sel = set(pages) if pages is not None else None
+    got = False
+    for text in _ocr_pages(path, sel):
+        got = True
+        yield text
+    if got:
+        return
+    # OCR 不可用或没认出字：退回已提取的少量文本，而不是悄悄丢掉
+    if any(t.strip() for t in held):
+        yield from held
+    elif pages is None:
+        raise RuntimeError(f'Cannot extract text from PDF: {path}')
+
+def stream_pdf(path, pages=None):
+    """pages: 只提取这些页（从 0 开始），None 为整本"""
+    return {'title': Path(path).stem, 'author': '', 'chunks': _pdf_chunks(path, pages)}
+
+def pdf_page_count(path):
+    """PDF 页数；libpdfparse 未编译或打不开时返回 0"""
+    cdll = _open_pdflib()
+    if not cdll:
+        return 0
+    h = cdll.pdf_open(path.encode('utf-8'))
+    if not h:
+        return 0
+    try:
+        return max(cdll.pdf_get_page_count(h), 0)
+    finally:
+        cdll.pdf_close(h)
+
+def stream_md(path):
+    return {'title': Path(path).stem, 'author': '', 'chunks': _iter_file(path)}
+
+def stream(path):
     ext = Path(path).suffix.lower()
     if ext in ('.mobi', '.azw3', '.prc'):
-        return extract_mobi(path)
+        return stream_mobi(path)
     elif ext == '.pdf':
-        return extract_pdf(path)
+        return stream_pdf(path)
     elif ext == '.md':
-        return extract_md(path)
+        return stream_md(path)
     elif ext == '.txt':
-        return extract_md(path)
+        return stream_md(path)
     else:
         raise ValueError(f'Unsupported format: {ext}')
 
+def _read_all(info):
+    info['text'] = ''.join(info.pop('chunks'))
+    return info
+
+def extract_mobi(path):
+    return _read_all(stream_mobi(path))
+
+def extract_pdf(path, pages=None):
+    return _read_all(stream_pdf(path, pages))
+
+def extract_md(path):
+    return _read_all(stream_md(path))
+
+def extract(path):
+    return _read_all(stream(path))
+
+# ── OCR 回退 ────────────────────────────────────────────────
+#
+# 扫描版 PDF 走 /opt/Unlimited-OCR (Baidu SGLang) 流水线：
+# 渲染（进程池，每个进程各自打开文档）→ 内存中编码 PNG（不落临时文件）→
+# 复用连接的 HTTP 会话，同时最多 OCR_INFLIGHT 个请求 → 按页序产出。
+# 在途上限按进程共用（并发的后台导入共享）；import_dir 的工作进程与主进程共用同一个信号量。
+# 请求前先查 OcrCache（页面 PNG 哈希 + 模型名），重复导入同一本书不再重复识别。
+# 本地调试可用 ocr_stub.py 在 127.0.0.1:10000 起一个桩服务。
+
+OCR_URL = os.environ.get('WORDCARD_OCR_URL', 'http://127.0.0.1:10000')
+OCR_MODEL = os.environ.get('WORDCARD_OCR_MODEL', 'Unlimited-OCR')
+OCR_INFLIGHT = int(os.environ.get('WORDCARD_OCR_INFLIGHT', '4'))
+OCR_RENDER_WORKERS = int(os.environ.get('WORDCARD_OCR_RENDER', '0'))   # 0 = min(CPU 数, 在途数)
+OCR_DPI = 300
+OCR_TIMEOUT = 300
+
+OCR_CACHE_DIR = os.environ.get('WORDCARD_OCR_CACHE', 'data/ocr_cache')   # 空串 = 关闭
+OCR_CACHE_MB = int(os.environ.get('WORDCARD_OCR_CACHE_MB', '512'))
+
+_render = threading.local()   # 渲染线程/进程各自持有的文档
+_ocr_slots = threading.BoundedSemaphore(max(1, OCR_INFLIGHT))   # 在途 OCR 请求上限
+_in_pool_worker = False
+
+def _pool_worker_init(slots):
+    """import_dir 工作进程的初始化：换成跨进程的在途信号量"""
+    global _ocr_slots, _in_pool_worker
+    _ocr_slots = slots
+    _in_pool_worker = True
+
+def _render_init(path):
+    fitz = _dep('fitz')
+    _render.doc = fitz.open(path)
+    _render.matrix = fitz.Matrix(OCR_DPI / 72, OCR_DPI / 72)
+
+def _render_page(i):
+    """渲染一页并在内存中编码为 PNG"""
+    return _render.doc[i].get_pixmap(matrix=_render.matrix).tobytes('png')
+
+def _render_executor(path, inflight):
+    workers = OCR_RENDER_WORKERS or min(os.cpu_count() or 1, inflight)
+    if workers <= 1 or _in_pool_worker:
+        # import_dir 已按书/页段多进程并行，工作进程内只用一个渲染线程
+        return ThreadPoolExecutor(1, initializer=_render_init, initargs=(path,))
+    # 非主线程（如 API 的后台导入）里 fork 会带上其它线程持有的锁，改用 spawn
+    ctx = (None if threading.current_thread() is threading.main_thread()
+           else multiprocessing.get_context('spawn'))
+    return ProcessPoolExecutor(workers, mp_context=ctx, initializer=_render_init,
+                               initargs=(path,))
+
+def _ocr_session(inflight):
+    requests = _dep('requests')
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=inflight)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _ocr_request(session, png):
+    b64 = base64.b64encode(png).decode('ascii')
+    payload = {
+        'model': OCR_MODEL,
+        'messages': [{'role': 'user', 'content': [
+            {'type': 'text', 'text': 'document parsing.'},
+            {'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{b64}'}}
+        ]}],
+        'temperature': 0,
+    }
+    r = session.post(f'{OCR_URL}/v1/chat/completions', json=payload, timeout=OCR_TIMEOUT)
+    r.raise_for_status()
+    return r.json()['choices'][0]['message']['content']
+
+class _OcrUnavailable(Exception):
+    pass
+
+class _OcrHealth:
+    """第一次缓存未命中时才探测 /health 并记住结果：全部命中的重复导入不需要服务在线"""
+
+    def __init__(self, session):
+        self.session = session
+        self._ok = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self._ok is None:
+                try:
+                    r = self.session.get(f'{OCR_URL}/health', timeout=2)
+                    self._ok = r.status_code == 200
+                except _dep('requests').RequestException:
+                    self._ok = False
+        if not self._ok:
+            raise _OcrUnavailable(OCR_URL)
+
+def _ocr_page(session, rendered, cache=None, health=None):
+    png = rendered.result()
+    if cache is not None:
+        text = cache.get(png)
+        if text is not None:
+            return text
+    if health is not None:
+        health.check()
+    with _ocr_slots:
+        text = _ocr_request(session, png)
+    if cache is not None:
+        cache.put(png, text)
+    return text
+
+class OcrCache:
+    """页面图片哈希 + 模型名 → OCR 文本 的磁盘缓存。
+    每条一个文件（按哈希前两位分目录），写入走临时文件 + 原子改名，
+    多个导入进程可共用同一目录；命中时刷新 mtime，总量超出上限时按 mtime 淘汰最久未用的条目"""
+
+    def __init__(self, root, model, max_bytes):
+        self.root = root
+        self.model = model
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._size = None     # 目录总字节数，首次写入时扫描一次，之后增量累计
+        self._lock = threading.Lock()
+
+    def key(self, png):
+        return hashlib.blake2b(png, digest_size=16, person=b'wordcard-ocr',
+                               key=self.model.encode('utf-8')[:64]).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, png):
+        path = self._path(self.key(png))
+        try:
+            with open(path, 'rb') as f:
+                text = f.read().decode('utf-8')
+            os.utime(path)
+        except (OSError, UnicodeDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, png, text):
+        path = self._path(self.key(png))
+        data = text.encode('utf-8')
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            # 缓存只是加速手段，写失败不影响导入
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        try:
+            subdirs = list(os.scandir(self.root))
+        except OSError:
+            return
+        for sub in subdirs:
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                if e.name.endswith('.tmp'):
+                    continue
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, e.path
+
+    def _evict(self):
+        # 一次淘汰到上限的 90%，避免每次写入都重新扫描目录
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 9 // 10
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+
+def _ocr_cache():
+    if not OCR_CACHE_DIR or OCR_CACHE_MB <= 0:
+        return None
+    return OcrCache(OCR_CACHE_DIR, OCR_MODEL, OCR_CACHE_MB * 1024 * 1024)
+
+def _ocr_pages(path, pages=None, inflight=None):
+    """逐页产出 OCR 文本（按页序）。先查缓存，第一次未命中时才要求服务在线：
+    依赖缺失或服务不可用且尚未产出时不产出；已产出部分页后服务不可用则抛 RuntimeError。
+    pages 为 None 时处理全部页；inflight 为同时在途的请求数（默认 OCR_INFLIGHT）"""
+    fitz, requests = _dep('fitz'), _dep('requests')
+    if not fitz or not requests:
+        return
+    inflight = max(1, inflight or OCR_INFLIGHT)
+    session = _ocr_session(inflight)
+    health = _OcrHealth(session)
+    yielded = False
+    try:
+        with fitz.open(path) as doc:
+            todo = [i for i in range(doc.page_count) if pages is None or i in pages]
+
+        cache = _ocr_cache()
+        render = _render_executor(path, inflight)
+        http = ThreadPoolExecutor(inflight)
+        try:
+            # 渲染最多领先 2×inflight 页，限制内存中的 PNG 数量
+            window = collections.deque()
+            it = iter(todo)
+            while True:
+                while len(window) < 2 * inflight:
+                    i = next(it, None)
+                    if i is None:
+                        break
+                    rendered = render.submit(_render_page, i)
+                    window.append((i, http.submit(_ocr_page, session, rendered, cache,
+                                                  health)))
+                if not window:
+                    break
+                i, fut = window.popleft()
+                try:
+                    text = fut.result()
+                except _OcrUnavailable:
+                    if not yielded:
+                        return
+                    raise RuntimeError(f'OCR service unavailable ({OCR_URL}); '
+                                       f'page {i + 1} of {path} is not cached') from None
+                except Exception as e:
+                    raise RuntimeError(f'OCR failed on page {i + 1} of {path}: {e}') from e
+                if text.strip():
+                    yielded = True
+                    yield f'--- Page {i+1} ---\n{text}\n\n'
+        finally:
+            http.shutdown(wait=True, cancel_futures=True)
+            render.shutdown(wait=True, cancel_futures=True)
+    finally:
+        session.close()
+
 # ── 提取词汇 ────────────────────────────────────────────────
 
+MAX_CARRY = 64 * 1024   # 无换行/无句末标点时的最大暂存，超出即强制切分
+
+_SENT_SPLIT = re.compile(r'(?<=[.!?])\s+')
+_WORD_RE = re.compile(r"[a-zA-Z]+(?:'[a-zA-Z]+)?")
+
 def _clean_text(text):
     """Remove markdown syntax and normalize"""
     text = re.sub(r'#{1,6}\s*', '', text)
@@ -156,61 +530,495 @@ def _clean_text(text):
     text = re.sub(r'^[-=]{3,}$', '', text, flags=re.MULTILINE)
     return text
 
-def extract_words(text, max_words=200):
-    """提取文本中的英文词汇，返回 [(word, context_sentence), ...]"""
-    text = _clean_text(text)
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    word_set = {}
-    for sent in sentences:
+def iter_sentences(chunks):
+    """文本块 → 句子流。只清洗完整的行，句子跨块时暂存，内存与块大小同阶"""
+    raw, pending = '', ''
+    try:
+        for chunk in chunks:
+            raw += chunk
+            cut = raw.rfind('\n') + 1
+            if not cut:
+                if len(raw) < MAX_CARRY:
+                    continue
+                cut = len(raw)
+            parts = _SENT_SPLIT.split(pending + _clean_text(raw[:cut]))
+            raw = raw[cut:]
+            pending = parts.pop()
+            yield from parts
+            if len(pending) > MAX_CARRY:
+                yield pending
+                pending = ''
+        yield from _SENT_SPLIT.split(pending + _clean_text(raw))
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+def iter_words(chunks, max_words=200):
+    """按首次出现顺序产出 (word, context_sentence)，满 max_words 即停止读取"""
+    if max_words <= 0:
+        return
+    seen = set()
+    sentences = iter_sentences(chunks)
+    try:
+        for sent in sentences:
+            sent = sent.strip()
+            if not sent:
+                continue
+            for w in _WORD_RE.findall(sent):
+                wl = w.lower()
+                if len(wl) < 3 or len(wl) > 20:
+                    continue
+                if wl in _STOPWORDS or wl in seen:
+                    continue
+                seen.add(wl)
+                context = sent
+                if len(context) > 200:
+                    context = context[:200] + '...'
+                yield w, context
+                if len(seen) >= max_words:
+                    return
+    finally:
+        sentences.close()
+
+def _collect_words(chunks, max_words=200):
+    """{lower: (word, context)}，保持首次出现顺序"""
+    return {w.lower(): (w, ctx) for w, ctx in iter_words(chunks, max_words)}
+
+# ── 词频统计与排序 ──────────────────────────────────────────
+#
+# 词表项：{lower: [count, word, context, context_score]}。
+# word 优先取全小写形式（避免句首大写），context 取得分最低（最合适）的句子。
+
+RANKS = ('frequency', 'rarity', 'first')
+MAX_VOCAB = 50000
+CONTEXT_IDEAL = 100
+
+def _context_score(sent):
+    """例句得分，越小越好：接近 100 字符最佳，超过 200 需截断的排在后面"""
+    n = len(sent)
+    return abs(n - CONTEXT_IDEAL) + (1000 if n > 200 else 0)
+
+def _prune_vocab(stats, max_vocab):
+    # 词表超限时只保留高频的 max_vocab 个（有损计数，之后新词计数偏低）
+    keep = heapq.nlargest(max_vocab, stats.items(), key=lambda kv: kv[1][0])
+    stats.clear()
+    stats.update(keep)
+
+def count_words(chunks, max_vocab=MAX_VOCAB):
+    """单遍流式统计全文词频与最佳例句。词表超过 2×max_vocab 时裁剪到 max_vocab"""
+    stats = {}
+    for sent in iter_sentences(chunks):
         sent = sent.strip()
         if not sent:
             continue
-        words = re.findall(r"[a-zA-Z]+(?:'[a-zA-Z]+)?", sent)
-        for w in words:
+        score = context = None
+        for w in _WORD_RE.findall(sent):
             wl = w.lower()
             if len(wl) < 3 or len(wl) > 20:
                 continue
             if wl in _STOPWORDS:
                 continue
-            if wl not in word_set and len(word_set) < max_words:
-                context = sent.strip()
-                if len(context) > 200:
-                    context = context[:200] + '...'
-                word_set[wl] = (w, context)
+            if score is None:
+                score = _context_score(sent)
+                context = sent if len(sent) <= 200 else sent[:200] + '...'
+            e = stats.get(wl)
+            if e is None:
+                stats[wl] = [1, w, context, score]
+                continue
+            e[0] += 1
+            if w == wl:
+                e[1] = w
+            if score < e[3]:
+                e[2], e[3] = context, score
+        if max_vocab and len(stats) > 2 * max_vocab:
+            _prune_vocab(stats, max_vocab)
+    return stats
+
+def _merge_stats(parts):
+    """合并各页段的词表：频次相加，例句取更优者"""
+    merged = {}
+    for part in parts:
+        for wl, e in part.items():
+            m = merged.get(wl)
+            if m is None:
+                merged[wl] = e
+                continue
+            m[0] += e[0]
+            if e[1] == wl:
+                m[1] = e[1]
+            if e[3] < m[3]:
+                m[2], m[3] = e[2], e[3]
+    return merged
+
+def rank_words(stats, max_words=200, rank='frequency', db=None):
+    """从词表中选出前 max_words 个，返回 [(word, context, count), ...]（按得分降序）。
+    frequency: 按书内频次；rarity: 书内频次 × log(库总词频 / 该词库内词频)，压低库里已常见的词。
+    rarity 不是 TF-IDF：库内词频是各词首次入库那本书里的频次（之后再遇到不累加），
+    不是出现过该词的书本数，只作“库里已有多少”的粗略估计"""
+    if rank not in ('frequency', 'rarity'):
+        raise ValueError(f'Unknown rank: {rank}')
+    # 频次相同时偏向较长（通常更少见）的词
+    top = heapq.nlargest(max_words if rank == 'frequency' else max_words * 8,
+                         stats.items(), key=lambda kv: (kv[1][0], len(kv[0])))
+    if rank == 'rarity':
+        if db is None:
+            raise ValueError('rarity ranking needs db')
+        with db.lock:
+            db_freq, db_total = db.item_frequencies([e[1] for _, e in top])
+        total = db_total + sum(e[0] for e in stats.values())
+        scored = [(e[0] * math.log((1 + total) / (1 + f + e[0])), len(wl), e)
+                  for (wl, e), f in zip(top, db_freq)]
+        scored.sort(key=lambda x: (x[0], x[1]), reverse=True)
+        top = [(None, e) for _, _, e in scored[:max_words]]
+    return [(e[1], e[2], e[0]) for _, e in top]
+
+def select_words(chunks, max_words=200, rank='frequency', db=None):
+    """按 rank 选词，返回 [(word, context, count), ...]。
+    rank='first' 为旧行为：取最先出现的 max_words 个词（按长度排序），读够即停，count 为 0"""
+    if rank == 'first':
+        return [(w, ctx, 0) for w, ctx in _sorted_words(_collect_words(chunks, max_words))]
+    return rank_words(count_words(chunks), max_words, rank, db)
+
+def _sorted_words(word_set):
     result = list(word_set.values())
     result.sort(key=lambda x: len(x[0]), reverse=True)
     return result
 
+def extract_words(text, max_words=200):
+    """提取文本中的英文词汇，返回 [(word, context_sentence), ...]"""
+    return _sorted_words(_collect_words([text], max_words))
+
+# ── 内容指纹 ────────────────────────────────────────────────
+#
+# 每个导入过的文件对应一条载体记录（content_source_t），保存文件大小、修改时间、
+# 整个文件的内容指纹，PDF 另存逐页指纹。重新导入时：大小与修改时间都未变直接跳过；
+# 内容指纹未变只刷新修改时间；PDF 只重新提取指纹变化（或新增）的页。
+
+PAGE_HASH_HEX = 8
+
+def file_hash(path):
+    """整个文件的 64 位内容指纹"""
+    h = hashlib.blake2b(digest_size=8)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            h.update(block)
+    return int.from_bytes(h.digest(), 'little')
+
+def pdf_page_hashes(path):
+    """逐页 CRC32 列表。装有 PyMuPDF 时取页面内容流及其引用图片的原始字节
+    （不解码不渲染，扫描版也能区分）；否则取文本层"""
+    fitz = _dep('fitz')
+    if fitz:
+        doc = fitz.open(path)
+        try:
+            out = []
+            for page in doc:
+                crc = zlib.crc32(page.read_contents())
+                for img in page.get_images(full=True):
+                    crc = zlib.crc32(doc.xref_stream_raw(img[0]) or b'', crc)
+                out.append(crc)
+            return out
+        finally:
+            doc.close()
+    cdll = _open_pdflib()
+    h = cdll.pdf_open(path.encode('utf-8')) if cdll else None
+    if not h:
+        return []
+    try:
+        pages = range(max(cdll.pdf_get_page_count(h), 0))
+        return [zlib.crc32(t.encode('utf-8')) for t in _pdf_pages(cdll, h, pages)]
+    finally:
+        cdll.pdf_close(h)
+
+def _split_hashes(s):
+    return [s[i:i + PAGE_HASH_HEX] for i in range(0, len(s), PAGE_HASH_HEX)]
+
+def _prior(db, path, force=False):
+    """主进程：只读库中已有载体，不读文件内容。返回 None 表示大小与修改时间都未变
+    可跳过，否则返回 (src, old_pages, args)，args 交给 _fingerprint"""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    with db.lock:
+        src = db.find_source(file_path=path)
+        old_pages = db.source_page_hashes(src.id) if src else ''
+    if (src and not force and src.content_hash and src.file_size == st.st_size
+            and src.file_mtime == int(st.st_mtime)):
+        return None
+    old_hash = src.content_hash if src and not force else 0
+    return src, old_pages, (path, st.st_size, int(st.st_mtime), old_hash)
+
+def _fingerprint(path, size, mtime, old_hash=0):
+    """读文件算新指纹（不碰数据库，可在工作进程中执行）。
+    内容指纹等于 old_hash 时不再算 PDF 逐页指纹"""
+    fp = {'path': path, 'size': size, 'mtime': mtime,
+          'hash': file_hash(path), 'pages': ''}
+    if fp['hash'] != old_hash and Path(path).suffix.lower() == '.pdf':
+        fp['pages'] = ''.join(f'{c:08x}' for c in pdf_page_hashes(path))
+    return fp
+
+def _diff(src, old_pages, fp, force=False):
+    """主进程：新指纹与已有载体对比，返回值同 _plan"""
+    if src and not force and src.content_hash == fp['hash']:
+        fp['pages'] = old_pages
+        return src, fp, []
+
+    pages = None
+    if Path(fp['path']).suffix.lower() == '.pdf' and src and old_pages and not force:
+        # 按指纹集合比较：插入/删除页不会让其后各页都算作变化
+        old = set(_split_hashes(old_pages))
+        pages = [i for i, c in enumerate(_split_hashes(fp['pages'])) if c not in old]
+    return src, fp, pages
+
+def _plan(db, path, force=False):
+    """对比载体指纹，决定要提取什么。返回 None 表示文件未变可跳过，
+    否则返回 (src, fp, pages)：src 为已有载体的副本或 None；fp 为新指纹；
+    pages 为需提取的页号列表（None = 整本，[] = 内容未变只需刷新指纹）"""
+    prior = _prior(db, path, force)
+    if prior is None:
+        return None
+    src, old_pages, args = prior
+    return _diff(src, old_pages, _fingerprint(*args), force)
+
+def _source_type(path):
+    return engine.SOURCE_PDF if Path(path).suffix.lower() == '.pdf' else engine.SOURCE_ARTICLE
+
+def _ensure_source(db, src, fp, title):
+    """取已有载体或新建（调用方持有 db.lock）；书名重复时以路径命名"""
+    if src is not None:
+        return src
+    sid = db.add_source(title, fp['path'], _source_type(fp['path']))
+    if not sid:
+        # 名称字段 127 字节：取路径末尾（含文件名）而不是开头
+        tail = fp['path'].encode('utf-8')[-127:].decode('utf-8', 'ignore')
+        sid = db.add_source(tail, fp['path'], _source_type(fp['path']))
+    if not sid:
+        raise RuntimeError(f'Cannot create source for {fp["path"]}')
+    return db.find_source(source_id=sid)
+
+def _save_fingerprint(db, src, fp, added=0):
+    """导入成功后才写入指纹，失败的书下次会重试（调用方持有 db.lock）"""
+    src.content_hash = fp['hash']
+    src.file_size = fp['size']
+    src.file_mtime = fp['mtime']
+    src.page_count = len(fp['pages']) // PAGE_HASH_HEX
+    src.item_count += added
+    src.updated_at = db.now()
+    db.update_source(src, fp['pages'])
+
 # ── 导入流程 ────────────────────────────────────────────────
 
-def import_book(book_path, db_path='data/wordcard.db', user_id=1, max_words=200):
-    print(f'Importing: {book_path}')
-    info = extract(book_path)
-    title = info['title']
-    text = info['text']
-    print(f'  Title: {title}')
-    print(f'  Text length: {len(text)} chars')
+def _tally(chunks, counter):
+    """透传文本块并累计字符数到 counter[0]"""
+    try:
+        for chunk in chunks:
+            counter[0] += len(chunk)
+            yield chunk
+    finally:
+        chunks.close()
 
-    words = extract_words(text, max_words)
-    print(f'  Found {len(words)} unique words')
+def _write_words(db, title, words, src_id=0):
+    tags = f'book:{title}'
+    with db.lock:
+        ids = db.add_items_bulk(
+            {'question': word, 'explanation': context,
+             'source_id': src_id, 'tags': tags, 'frequency': count}
+            for word, context, count in words)
+    return sum(1 for i in ids if i)
 
-    db = engine.WordCardDB.open(db_path)
+def import_book(book_path, db_path='data/wordcard.db', user_id=1, max_words=200,
+                db=None, rank='frequency', force=False):
+    """db: 已打开的 WordCardDB（如 API 进程共享的句柄）；为 None 时自行打开并关闭。
+    rank: 选词方式，见 select_words；force: 忽略指纹整本重新导入"""
+    if rank not in RANKS:
+        raise ValueError(f'Unknown rank: {rank}')
+    print(f'Importing: {book_path}')
+    own = db is None
+    if own:
+        db = engine.WordCardDB.open(db_path)
     try:
-        src_id = 0
-        added = 0
-        for word, context in words:
-            item_id = db.add_item(
-                question=word,
-                answer='',
-                explanation=context,
-                source_id=src_id,
-                tags=f'book:{title}',
-            )
-            if item_id:
-                added += 1
-
-        db.save()
+        plan = _plan(db, book_path, force)
+        if plan is None:
+            print('  Unchanged, skipped')
+            return 0
+        src, fp, pages = plan
+        if pages == []:
+            with db.lock:
+                _save_fingerprint(db, src, fp)
+                db.save()
+            print('  Content unchanged, skipped')
+            return 0
+
+        if pages is None:
+            info = stream(book_path)
+        else:
+            print(f'  {len(pages)} of {len(fp["pages"]) // PAGE_HASH_HEX} pages changed')
+            info = stream_pdf(book_path, pages)
+        read = [0]
+        words = select_words(_tally(info['chunks'], read), max_words, rank, db)
+        title = info['title']
+        print(f'  Title: {title}')
+        print(f'  Text read: {read[0]} chars')
+        print(f'  Selected {len(words)} words by {rank}')
+
+        with db.lock:
+            src = _ensure_source(db, src, fp, title)
+            added = _write_words(db, title, words, src.id)
+            _save_fingerprint(db, src, fp, added)
+            db.save()
         print(f'  Added {added} items to database')
         return added
     finally:
-        db.close()
+        if own:
+            db.close()
+
+# ── 批量并行导入 ────────────────────────────────────────────
+
+BOOK_EXTS = ('.mobi', '.azw3', '.prc', '.pdf', '.md', '.txt')
+PDF_PAGES_PER_JOB = 32
+
+def _extract_job(path, pages, max_words, rank):
+    """工作进程：流式提取一本书或一组 PDF 页的词汇。
+    返回 (title, 已读字符数, 词表)；rank='first' 时词表为 {lower: (word, context)}，
+    否则为 count_words 的词频表"""
+    info = stream(path) if pages is None else stream_pdf(path, pages)
+    read = [0]
+    chunks = _tally(info['chunks'], read)
+    if rank == 'first':
+        words = _collect_words(chunks, max_words)
+    else:
+        words = count_words(chunks)
+    return info['title'], read[0], words
+
+def _book_jobs(path, pages, page_count=0):
+    """PDF 按页分组（每组 PDF_PAGES_PER_JOB 页），其余整本一个任务。
+    page_count 为 0 时打开 PDF 取页数"""
+    if pages is None and Path(path).suffix.lower() == '.pdf':
+        n = page_count or pdf_page_count(path)
+        if n > PDF_PAGES_PER_JOB:
+            pages = range(n)
+    if pages is None:
+        return [None]
+    pages = list(pages)
+    return [pages[i:i + PDF_PAGES_PER_JOB] for i in range(0, len(pages), PDF_PAGES_PER_JOB)]
+
+def _merge_words(parts, max_words):
+    """按页段顺序合并，保留首次出现的词，结果与整本提取一致（跨页句子除外）"""
+    merged = {}
+    for part in parts:
+        for wl, v in part.items():
+            if len(merged) >= max_words:
+                return merged
+            if wl not in merged:
+                merged[wl] = v
+    return merged
+
+def import_dir(dir_path, db_path='data/wordcard.db', user_id=1, max_words=200,
+               jobs=None, db=None, rank='frequency', force=False):
+    """并行导入目录下所有电子书：提取与分词在进程池中进行（PDF 再按页分组），
+    主进程作为唯一写者逐本批量写入，最后统一提交一次。
+    内容未变的书直接跳过，PDF 只提取变化的页（见 _plan）；算指纹也在进程池中。
+    返回 {book_path: added}；失败的书记为 None"""
+    if rank not in RANKS:
+        raise ValueError(f'Unknown rank: {rank}')
+    books = sorted(str(p) for p in Path(dir_path).rglob('*')
+                   if p.is_file() and p.suffix.lower() in BOOK_EXTS)
+    print(f'Importing {len(books)} books from {dir_path} ({jobs or os.cpu_count()} jobs)')
+    results = {}
+    if not books:
+        return results
+
+    own = db is None
+    if own:
+        db = engine.WordCardDB.open(db_path)
+    try:
+        skipped = 0
+        slots = multiprocessing.BoundedSemaphore(max(1, OCR_INFLIGHT))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_pool_worker_init,
+                                 initargs=(slots,)) as pool:
+            # 读文件算指纹也在进程池里做，主进程只查库、对比和写入
+            pending = {}   # book → [已完成任务数, 各任务结果, src, fp]，算指纹时为 (src, old_pages)
+            futures = {}   # future → (book, k)；k 为 None 是指纹任务
+            for book in books:
+                try:
+                    prior = _prior(db, book, force)
+                except OSError as e:
+                    print(f'  {book}: {e}')
+                    results[book] = None
+                    continue
+                if prior is None:
+                    results[book] = 0
+                    skipped += 1
+                    continue
+                src, old_pages, args = prior
+                pending[book] = (src, old_pages)
+                futures[pool.submit(_fingerprint, *args)] = (book, None)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    book, k = futures.pop(fut)
+                    state = pending[book]
+                    if state is None:
+                        continue
+                    try:
+                        result = fut.result()
+                    except Exception as e:
+                        print(f'  {book}: {e}')
+                        results[book] = None
+                        pending[book] = None
+                        continue
+
+                    if k is None:
+                        src, fp, pages = _diff(*state, result, force)
+                        if pages == []:
+                            with db.lock:
+                                _save_fingerprint(db, src, fp)
+                            results[book] = 0
+                            pending[book] = None
+                            skipped += 1
+                            continue
+                        groups = _book_jobs(book, pages, len(fp['pages']) // PAGE_HASH_HEX)
+                        pending[book] = [0, [None] * len(groups), src, fp]
+                        for k, group in enumerate(groups):
+                            futures[pool.submit(_extract_job, book, group,
+                                                max_words, rank)] = (book, k)
+                        continue
+
+                    state[1][k] = result
+                    state[0] += 1
+                    if state[0] < len(state[1]):
+                        continue
+
+                    pending[book] = None
+                    _, parts, src, fp = state
+                    title = parts[0][0]
+                    text_len = sum(p[1] for p in parts)
+                    if text_len == 0 and src is None:
+                        print(f'  {book}: no text extracted')
+                        results[book] = None
+                        continue
+                    words = [p[2] for p in parts]
+                    if rank == 'first':
+                        words = [(w, ctx, 0) for w, ctx in
+                                 _sorted_words(_merge_words(words, max_words))]
+                    else:
+                        words = rank_words(_merge_stats(words), max_words, rank, db)
+                    with db.lock:
+                        src = _ensure_source(db, src, fp, title)
+                        results[book] = _write_words(db, title, words, src.id)
+                        _save_fingerprint(db, src, fp, results[book])
+                    print(f'  {title}: {text_len} chars, {len(words)} words, '
+                          f'{results[book]} added')
+
+        with db.lock:
+            db.save()
+        print(f'  Skipped {skipped} unchanged, '
+              f'added {sum(n for n in results.values() if n)} items to database')
+        return results
+    finally:
+        if own:
+            db.close()
@@ -76,30 +76,9 @@ API int pdf_get_page_count(void* handle) {
     return count;
 }
 
-/**
- * 提取所有页面的纯文本
- * @param handle pdf_open 返回的句柄
- * @param out_text 输出文本指针（需调用 pdf_free_text 释放）
- * @param out_len 输出文本长度
- * @return 0 成功，-1 失败
- */
-API int pdf_extract_text(void* handle, char** out_text, size_t* out_len) {
-    PdfHandle* h = static_cast<PdfHandle*>(handle);
-    if (!h || !h->doc) return -1;
-
-    // 如果已有缓存，直接返回
-    if (h->text_cache) {
-        *out_text = h->text_cache;
-        *out_len = h->text_cache_len;
-        return 0;
-    }
-
-    int page_count = pdf_get_page_count(h);
-    if (page_count < 0) return -1;
-
-    std::string result;
-
-    for (int i = 0; i < page_count; i++) {
+/* 提取 [first, last) 页文本追加到 result */
+static void extract_pages(PdfHandle* h, int first, int last, std::string& result) {
+    for (int i = first; i < last; i++) {
         fz_page* page = nullptr;
         fz_try(h->ctx) {
             page = fz_load_page(h->ctx, h->doc, i);
@@ -138,18 +117,75 @@ API int pdf_extract_text(void* handle, char** out_text, size_t* out_len) {
         }
         fz_drop_page(h->ctx, page);
     }
+}
+
+static char* copy_text(const std::string& s, size_t* out_len) {
+    char* p = (char*)malloc(s.length() + 1);
+    if (!p) return nullptr;
+    memcpy(p, s.c_str(), s.length() + 1);
+    *out_len = s.length();
+    return p;
+}
+
+/**
+ * 提取所有页面的纯文本
+ * @param handle pdf_open 返回的句柄
+ * @param out_text 输出文本指针（句柄持有的全文缓存，随 pdf_close 释放；
+ *                 可调用 pdf_free_text，但它不做任何事）
+ * @param out_len 输出文本长度
+ * @return 0 成功，-1 失败
+ */
+API int pdf_extract_text(void* handle, char** out_text, size_t* out_len) {
+    PdfHandle* h = static_cast<PdfHandle*>(handle);
+    if (!h || !h->doc) return -1;
+
+    // 如果已有缓存，直接返回
+    if (h->text_cache) {
+        *out_text = h->text_cache;
+        *out_len = h->text_cache_len;
+        return 0;
+    }
+
+    int page_count = pdf_get_page_count(h);
+    if (page_count < 0) return -1;
+
+    std::string result;
+    extract_pages(h, 0, page_count, result);
 
     // 分配并缓存结果
-    h->text_cache_len = result.length();
-    h->text_cache = (char*)malloc(h->text_cache_len + 1);
+    h->text_cache = copy_text(result, &h->text_cache_len);
     if (!h->text_cache) return -1;
 
-    memcpy(h->text_cache, result.c_str(), h->text_cache_len + 1);
     *out_text = h->text_cache;
     *out_len = h->text_cache_len;
     return 0;
 }
 
+/**
+ * 提取 [first, last) 页的纯文本（用于按页段并行导入）
+ * @param handle pdf_open 返回的句柄
+ * @param first 起始页（从 0 开始）
+ * @param last 结束页（不含），超出页数时截断
+ * @param out_text 输出文本指针（独立分配，需调用 pdf_free_range_text 释放）
+ * @param out_len 输出文本长度
+ * @return 0 成功，-1 失败
+ */
+API int pdf_extract_range(void* handle, int first, int last,
+                          char** out_text, size_t* out_len) {
+    PdfHandle* h = static_cast<PdfHandle*>(handle);
+    if (!h || !h->doc || first < 0) return -1;
+
+    int page_count = pdf_get_page_count(h);
+    if (page_count < 0) return -1;
+    if (last > page_count) last = page_count;
+
+    std::string result;
+    if (first < last) extract_pages(h, first, last, result);
+
+    *out_text = copy_text(result, out_len);
+    return *out_text ? 0 : -1;
+}
+
 /**
  * 释放 pdf_extract_text 返回的文本
  * @param text 文本指针
@@ -159,6 +195,14 @@ API void pdf_free_text(char* text) {
     (void)text;
 }
 
+/**
+ * 释放 pdf_extract_range 返回的文本
+ * @param text 文本指针
+ */
+API void pdf_free_range_text(char* text) {
+    free(text);
+}
+
 /**
  * 关闭 PDF 文件并释放资源
  * @param handle pdf_open 返回的句柄
@@ -0,0 +1,82 @@
+"""OCR 桩服务 — 在本地模拟 Unlimited-OCR 的接口，用于调试和压测导入流水线
+
+提供 GET /health 与 POST /v1/chat/completions（OpenAI 兼容格式）。
+返回文本包含页面图片的哈希与字节数，每个请求按 --delay 加随机抖动休眠，
+完成顺序因此被打乱，可检验结果是否按页序重组；日志打印当前在途请求数。
+
+用法: python ocr_stub.py [--port 10000] [--delay 0.5] [--jitter 0.5]
+"""
+
+import argparse, base64, hashlib, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Stats:
+    lock = threading.Lock()
+    inflight = 0
+    peak = 0
+    served = 0
+
+class Handler(BaseHTTPRequestHandler):
+    delay = 0.5
+    jitter = 0.5
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/v1/chat/completions':
+            self._reply(404, {'error': 'not found'})
+            return
+        req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        url = next(c['image_url']['url'] for c in req['messages'][0]['content']
+                   if c['type'] == 'image_url')
+        png = base64.b64decode(url.split(',', 1)[1])
+
+        with Stats.lock:
+            Stats.inflight += 1
+            Stats.peak = max(Stats.peak, Stats.inflight)
+            now = Stats.inflight
+        try:
+            time.sleep(self.delay + random.random() * self.jitter)
+        finally:
+            with Stats.lock:
+                Stats.inflight -= 1
+                Stats.served += 1
+                served, peak = Stats.served, Stats.peak
+        print(f'#{served} {len(png)} bytes, in flight {now} (peak {peak})', flush=True)
+
+        text = (f'Stub page {hashlib.sha1(png).hexdigest()[:12]} ({len(png)} bytes). '
+                f'The {req["model"]} service recognised this scanned page.')
+        self._reply(200, {'choices': [{'message': {'role': 'assistant', 'content': text}}]})
+
+    def log_message(self, fmt, *args):
+        pass
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=10000)
+    ap.add_argument('--delay', type=float, default=0.5, help='每个请求的基础耗时（秒）')
+    ap.add_argument('--jitter', type=float, default=0.5, help='附加随机耗时上限（秒）')
+    args = ap.parse_args()
+    Handler.delay, Handler.jitter = args.delay, args.jitter
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f'OCR stub on http://{args.host}:{args.port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
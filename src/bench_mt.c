@@ -0,0 +1,143 @@
+/* 多线程复习吞吐基准
+ *
+ * 每个线程负责一部分用户，循环提交 wc_review（已建档的行，走共享锁 + 用户分片锁
+ * 的快路径），每 8 次夹一次 wc_get_due_items 读查询。对照组在每次调用外
+ * 再套一把全局互斥锁，模拟旧版单锁引擎的串行行为。
+ *
+ * 用法: ./bench_mt [用户数 64] [每用户学习项 200] [每轮秒数 1] [--wal]
+ */
+
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include "wordcard.h"
+
+static wordcard_db_t *g_db;
+static uint32_t *g_users;
+static uint32_t *g_items;
+static int g_n_users, g_n_items;
+static volatile int g_stop;
+static int g_serial;
+static pthread_mutex_t g_big_lock = PTHREAD_MUTEX_INITIALIZER;
+
+typedef struct {
+    int tid, threads;
+    uint64_t ops;
+} worker_t;
+
+static uint32_t xorshift(uint32_t *s) {
+    uint32_t x = *s;
+    x ^= x << 13; x ^= x >> 17; x ^= x << 5;
+    return *s = x;
+}
+
+static void *worker(void *arg) {
+    worker_t *w = arg;
+    uint32_t seed = 2463534242u + (uint32_t)w->tid * 7919u;
+    uint32_t due[32];
+    uint64_t ops = 0;
+    /* 只操作 user % threads == tid 的用户，线程之间没有共享行 */
+    int mine = (g_n_users - w->tid + w->threads - 1) / w->threads;
+    if (mine <= 0) return NULL;
+    while (!g_stop) {
+        uint32_t uid = g_users[w->tid + (int)(xorshift(&seed) % (uint32_t)mine) * w->threads];
+        uint32_t iid = g_items[xorshift(&seed) % (uint32_t)g_n_items];
+        if (g_serial) pthread_mutex_lock(&g_big_lock);
+        if ((ops & 7) == 7) {
+            wc_get_due_items(g_db, uid, wc_now() + 30 * 86400, due, 32);
+        } else {
+            wc_review(g_db, uid, iid, (uint8_t)(3 + xorshift(&seed) % 3), 5, NULL);
+        }
+        if (g_serial) pthread_mutex_unlock(&g_big_lock);
+        ops++;
+    }
+    w->ops = ops;
+    return NULL;
+}
+
+static double run(int threads, double seconds) {
+    pthread_t tids[64];
+    worker_t ws[64];
+    struct timespec t0, t1;
+    g_stop = 0;
+    clock_gettime(CLOCK_MONOTONIC, &t0);
+    for (int i = 0; i < threads; i++) {
+        ws[i] = (worker_t){ .tid = i, .threads = threads, .ops = 0 };
+        pthread_create(&tids[i], NULL, worker, &ws[i]);
+    }
+    usleep((useconds_t)(seconds * 1e6));
+    g_stop = 1;
+    uint64_t total = 0;
+    for (int i = 0; i < threads; i++) {
+        pthread_join(tids[i], NULL);
+        total += ws[i].ops;
+    }
+    clock_gettime(CLOCK_MONOTONIC, &t1);
+    return total / ((t1.tv_sec - t0.tv_sec) + (t1.tv_nsec - t0.tv_nsec) / 1e9);
+}
+
+int main(int argc, char **argv) {
+    int wal = 0, pos = 0;
+    long args[3] = { 64, 200, 1 };
+    for (int i = 1; i < argc; i++) {
+        if (strcmp(argv[i], "--wal") == 0) wal = 1;
+        else if (pos < 3) args[pos++] = atol(argv[i]);
+    }
+    g_n_users = (int)args[0];
+    g_n_items = (int)args[1];
+    double seconds = (double)args[2];
+
+    g_db = wc_db_init();
+    g_users = malloc(sizeof(uint32_t) * (size_t)g_n_users);
+    g_items = malloc(sizeof(uint32_t) * (size_t)g_n_items);
+    item_entry_t e;
+    memset(&e, 0, sizeof(e));
+    for (int i = 0; i < g_n_items; i++) {
+        snprintf(e.question, sizeof(e.question), "word%d", i);
+        g_items[i] = wc_add_item(g_db, &e);
+    }
+    for (int u = 0; u < g_n_users; u++) {
+        char uid[32];
+        snprintf(uid, sizeof(uid), "bench%d", u);
+        g_users[u] = wc_create_user(g_db, uid, uid);
+    }
+    const char *path = "/tmp/wordcard_bench_mt.db";
+    if (wal) {
+        char wal_path[64];
+        snprintf(wal_path, sizeof(wal_path), "%s.wal", path);
+        remove(wal_path);
+        wc_journal_open(g_db, path);
+    }
+    /* 预先建好全部掌握度行与当日统计行，计时阶段只走快路径 */
+    for (int u = 0; u < g_n_users; u++)
+        for (int i = 0; i < g_n_items; i++)
+            wc_review(g_db, g_users[u], g_items[i], 4, 5, NULL);
+
+    long cpus = sysconf(_SC_NPROCESSORS_ONLN);
+    printf("%d users x %d items, %.0fs per run, %ld CPU(s)%s\n",
+           g_n_users, g_n_items, seconds, cpus, wal ? ", WAL on" : "");
+    printf("%8s %14s %14s %8s\n", "threads", "sharded op/s", "global op/s", "ratio");
+    double base = 0;
+    for (int threads = 1; threads <= 16; threads *= 2) {
+        g_serial = 0;
+        double sharded = run(threads, seconds);
+        g_serial = 1;
+        double serial = run(threads, seconds);
+        if (threads == 1) base = sharded;
+        printf("%8d %14.0f %14.0f %7.2fx   (%.2fx vs 1 thread)\n",
+               threads, sharded, serial, sharded / serial, sharded / base);
+    }
+
+    wc_db_free(g_db);
+    if (wal) {
+        char wal_path[64];
+        snprintf(wal_path, sizeof(wal_path), "%s.wal", path);
+        remove(wal_path);
+    }
+    free(g_users);
+    free(g_items);
+    return 0;
+}
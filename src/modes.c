@@ -68,8 +68,8 @@ size_t wc_generate_daily_queue(wordcard_db_t *db, uint32_t user_id, uint32_t now
                                 size_t max_count) {
     if (!db || !out_ids || !out_modes || max_count == 0) return 0;
     
-    user_t *user = wc_find_user_by_id(db, user_id);
-    if (!user) return 0;
+    user_t user;
+    if (wc_get_user(db, user_id, &user) != WC_OK) return 0;
     
     size_t count = 0;
     
@@ -80,10 +80,10 @@ size_t wc_generate_daily_queue(wordcard_db_t *db, uint32_t user_id, uint32_t now
     size_t due_count = wc_get_due_items(db, user_id, now, due_buffer, max_count);
     
     for (size_t i = 0; i < due_count && count < max_count; i++) {
-        user_item_mastery_t *m = wc_find_mastery(db, user_id, due_buffer[i]);
-        if (m) {
+        user_item_mastery_t m;
+        if (wc_get_mastery(db, user_id, due_buffer[i], &m) == WC_OK) {
             out_ids[count] = due_buffer[i];
-            out_modes[count] = (uint8_t)wc_recommend_mode(m, now);
+            out_modes[count] = (uint8_t)wc_recommend_mode(&m, now);
             count++;
         }
     }
@@ -91,7 +91,7 @@ size_t wc_generate_daily_queue(wordcard_db_t *db, uint32_t user_id, uint32_t now
     free(due_buffer);
     
     /* 第二步: 添加新词（不超过每日限制） */
-    size_t new_limit = user->daily_new_limit;
+    size_t new_limit = user.daily_new_limit;
     if (count < max_count && new_limit > 0) {
         uint32_t *new_buffer = malloc(sizeof(uint32_t) * new_limit);
         if (new_buffer) {
@@ -1,6 +1,12 @@
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
+#include <time.h>
 #include <assert.h>
+#include <pthread.h>
+#include <sys/stat.h>
+#include <sys/wait.h>
+#include <unistd.h>
 #include "wordcard.h"
 
 /* ========================================================================
@@ -52,14 +58,21 @@ TEST(item_add_find) {
     ASSERT(id > 0);
     ASSERT(db->item_count == 1);
     
-    item_entry_t *found = wc_find_item_by_question(db, "abandon");
+    item_row_t *found = wc_find_item_by_question(db, "abandon");
     ASSERT(found != NULL);
     ASSERT(found->id == id);
-    ASSERT(strcmp(found->question, "abandon") == 0);
+    ASSERT(strcmp(wc_str(db, found->question), "abandon") == 0);
     
-    item_entry_t *found2 = wc_find_item_by_id(db, id);
+    item_row_t *found2 = wc_find_item_by_id(db, id);
     ASSERT(found2 == found); /* 应该指向同一个内存 */
     
+    /* 展开为完整学习项副本 */
+    item_entry_t full;
+    ASSERT(wc_get_item(db, id, &full) == WC_OK);
+    ASSERT(strcmp(full.answer, "放弃") == 0);
+    ASSERT(full.category == CAT_ENGLISH_VOCAB);
+    ASSERT(wc_get_item(db, id + 1, &full) == WC_ERR_NOT_FOUND);
+    
     wc_db_free(db);
 }
 
@@ -81,6 +94,20 @@ TEST(user_create_find) {
     user_t *u2 = wc_find_user_by_id(db, uid);
     ASSERT(u2 == u);
     
+    /* 锁内拷贝的副本 */
+    user_t copy;
+    ASSERT(wc_get_user(db, uid, &copy) == WC_OK && copy.id == uid);
+    ASSERT(wc_get_user_by_uid(db, "ding123", &copy) == WC_OK);
+    ASSERT(strcmp(copy.name, "TestUser") == 0);
+    ASSERT(wc_get_user(db, uid + 1, &copy) == WC_ERR_NOT_FOUND);
+    ASSERT(wc_get_user_by_uid(db, "nobody", &copy) == WC_ERR_NOT_FOUND);
+    
+    user_item_mastery_t m;
+    ASSERT(wc_get_mastery(db, uid, 1, &m) == WC_ERR_NOT_FOUND);
+    wc_get_or_create_mastery(db, uid, 1)->total_reviews = 3;
+    ASSERT(wc_get_mastery(db, uid, 1, &m) == WC_OK);
+    ASSERT(m.user_id == uid && m.item_id == 1 && m.total_reviews == 3);
+    
     wc_db_free(db);
 }
 
@@ -170,9 +197,9 @@ TEST(db_save_load) {
     ASSERT(db2->item_count == 1);
     ASSERT(db2->user_count == 1);
     
-    item_entry_t *found = wc_find_item_by_question(db2, "test");
+    item_row_t *found = wc_find_item_by_question(db2, "test");
     ASSERT(found != NULL);
-    ASSERT(strcmp(found->answer, "测试") == 0);
+    ASSERT(strcmp(wc_str(db2, found->answer), "测试") == 0);
     ASSERT(found->category == CAT_CUSTOM);
     
     wc_db_free(db2);
@@ -336,18 +363,938 @@ TEST(universal_category) {
     
     ASSERT(db->item_count == 3);
     
-    item_entry_t *f1 = wc_find_item_by_id(db, id1);
+    item_row_t *f1 = wc_find_item_by_id(db, id1);
     ASSERT(f1->category == CAT_ENGLISH_VOCAB);
     
-    item_entry_t *f2 = wc_find_item_by_id(db, id2);
+    item_row_t *f2 = wc_find_item_by_id(db, id2);
     ASSERT(f2->category == CAT_LEGAL_LAW);
+    ASSERT(strcmp(wc_str(db, f2->question), "【刑法】第266条") == 0);
     
-    item_entry_t *f3 = wc_find_item_by_id(db, id3);
+    item_row_t *f3 = wc_find_item_by_id(db, id3);
     ASSERT(f3->category == CAT_IELTS_SPEAKING);
     
     wc_db_free(db);
 }
 
+/* -------- 测试 12: 预写日志重放与折叠 -------- */
+
+static long file_size(const char *path) {
+    struct stat st;
+    return stat(path, &st) == 0 ? (long)st.st_size : -1;
+}
+
+TEST(journal_replay) {
+    const char *path = "/tmp/test_wordcard_wal.db";
+    const char *wal = "/tmp/test_wordcard_wal.db.wal";
+    remove(path);
+    remove(wal);
+    
+    /* 只写日志，不保存快照 */
+    wordcard_db_t *db = wc_db_init();
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    uint32_t uid = wc_create_user(db, "wal_user", "Wal");
+    item_entry_t v = {0};
+    strcpy(v.question, "journal");
+    uint32_t vid = wc_add_item(db, &v);
+    user_item_mastery_t out;
+    ASSERT(wc_review(db, uid, vid, 4, 5, &out) == WC_OK);
+    ASSERT(out.repetitions == 1);
+    ASSERT(wc_review(db, uid, vid, 5, 5, &out) == WC_OK);
+    ASSERT(db->dirty == 0);          /* 全部由日志覆盖 */
+    ASSERT(wc_commit(db, 0) == WC_OK);
+    wc_db_free(db);
+    
+    /* 模拟崩溃时写了半条记录 */
+    FILE *fp = fopen(wal, "ab");
+    ASSERT(fp != NULL);
+    fwrite("\x01\x02\x03", 1, 3, fp);
+    fclose(fp);
+    
+    /* 快照不存在：空库 + 重放日志 */
+    ASSERT(wc_load_db(path) == NULL);
+    db = wc_db_init();
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    ASSERT(db->user_count == 1);
+    ASSERT(db->item_count == 1);
+    user_item_mastery_t *m = wc_find_mastery(db, uid, vid);
+    ASSERT(m != NULL);
+    ASSERT(m->repetitions == 2);
+    ASSERT(m->interval_days == 6);
+    ASSERT(db->stat_count == 1);
+    ASSERT(db->stats[0].new_items == 1);
+    ASSERT(db->stats[0].reviewed_items == 1);
+    
+    /* 折叠：写快照并清空日志 */
+    ASSERT(wc_checkpoint(db) == WC_OK);
+    ASSERT(file_size(wal) == WC_WAL_HEADER_SIZE);
+    ASSERT(wc_review(db, uid, vid, 5, 5, NULL) == WC_OK);
+    wc_db_free(db);
+    
+    db = wc_load_db(path);
+    ASSERT(db != NULL);
+    ASSERT(wc_find_mastery(db, uid, vid)->repetitions == 2);
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    ASSERT(wc_find_mastery(db, uid, vid)->repetitions == 3);
+    wc_db_free(db);
+    
+    remove(path);
+    remove(wal);
+}
+
+/* -------- 测试 13: 只读映射加载 -------- */
+
+TEST(map_db) {
+    const char *path = "/tmp/test_wordcard_map.db";
+    wordcard_db_t *db = wc_db_init();
+    uint32_t uid = wc_create_user(db, "map_user", "Map");
+    item_entry_t v = {0};
+    strcpy(v.question, "mapped");
+    strcpy(v.answer, "映射");
+    uint32_t vid = wc_add_item(db, &v);
+    wc_sm2_update(wc_get_or_create_mastery(db, uid, vid), 4);
+    ASSERT(wc_save_db(db, path) == WC_OK);
+    wc_db_free(db);
+    
+    db = wc_map_db(path);
+    ASSERT(db != NULL);
+    ASSERT(db->map_base != NULL);
+    item_row_t *found = wc_find_item_by_question(db, "mapped");
+    ASSERT(found != NULL);
+    ASSERT((char*)found > (char*)db->map_base);          /* 零拷贝：指向映射区 */
+    ASSERT(strcmp(wc_str(db, found->answer), "映射") == 0);
+    
+    /* 原地修改（写时复制）与追加（拷出到堆）都可用 */
+    user_item_mastery_t *m = wc_find_mastery(db, uid, vid);
+    ASSERT(m != NULL);
+    wc_sm2_update(m, 5);
+    ASSERT(m->repetitions == 2);
+    strcpy(v.question, "appended");
+    uint32_t vid2 = wc_add_item(db, &v);
+    ASSERT(vid2 == vid + 1);
+    ASSERT(wc_find_item_by_question(db, "mapped") != NULL);
+    ASSERT(wc_save_db(db, path) == WC_OK);
+    wc_db_free(db);
+    
+    /* 重新加载看到保存后的数据 */
+    db = wc_load_db(path);
+    ASSERT(db != NULL);
+    ASSERT(db->item_count == 2);
+    ASSERT(wc_find_mastery(db, uid, vid)->repetitions == 2);
+    wc_db_free(db);
+    remove(path);
+}
+
+/* -------- 测试 13b: 两个进程映射同一个库 -------- */
+
+TEST(map_db_shared) {
+    const char *path = "/tmp/test_wordcard_map2.db";
+    const char *wal = "/tmp/test_wordcard_map2.db.wal";
+    remove(path);
+    remove(wal);
+    wordcard_db_t *db = wc_db_init();
+    uint32_t uid = wc_create_user(db, "map_user", "Map");
+    item_entry_t v = {0};
+    strcpy(v.question, "shared");
+    uint32_t vid = wc_add_item(db, &v);
+    ASSERT(wc_save_db(db, path) == WC_OK);
+    wc_db_free(db);
+    
+    /* 写者：映射 + 日志，快照之后的复习只在日志里 */
+    db = wc_map_db(path);
+    ASSERT(db != NULL);
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    ASSERT(wc_review(db, uid, vid, 4, 5, NULL) == WC_OK);
+    ASSERT(wc_journal_sync(db) == WC_OK);
+    
+    /* 另一个进程同时只读映射，重放日志看到同样的数据，不动日志文件 */
+    long before = file_size(wal);
+    pid_t pid = fork();
+    ASSERT(pid >= 0);
+    if (pid == 0) {
+        wordcard_db_t *ro = wc_map_db(path);
+        int ok = ro && ro->map_base && wc_journal_replay(ro, path) == WC_OK &&
+                 wc_find_item_by_question(ro, "shared") != NULL &&
+                 wc_find_mastery(ro, uid, vid) != NULL &&
+                 wc_find_mastery(ro, uid, vid)->repetitions == 1;
+        _exit(ok ? 0 : 1);
+    }
+    int status = 0;
+    ASSERT(waitpid(pid, &status, 0) == pid);
+    ASSERT(WIFEXITED(status) && WEXITSTATUS(status) == 0);
+    ASSERT(file_size(wal) == before);
+    
+    /* 写者照常继续 */
+    ASSERT(wc_review(db, uid, vid, 5, 5, NULL) == WC_OK);
+    ASSERT(wc_find_mastery(db, uid, vid)->repetitions == 2);
+    wc_db_free(db);
+    
+    /* 没有日志文件时只读重放什么也不做 */
+    remove(wal);
+    db = wc_map_db(path);
+    ASSERT(wc_journal_replay(db, path) == WC_OK);
+    ASSERT(wc_find_mastery(db, uid, vid) == NULL);
+    wc_db_free(db);
+    remove(path);
+}
+
+/* -------- 测试 14: 紧凑存储与 v3 格式迁移 -------- */
+
+TEST(compact_items) {
+    const char *path = "/tmp/test_wordcard_v3.db";
+    
+    /* 手工写一个 v3 文件：文件头 + 定长学习项 */
+    wc_file_header_t header;
+    memset(&header, 0, sizeof(header));
+    memcpy(header.magic, WC_MAGIC_V3, 4);
+    header.version = WC_VERSION_V3;
+    header.item_count = 2;
+    item_entry_t items[2];
+    memset(items, 0, sizeof(items));
+    items[0].id = 1;
+    strcpy(items[0].question, "legacy");
+    strcpy(items[0].explanation, "An old fixed-size record.");
+    strcpy(items[0].tags, "book:old");
+    items[0].frequency = 7;
+    items[1].id = 2;
+    strcpy(items[1].question, "second");
+    FILE *fp = fopen(path, "wb");
+    ASSERT(fp != NULL);
+    fwrite(&header, sizeof(header), 1, fp);
+    fwrite(items, sizeof(item_entry_t), 2, fp);
+    fclose(fp);
+    
+    wordcard_db_t *db = wc_map_db(path);      /* v3 走拷贝转换 */
+    ASSERT(db != NULL);
+    ASSERT(db->item_count == 2);
+    item_entry_t full;
+    ASSERT(wc_get_item_by_question(db, "legacy", &full) == WC_OK);
+    ASSERT(full.id == 1);
+    ASSERT(full.frequency == 7);
+    ASSERT(strcmp(full.explanation, "An old fixed-size record.") == 0);
+    ASSERT(strcmp(full.tags, "book:old") == 0);
+    ASSERT(wc_find_item_by_id(db, 2)->answer == 0);     /* 空串共享偏移 0 */
+    
+    /* 另存为 v4：行 + 字符串堆，远小于定长格式 */
+    ASSERT(wc_save_db(db, path) == WC_OK);
+    wc_db_free(db);
+    struct stat st;
+    ASSERT(stat(path, &st) == 0);
+    ASSERT((size_t)st.st_size < sizeof(header) + 2 * sizeof(item_entry_t) / 10);
+    
+    db = wc_map_db(path);
+    ASSERT(db != NULL);
+    ASSERT(db->map_base != NULL);
+    ASSERT(strcmp(wc_str(db, wc_find_item_by_id(db, 1)->tags), "book:old") == 0);
+    wc_db_free(db);
+    remove(path);
+}
+
+/* -------- 测试 15: 批量添加学习项 -------- */
+
+TEST(add_items_bulk) {
+    const char *path = "/tmp/test_wordcard_bulk.db";
+    const char *wal = "/tmp/test_wordcard_bulk.db.wal";
+    remove(path);
+    remove(wal);
+    
+    wordcard_db_t *db = wc_db_init();
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    item_entry_t one = {0};
+    strcpy(one.question, "w1");
+    uint32_t first = wc_add_item(db, &one);
+    
+    /* 5000 项：与已有项重复 1 个，批内重复 1 个 */
+    size_t n = 5000;
+    item_entry_t *batch = calloc(n, sizeof(item_entry_t));
+    uint32_t *ids = calloc(n, sizeof(uint32_t));
+    for (size_t i = 0; i < n; i++) {
+        snprintf(batch[i].question, sizeof(batch[i].question), "w%zu", i);
+        strcpy(batch[i].answer, "答案");
+        batch[i].category = CAT_ENGLISH_VOCAB;
+    }
+    strcpy(batch[n - 1].question, "w7");
+    
+    ASSERT(wc_add_items_bulk(db, batch, n, ids) == (int)n - 2);
+    ASSERT(ids[0] == first + 1);
+    ASSERT(ids[1] == 0);                         /* 已存在 */
+    ASSERT(ids[n - 1] == 0);                     /* 批内重复 */
+    ASSERT(db->item_count == n - 1);
+    ASSERT(wc_find_item_by_question(db, "w4998")->id == ids[4998]);
+    ASSERT(db->dirty == 0);                      /* 全部写入日志 */
+    ASSERT(wc_add_items_bulk(db, batch, n, NULL) == 0);
+    wc_db_free(db);
+    
+    /* 重放日志恢复全部新增项 */
+    db = wc_db_init();
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    ASSERT(db->item_count == n - 1);
+    item_entry_t full;
+    ASSERT(wc_get_item_by_question(db, "w42", &full) == WC_OK);
+    ASSERT(full.id == ids[42]);
+    ASSERT(strcmp(full.answer, "答案") == 0);
+    
+    /* 定长字段写满（无 NUL）：存储与查重都截到 sizeof-1，日志可重放 */
+    item_entry_t wide;
+    memset(&wide, 'x', sizeof(wide));
+    wide.difficulty = 1;
+    wide.source_id = 0;
+    wide.category = CAT_ENGLISH_VOCAB;
+    wide.frequency = 0;
+    uint32_t wide_id = wc_add_item(db, &wide);
+    ASSERT(wide_id > 0);
+    ASSERT(wc_add_item(db, &wide) == 0);
+    ASSERT(wc_add_items_bulk(db, &wide, 1, NULL) == 0);
+    wide.question[0] = 'y';
+    item_entry_t wides[2] = { wide, wide };
+    ASSERT(wc_add_items_bulk(db, wides, 2, NULL) == 1);
+    wc_db_free(db);
+    
+    db = wc_db_init();
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    ASSERT(db->item_count == n + 1);
+    ASSERT(wc_get_item(db, wide_id, &full) == WC_OK);
+    ASSERT(strlen(full.question) == sizeof(full.question) - 1);
+    ASSERT(strlen(full.explanation) == sizeof(full.explanation) - 1);
+    ASSERT(wc_get_item_by_question(db, full.question, &full) == WC_OK && full.id == wide_id);
+    wc_db_free(db);
+    
+    free(batch);
+    free(ids);
+    remove(path);
+    remove(wal);
+}
+
+/* -------- 测试 16: 按用户到期堆 -------- */
+
+/* 暴力对照：扫描全表，按 (next_review, 下标) 排序后取前 k 个 */
+static size_t brute_due(wordcard_db_t *db, uint32_t uid, uint32_t now,
+                        uint32_t *out, size_t k) {
+    size_t n = 0;
+    for (size_t i = 0; i < db->mastery_count; i++) {
+        user_item_mastery_t *m = &db->mastery[i];
+        if (m->user_id != uid || m->sm2_status == SM2_NEW || m->next_review > now) continue;
+        /* 插入排序（规模很小） */
+        size_t j = n++;
+        while (j > 0) {
+            user_item_mastery_t *p = wc_find_mastery(db, uid, out[j - 1]);
+            if (p->next_review < m->next_review ||
+                (p->next_review == m->next_review && p < m)) break;
+            out[j] = out[j - 1];
+            j--;
+        }
+        out[j] = m->item_id;
+    }
+    return n < k ? n : k;
+}
+
+static int due_matches(wordcard_db_t *db, uint32_t uid, uint32_t now, size_t k) {
+    uint32_t got[512], want[512];
+    size_t n = wc_get_due_items(db, uid, now, got, k);
+    if (n != brute_due(db, uid, now, want, k)) return 0;
+    return memcmp(got, want, n * sizeof(uint32_t)) == 0;
+}
+
+TEST(due_heap) {
+    wordcard_db_t *db = wc_db_init();
+    uint32_t uids[3], vids[150];
+    uids[0] = wc_create_user(db, "heap_a", "A");
+    uids[1] = wc_create_user(db, "heap_b", "B");
+    uids[2] = wc_create_user(db, "heap_c", "C");
+    for (int i = 0; i < 150; i++) {
+        item_entry_t v = {0};
+        snprintf(v.question, sizeof(v.question), "heap%d", i);
+        vids[i] = wc_add_item(db, &v);
+    }
+    
+    /* wc_review 增量维护 */
+    for (int u = 0; u < 3; u++) {
+        for (int i = u; i < 150; i += 1 + u) {
+            for (int r = 0; r <= i % 3; r++) {
+                ASSERT(wc_review(db, uids[u], vids[i], (uint8_t)((i * 7 + u + r) % 6), 5, NULL) == WC_OK);
+            }
+        }
+    }
+    wc_get_or_create_mastery(db, uids[0], vids[1]);      /* NEW 记录不进入到期堆 */
+    uint32_t now = wc_now();
+    uint32_t offsets[4] = { 0, 86400, 7 * 86400, 30 * 86400 };
+    for (int u = 0; u < 3; u++) {
+        for (int t = 0; t < 4; t++) {
+            ASSERT(due_matches(db, uids[u], now + offsets[t], 5));
+            ASSERT(due_matches(db, uids[u], now + offsets[t], 512));
+        }
+    }
+    
+    /* 直接改写 next_review 后通知，查询时整堆重建 */
+    for (size_t i = 0; i < db->mastery_count; i++) {
+        db->mastery[i].next_review = now + (uint32_t)((i * 2654435761u) % (20 * 86400));
+    }
+    wc_notify_mastery_changed(db);
+    ASSERT(due_matches(db, uids[1], now + 10 * 86400, 512));
+    
+    /* 重建后继续走 wc_sm2_update_db 增量路径 */
+    for (int i = 0; i < 150; i += 4) {
+        user_item_mastery_t *m = wc_find_mastery(db, uids[1], vids[i]);
+        if (m) wc_sm2_update_db(db, m, (uint8_t)(i % 6));
+    }
+    for (int u = 0; u < 3; u++) {
+        ASSERT(due_matches(db, uids[u], now + 3 * 86400, 7));
+        ASSERT(due_matches(db, uids[u], now + 30 * 86400, 512));
+    }
+    
+    uint32_t ids[4];
+    ASSERT(wc_get_due_items(db, uids[0], now + 30 * 86400, ids, 4) == 4);
+    
+    /* 未出现过的用户 */
+    ASSERT(wc_get_due_items(db, 9999, now + 30 * 86400, ids, 4) == 0);
+    wc_db_free(db);
+}
+
+/* -------- 测试 17: 未学位图 -------- */
+
+TEST(new_items_bitmap) {
+    wordcard_db_t *db = wc_db_init();
+    uint32_t uid = wc_create_user(db, "seen_user", "Seen");
+    uint32_t vids[300];
+    for (int i = 0; i < 300; i++) {
+        item_entry_t v = {0};
+        snprintf(v.question, sizeof(v.question), "seen%d", i);
+        v.source_id = (i % 2) ? 7 : 0;
+        vids[i] = wc_add_item(db, &v);
+    }
+    
+    /* 学过除 3 的倍数以外的全部项（跨越多个 64 位字） */
+    for (int i = 0; i < 300; i++) {
+        if (i % 3) ASSERT(wc_review(db, uid, vids[i], 4, 5, NULL) == WC_OK);
+    }
+    uint32_t ids[300];
+    size_t n = wc_get_new_items(db, uid, 0, ids, 300);
+    ASSERT(n == 100);
+    for (size_t k = 0; k < n; k++) ASSERT(ids[k] == vids[k * 3]);
+    ASSERT(wc_get_new_items(db, uid, 0, ids, 5) == 5);
+    ASSERT(ids[4] == vids[12]);
+    
+    /* 按载体过滤 */
+    n = wc_get_new_items(db, uid, 7, ids, 300);
+    ASSERT(n == 50);
+    ASSERT(ids[0] == vids[3]);
+    
+    /* 未出现过的用户：全部为新项 */
+    ASSERT(wc_get_new_items(db, 4242, 0, ids, 300) == 300);
+    
+    /* 掌握度记录先于学习项存在 */
+    uint32_t next_id = vids[299] + 1;
+    ASSERT(wc_get_or_create_mastery(db, uid, next_id) != NULL);
+    item_entry_t late = {0};
+    strcpy(late.question, "late");
+    ASSERT(wc_add_item(db, &late) == next_id);
+    n = wc_get_new_items(db, uid, 0, ids, 300);
+    ASSERT(n == 100);
+    ASSERT(ids[n - 1] == vids[297]);
+    
+    wc_db_free(db);
+}
+
+/* -------- 测试 18: 用户计数汇总 -------- */
+
+TEST(user_counts) {
+    wordcard_db_t *db = wc_db_init();
+    uint32_t uid = wc_create_user(db, "count_user", "Count");
+    uint32_t other = wc_create_user(db, "count_other", "Other");
+    uint32_t vids[120];
+    for (int i = 0; i < 120; i++) {
+        item_entry_t v = {0};
+        snprintf(v.question, sizeof(v.question), "count%d", i);
+        vids[i] = wc_add_item(db, &v);
+    }
+    
+    user_counts_t c;
+    ASSERT(wc_get_user_counts(db, uid, wc_now(), &c) == WC_OK);
+    ASSERT(c.new_available == 120 && c.learning == 0 && c.due_now == 0);
+    
+    for (int i = 0; i < 80; i++) {
+        ASSERT(wc_review(db, uid, vids[i], (uint8_t)(i % 6), 5, NULL) == WC_OK);
+    }
+    for (int i = 0; i < 10; i++) {
+        ASSERT(wc_review(db, other, vids[i], 5, 5, NULL) == WC_OK);
+    }
+    
+    /* 直接构造 10 个已掌握 + 若干已到期 */
+    uint32_t now = wc_now();
+    for (int i = 0; i < 10; i++) {
+        user_item_mastery_t *m = wc_find_mastery(db, uid, vids[i]);
+        m->sm2_status = SM2_MASTERED;
+        m->next_review = now - 100 * (uint32_t)(i + 1);
+    }
+    wc_notify_mastery_changed(db);
+    
+    /* 暴力对照 */
+    uint32_t learning = 0, mastered = 0, due_now = 0, due_week = 0;
+    for (size_t i = 0; i < db->mastery_count; i++) {
+        user_item_mastery_t *m = &db->mastery[i];
+        if (m->user_id != uid) continue;
+        if (m->sm2_status == SM2_LEARNING) learning++;
+        if (m->sm2_status == SM2_MASTERED) mastered++;
+        if (m->sm2_status != SM2_NEW && m->next_review <= now) due_now++;
+        if (m->sm2_status != SM2_NEW && m->next_review <= now + 7 * 86400) due_week++;
+    }
+    ASSERT(wc_get_user_counts(db, uid, now, &c) == WC_OK);
+    ASSERT(c.new_available == 40);
+    ASSERT(c.learning == learning);
+    ASSERT(c.mastered == 10 && mastered == 10);
+    ASSERT(c.due_now == due_now && due_now >= 10);
+    ASSERT(c.due_today >= c.due_now);
+    
+    /* 增量迁移：复习一个新项，学习中 +1 */
+    ASSERT(wc_review(db, uid, vids[100], 4, 5, NULL) == WC_OK);
+    ASSERT(wc_get_user_counts(db, uid, now, &c) == WC_OK);
+    ASSERT(c.new_available == 39);
+    ASSERT(c.learning == learning + 1);
+    
+    /* 一周后的到期数等于堆中 ≤ 该时刻的全部记录 */
+    ASSERT(wc_get_user_counts(db, uid, now + 7 * 86400, &c) == WC_OK);
+    ASSERT(c.due_now == due_week + 1);
+    
+    ASSERT(wc_get_user_counts(db, other, now, &c) == WC_OK);
+    ASSERT(c.new_available == 110 && c.learning == 10);
+    wc_db_free(db);
+}
+
+/* -------- 测试 19: 批量提交复习 -------- */
+
+TEST(submit_reviews) {
+    const char *path = "/tmp/test_wordcard_batch.db";
+    const char *wal = "/tmp/test_wordcard_batch.db.wal";
+    remove(path);
+    remove(wal);
+    
+    wordcard_db_t *db = wc_db_init();
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    uint32_t uid = wc_create_user(db, "batch_user", "Batch");
+    item_entry_t v = {0};
+    strcpy(v.question, "batch_a");
+    uint32_t a = wc_add_item(db, &v);
+    strcpy(v.question, "batch_b");
+    uint32_t b = wc_add_item(db, &v);
+    
+    /* 离线会话：两天前学 a，昨天复习 a，同时答错 b；一条无效评分 */
+    uint32_t now = wc_now();
+    review_req_t reqs[4] = {
+        { uid, a, now - 2 * 86400, 10, 4, {0} },
+        { uid, a, now - 86400, 8, 5, {0} },
+        { uid, b, now - 86400, 12, 1, {0} },
+        { uid, b, 0, 5, 9, {0} },
+    };
+    user_item_mastery_t out[4];
+    int32_t rc[4];
+    ASSERT(wc_submit_reviews(db, reqs, 4, out, rc) == 3);
+    ASSERT(rc[0] == WC_OK && rc[1] == WC_OK && rc[2] == WC_OK);
+    ASSERT(rc[3] == WC_ERR_INVALID);
+    ASSERT(out[0].interval_days == 1 && out[1].interval_days == 6);
+    ASSERT(out[1].last_review == now - 86400);
+    ASSERT(out[1].next_review == now - 86400 + 6 * 86400);
+    ASSERT(out[2].last_wrong == now - 86400);
+    ASSERT(db->dirty == 0);
+    
+    /* 不存在的用户/学习项逐条报 NOT_FOUND，不建孤儿行 */
+    size_t rows = db->mastery_count;
+    review_req_t ghosts[2] = {
+        { uid, 9999, 0, 5, 4, {0} },
+        { 9999, a, 0, 5, 4, {0} },
+    };
+    ASSERT(wc_submit_reviews(db, ghosts, 2, NULL, rc) == 0);
+    ASSERT(rc[0] == WC_ERR_NOT_FOUND && rc[1] == WC_ERR_NOT_FOUND);
+    ASSERT(wc_review(db, 9999, a, 4, 5, NULL) == WC_ERR_NOT_FOUND);
+    ASSERT(wc_review(db, uid, 9999, 4, 5, NULL) == WC_ERR_NOT_FOUND);
+    ASSERT(db->mastery_count == rows);
+    ASSERT(wc_find_mastery(db, 9999, a) == NULL);
+    
+    /* 统计记在复习发生的那一天 */
+    daily_stat_t *s = wc_get_or_create_daily_stat(db, uid, wc_date_of(now - 86400));
+    ASSERT(s->reviewed_items == 1 && s->new_items == 1 && s->wrong_items == 1);
+    uint32_t ids[4];
+    ASSERT(wc_get_due_items(db, uid, now + 4 * 86400, ids, 4) == 0);
+    ASSERT(wc_get_due_items(db, uid, now + 5 * 86400, ids, 4) == 1);   /* b 答错仍为新项 */
+    ASSERT(ids[0] == a);
+    wc_db_free(db);
+    
+    /* 日志重放得到相同的掌握度 */
+    db = wc_db_init();
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    user_item_mastery_t *m = wc_find_mastery(db, uid, a);
+    ASSERT(m != NULL);
+    ASSERT(m->repetitions == 2 && m->next_review == out[1].next_review);
+    wc_db_free(db);
+    remove(path);
+    remove(wal);
+}
+
+/* -------- 测试 20: 掌握度表批量定位 -------- */
+
+TEST(mastery_rows) {
+    wordcard_db_t *db = wc_db_init();
+    ASSERT(wc_get_or_create_mastery(db, 1, 10) != NULL);
+    ASSERT(wc_get_or_create_mastery(db, 2, 10) != NULL);
+    db->dirty = 0;
+    
+    uint32_t uids[3] = { 2, 1, 3 };
+    uint32_t iids[3] = { 10, 10, 30 };
+    int64_t rows[3];
+    ASSERT(wc_mastery_rows(db, uids, iids, 3, 0, rows) == 1);
+    ASSERT(rows[0] == 1 && rows[1] == 0 && rows[2] == -1);
+    ASSERT(db->dirty == 0);
+    
+    ASSERT(wc_mastery_rows(db, uids, iids, 3, 1, rows) == 0);
+    ASSERT(rows[2] == 2);
+    ASSERT(db->dirty == 1);
+    
+    size_t count = 0;
+    db->dirty = 0;
+    uint32_t gen = db->due_generation;
+    user_item_mastery_t *table = wc_mastery_acquire(db, &count);
+    ASSERT(count == 3);
+    ASSERT(table[rows[2]].user_id == 3 && table[rows[2]].item_id == 30);
+    wc_mastery_release(db, 0);
+    ASSERT(db->dirty == 0 && db->due_generation == gen);
+    
+    table = wc_mastery_acquire(db, &count);
+    table[rows[0]].next_review = 0;
+    wc_mastery_release(db, 1);
+    ASSERT(db->dirty == 1 && db->due_generation != gen);
+    
+    /* 释放后锁可再次获取 */
+    ASSERT(wc_mastery_rows(db, uids, iids, 3, 0, rows) == 0);
+    wc_db_free(db);
+}
+
+/* -------- 测试 21: 到期量预测 -------- */
+
+TEST(forecast) {
+    wordcard_db_t *db = wc_db_init();
+    uint32_t uid = wc_create_user(db, "fc_user", "Forecast");
+    uint32_t now = wc_now();
+    for (uint32_t i = 1; i <= 60; i++) {
+        user_item_mastery_t *m = wc_get_or_create_mastery(db, uid, i);
+        m->sm2_status = SM2_LEARNING;
+        m->next_review = now + (i % 12) * 86400;        /* 0..11 天后 */
+    }
+    wc_get_or_create_mastery(db, uid, 99);              /* 新项不计入 */
+    wc_get_or_create_mastery(db, uid + 1, 1)->sm2_status = SM2_LEARNING;
+    wc_notify_mastery_changed(db);
+    
+    uint32_t counts[10];
+    ASSERT(wc_forecast(db, uid, now, 10, counts) == WC_OK);
+    uint32_t total = 0;
+    for (int d = 0; d < 10; d++) {
+        ASSERT(counts[d] == 5);
+        total += counts[d];
+    }
+    ASSERT(total == 50);                                /* 第 10、11 天在窗口外 */
+    
+    /* 另一用户（next_review = 0）：全部计入今天 */
+    ASSERT(wc_forecast(db, uid + 1, now, 3, counts) == WC_OK);
+    ASSERT(counts[0] == 1 && counts[1] == 0);
+    ASSERT(wc_forecast(db, 777, now, 3, counts) == WC_OK && counts[0] == 0);
+    ASSERT(wc_forecast(db, uid, now, 0, counts) == WC_ERR_INVALID);
+    
+    /* 跨夏令时：纽约 2026-03-08 只有 23 小时，03-09 00:30 仍归第 2 天 */
+    char *old_tz = getenv("TZ") ? strdup(getenv("TZ")) : NULL;
+    setenv("TZ", "America/New_York", 1);
+    tzset();
+    struct tm tm_at = {0};
+    tm_at.tm_year = 126; tm_at.tm_mon = 2; tm_at.tm_mday = 7;
+    tm_at.tm_hour = 12; tm_at.tm_isdst = -1;
+    uint32_t t0 = (uint32_t)mktime(&tm_at);
+    tm_at.tm_mday = 9; tm_at.tm_hour = 0; tm_at.tm_min = 30; tm_at.tm_isdst = -1;
+    uint32_t after = (uint32_t)mktime(&tm_at);
+    uint32_t ends[3];
+    ASSERT(wc_day_ends(t0, 3, ends) == WC_OK);
+    ASSERT(ends[1] - ends[0] == 23 * 3600 && ends[2] - ends[1] == 86400);
+    uint32_t dst_uid = wc_create_user(db, "dst_user", "DST");
+    user_item_mastery_t *m = wc_get_or_create_mastery(db, dst_uid, 1);
+    m->sm2_status = SM2_LEARNING;
+    m->next_review = after;
+    wc_notify_mastery_changed(db);
+    ASSERT(wc_forecast(db, dst_uid, t0, 3, counts) == WC_OK);
+    ASSERT(counts[0] == 0 && counts[1] == 0 && counts[2] == 1);
+    if (old_tz) { setenv("TZ", old_tz, 1); free(old_tz); } else unsetenv("TZ");
+    tzset();
+    wc_db_free(db);
+}
+
+/* -------- 测试 22: 批量查词频 -------- */
+
+TEST(item_frequencies) {
+    wordcard_db_t *db = wc_db_init();
+    item_entry_t e;
+    memset(&e, 0, sizeof(e));
+    strcpy(e.question, "ubiquitous");
+    e.frequency = 7;
+    ASSERT(wc_add_item(db, &e) > 0);
+    strcpy(e.question, "ephemeral");
+    e.frequency = 3;
+    ASSERT(wc_add_item(db, &e) > 0);
+    
+    const char *qs[] = {"ephemeral", "missing", "ubiquitous", NULL};
+    uint32_t freq[4];
+    uint64_t total = 0;
+    ASSERT(wc_item_frequencies(db, qs, 4, freq, &total) == WC_OK);
+    ASSERT(freq[0] == 3 && freq[1] == 0 && freq[2] == 7 && freq[3] == 0);
+    ASSERT(total == 10);
+    ASSERT(wc_item_frequencies(db, qs, 1, freq, NULL) == WC_OK && freq[0] == 3);
+    ASSERT(wc_item_frequencies(db, NULL, 1, freq, NULL) == WC_ERR_INVALID);
+    wc_db_free(db);
+}
+
+/* -------- 测试 23: 载体内容指纹与 v4 迁移 -------- */
+
+/* 页指纹副本（测试用静态缓冲） */
+static const char *page_hashes(wordcard_db_t *db, uint32_t source_id) {
+    static char buf[64];
+    size_t len;
+    return wc_get_source_page_hashes(db, source_id, buf, sizeof(buf), &len) == WC_OK
+         ? buf : NULL;
+}
+
+TEST(source_fingerprint) {
+    const char *path = "/tmp/test_wordcard_src.db";
+    const char *wal = "/tmp/test_wordcard_src.db.wal";
+    remove(path);
+    remove(wal);
+    
+    /* 手工写一个 v4 文件：空学习项表 + 最小字符串堆 + 旧载体行 */
+    wc_file_header_t header;
+    memset(&header, 0, sizeof(header));
+    memcpy(header.magic, WC_MAGIC_V4, 4);
+    header.version = WC_VERSION_V4;
+    header.string_size = 8;
+    header.source_count = 1;
+    char heap[8] = {0};
+    content_source_v4_t old;
+    memset(&old, 0, sizeof(old));
+    old.id = 3;
+    old.type = SOURCE_PDF;
+    strcpy(old.name, "Old Book");
+    strcpy(old.file_path, "/books/old.pdf");
+    old.item_count = 42;
+    FILE *fp = fopen(path, "wb");
+    ASSERT(fp != NULL);
+    fwrite(&header, sizeof(header), 1, fp);
+    fwrite(heap, 1, sizeof(heap), fp);
+    fwrite(&old, sizeof(old), 1, fp);
+    fclose(fp);
+    
+    wordcard_db_t *db = wc_map_db(path);      /* v4 走拷贝转换 */
+    ASSERT(db != NULL);
+    content_source_t copy;
+    ASSERT(wc_get_source_by_path(db, "/books/old.pdf", &copy) == WC_OK);
+    ASSERT(copy.id == 3 && copy.item_count == 42);
+    ASSERT(copy.content_hash == 0 && copy.page_count == 0);
+    ASSERT(strcmp(page_hashes(db, 3), "") == 0);
+    ASSERT(wc_get_source_by_path(db, "/books/none.pdf", &copy) == WC_ERR_NOT_FOUND);
+    ASSERT(wc_get_source_by_path(db, "/books/old.pdf", &copy) == WC_OK);
+    
+    /* 更新指纹并经日志重放 */
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    content_source_t upd = copy;
+    upd.content_hash = 0x1122334455667788ULL;
+    upd.file_size = 123456;
+    upd.page_count = 2;
+    ASSERT(wc_update_source(db, &upd, "0000abcd1234ffff") == WC_OK);
+    upd.id = 99;
+    ASSERT(wc_update_source(db, &upd, NULL) == WC_ERR_NOT_FOUND);
+    ASSERT(wc_journal_sync(db) == WC_OK);
+    wc_db_free(db);
+    
+    db = wc_load_db(path);                    /* 快照仍是 v4，指纹来自日志 */
+    ASSERT(db != NULL);
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    content_source_t *s = wc_find_source_by_id(db, 3);
+    ASSERT(s != NULL && s->content_hash == 0x1122334455667788ULL);
+    ASSERT(s->file_size == 123456 && s->item_count == 42);
+    ASSERT(strcmp(page_hashes(db, 3), "0000abcd1234ffff") == 0);
+    
+    /* page_hashes 为 NULL 时保留原页指纹；存为 v5 后可直接映射 */
+    upd = *s;
+    upd.item_count = 50;
+    ASSERT(wc_update_source(db, &upd, NULL) == WC_OK);
+    ASSERT(wc_checkpoint(db) == WC_OK);
+    wc_db_free(db);
+    
+    db = wc_map_db(path);
+    ASSERT(db != NULL && db->map_base != NULL);
+    s = wc_find_source_by_name(db, "Old Book");
+    ASSERT(s != NULL && s->item_count == 50 && s->page_count == 2);
+    ASSERT(strcmp(page_hashes(db, 3), "0000abcd1234ffff") == 0);
+    
+    /* 重新导入：指纹不变不占堆、日志只记行；变短原地覆盖；变长才追加 */
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    upd = *s;
+    size_t heap_size = db->string_size;
+    long wal_before = file_size(wal);
+    ASSERT(wc_update_source(db, &upd, "0000abcd1234ffff") == WC_OK);
+    ASSERT(db->string_size == heap_size);
+    ASSERT(file_size(wal) - wal_before == (long)(sizeof(wc_wal_record_t) + sizeof(content_source_t)));
+    ASSERT(wc_update_source(db, &upd, "99998888") == WC_OK);
+    ASSERT(db->string_size == heap_size);
+    ASSERT(strcmp(page_hashes(db, 3), "99998888") == 0);
+    ASSERT(wc_update_source(db, &upd, "0000abcd1234ffff7777") == WC_OK);
+    ASSERT(db->string_size == heap_size + 21);
+    ASSERT(wc_update_source(db, &upd, "0000abcd1234ffff7777") == WC_OK);
+    ASSERT(db->string_size == heap_size + 21);
+    ASSERT(wc_journal_sync(db) == WC_OK);
+    wc_db_free(db);
+    
+    db = wc_map_db(path);                     /* 快照 + 日志重放结果一致 */
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    ASSERT(strcmp(page_hashes(db, 3), "0000abcd1234ffff7777") == 0);
+    ASSERT(db->string_size == heap_size + 21);
+    
+    /* 缓冲不足：不拷贝，回报长度 */
+    char small[8];
+    size_t len = 0;
+    ASSERT(wc_get_source_page_hashes(db, 3, small, sizeof(small), &len) == WC_ERR_MEMORY);
+    ASSERT(len == 20);
+    ASSERT(wc_get_source_page_hashes(db, 3, NULL, 0, &len) == WC_ERR_MEMORY && len == 20);
+    ASSERT(wc_get_source_page_hashes(db, 77, small, sizeof(small), &len) == WC_ERR_NOT_FOUND);
+    ASSERT(wc_get_source(db, 3, &copy) == WC_OK && copy.item_count == 50);
+    ASSERT(wc_get_source(db, 77, &copy) == WC_ERR_NOT_FOUND);
+    wc_db_free(db);
+    remove(path);
+    remove(wal);
+}
+
+/* -------- 测试 24: 队列与文本一次取回 -------- */
+
+TEST(daily_queue_items) {
+    wordcard_db_t *db = wc_db_init();
+    uint32_t uid = wc_create_user(db, "queue_user", "Queue");
+    item_entry_t e;
+    memset(&e, 0, sizeof(e));
+    strcpy(e.question, "alpha");
+    strcpy(e.answer, "A");
+    strcpy(e.explanation, "first letter");
+    ASSERT(wc_add_item(db, &e) > 0);
+    strcpy(e.question, "beta");
+    strcpy(e.answer, "");
+    strcpy(e.explanation, "second");
+    ASSERT(wc_add_item(db, &e) > 0);
+
+    uint32_t ids[8], plain_ids[8], offs[8 * 2 + 1];
+    uint8_t modes[8], plain_modes[8];
+    char buf[64];
+    size_t used = 0;
+    size_t n = wc_daily_queue_items(db, uid, 1000, WC_FIELD_QUESTION | WC_FIELD_EXPLANATION,
+                                    ids, modes, offs, buf, sizeof(buf), &used, 8);
+    size_t m = wc_generate_daily_queue(db, uid, 1000, plain_ids, plain_modes, 8);
+    ASSERT(n == 2 && m == 2);
+    ASSERT(ids[0] == plain_ids[0] && ids[1] == plain_ids[1]);
+    ASSERT(modes[0] == plain_modes[0]);
+    ASSERT(used == strlen("alphafirst letterbetasecond"));
+    ASSERT(memcmp(buf, "alphafirst letterbetasecond", used) == 0);
+    ASSERT(offs[0] == 0 && offs[1] == 5 && offs[2] == 17 && offs[3] == 21 && offs[4] == used);
+
+    /* 缓冲区不足：报告所需大小，按此重试 */
+    n = wc_daily_queue_items(db, uid, 1000, WC_FIELD_ANSWER | WC_FIELD_EXPLANATION,
+                             ids, modes, offs, buf, 4, &used, 8);
+    ASSERT(n == 2 && used == strlen("Afirst lettersecond"));
+    ASSERT(offs[2] == offs[3]);             /* beta 的答案为空串 */
+
+    /* 不取文本时等同于 wc_generate_daily_queue */
+    n = wc_daily_queue_items(db, uid, 1000, 0, ids, modes, NULL, NULL, 0, NULL, 1);
+    ASSERT(n == 1 && ids[0] == plain_ids[0]);
+    wc_db_free(db);
+}
+
+/* -------- 测试 25: 多线程复习（分片锁）与日志顺序 -------- */
+
+#define MT_THREADS 8
+#define MT_USERS   6
+#define MT_ITEMS   20
+#define MT_ROUNDS  400
+
+typedef struct {
+    wordcard_db_t *db;
+    uint32_t *users;
+    uint32_t *items;
+    int tid;
+} mt_arg_t;
+
+static void *mt_review_worker(void *p) {
+    mt_arg_t *a = p;
+    uint32_t due[MT_ITEMS];
+    for (int r = 0; r < MT_ROUNDS; r++) {
+        /* 线程数多于用户数：既有不同用户并行，也有同一用户争用 */
+        uint32_t uid = a->users[(a->tid + r) % MT_USERS];
+        uint32_t vid = a->items[(a->tid * 7 + r) % MT_ITEMS];
+        wc_review(a->db, uid, vid, (uint8_t)(r % 6), 5, NULL);
+        if (r % 5 == 0) wc_get_due_items(a->db, uid, UINT32_MAX, due, MT_ITEMS);
+    }
+    return NULL;
+}
+
+TEST(concurrent_reviews) {
+    const char *path = "/tmp/test_wordcard_mt.db";
+    const char *wal = "/tmp/test_wordcard_mt.db.wal";
+    remove(path);
+    remove(wal);
+    
+    wordcard_db_t *db = wc_db_init();
+    ASSERT(wc_journal_open(db, path) == WC_OK);
+    uint32_t users[MT_USERS], items[MT_ITEMS];
+    for (int u = 0; u < MT_USERS; u++) {
+        char name[32];
+        snprintf(name, sizeof(name), "mt_user%d", u);
+        users[u] = wc_create_user(db, name, name);
+    }
+    item_entry_t e;
+    memset(&e, 0, sizeof(e));
+    for (int i = 0; i < MT_ITEMS; i++) {
+        snprintf(e.question, sizeof(e.question), "mt_word%d", i);
+        items[i] = wc_add_item(db, &e);
+    }
+    
+    pthread_t tids[MT_THREADS];
+    mt_arg_t args[MT_THREADS];
+    for (int t = 0; t < MT_THREADS; t++) {
+        args[t] = (mt_arg_t){ db, users, items, t };
+        ASSERT(pthread_create(&tids[t], NULL, mt_review_worker, &args[t]) == 0);
+    }
+    for (int t = 0; t < MT_THREADS; t++) pthread_join(tids[t], NULL);
+    
+    /* 每次复习恰好计入一次 */
+    uint64_t reviews = 0, activity = 0;
+    for (size_t i = 0; i < db->mastery_count; i++) reviews += db->mastery[i].total_reviews;
+    for (size_t i = 0; i < db->stat_count; i++)
+        activity += db->stats[i].new_items + db->stats[i].reviewed_items;
+    ASSERT(reviews == MT_THREADS * MT_ROUNDS);
+    ASSERT(activity == reviews);
+    
+    /* 到期堆与掌握度行一致 */
+    for (int u = 0; u < MT_USERS; u++) {
+        size_t learned = 0;
+        for (size_t i = 0; i < db->mastery_count; i++) {
+            if (db->mastery[i].user_id == users[u] && db->mastery[i].sm2_status != SM2_NEW)
+                learned++;
+        }
+        uint32_t due[MT_ITEMS];
+        ASSERT(wc_get_due_items(db, users[u], UINT32_MAX, due, MT_ITEMS) == learned);
+    }
+    
+    /* 重放日志得到逐字节相同的行：同一行的后像按修改顺序落盘 */
+    wordcard_db_t *db2 = wc_db_init();
+    ASSERT(wc_journal_open(db2, path) == WC_OK);
+    ASSERT(db2->mastery_count == db->mastery_count);
+    for (size_t i = 0; i < db->mastery_count; i++) {
+        user_item_mastery_t *m = wc_find_mastery(db2, db->mastery[i].user_id,
+                                                 db->mastery[i].item_id);
+        ASSERT(m && memcmp(m, &db->mastery[i], sizeof(*m)) == 0);
+    }
+    wc_db_free(db2);
+    wc_db_free(db);
+    remove(path);
+    remove(wal);
+}
+
 /* ========================================================================
  * 主函数
  * ======================================================================== */
@@ -366,6 +1313,21 @@ int main(void) {
     RUN(user_id_hash);
     RUN(due_items_index);
     RUN(universal_category);
+    RUN(journal_replay);
+    RUN(map_db);
+    RUN(map_db_shared);
+    RUN(compact_items);
+    RUN(add_items_bulk);
+    RUN(due_heap);
+    RUN(new_items_bitmap);
+    RUN(user_counts);
+    RUN(submit_reviews);
+    RUN(mastery_rows);
+    RUN(forecast);
+    RUN(item_frequencies);
+    RUN(source_fingerprint);
+    RUN(daily_queue_items);
+    RUN(concurrent_reviews);
     
     printf("\n===========================\n");
     printf("Passed: %d\n", tests_passed);
@@ -1,10 +1,17 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <errno.h>
 #include <time.h>
 #include <pthread.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include "wordcard.h"
 
+uint32_t mydb_crc32(const void* data, size_t len);   /* crc32.c */
+
 /* ========================================================================
  * 简单哈希表实现（链地址法）
  * ======================================================================== */
@@ -278,64 +285,402 @@ static void pair_hash_resize(pair_hash_t *h, size_t new_size) {
 }
 
 /* ========================================================================
- * 全局锁（线程安全）
+ * 问题索引：开放寻址表，槽位存 item_index+1（0 = 空），
+ * 键直接比较字符串堆中的问题，不额外复制字符串
+ * ======================================================================== */
+
+typedef struct {
+    uint32_t *slots;
+    size_t size;                    /* 2 的幂 */
+    size_t count;
+} qindex_t;
+
+static size_t fnv1a(const char *s) {
+    uint64_t h = 1469598103934665603ULL;
+    for (; *s; s++) {
+        h ^= (uint8_t)*s;
+        h *= 1099511628211ULL;
+    }
+    return (size_t)h;
+}
+
+static qindex_t* qindex_new(size_t min_size) {
+    qindex_t *q = calloc(1, sizeof(qindex_t));
+    if (!q) return NULL;
+    q->size = 1024;
+    while (q->size < min_size * 2) q->size *= 2;
+    q->slots = calloc(q->size, sizeof(uint32_t));
+    if (!q->slots) { free(q); return NULL; }
+    return q;
+}
+
+static void qindex_free(qindex_t *q) {
+    if (!q) return;
+    free(q->slots);
+    free(q);
+}
+
+static int qindex_get(const wordcard_db_t *db, const char *question, int *out) {
+    const qindex_t *q = db->question_hash;
+    size_t mask = q->size - 1;
+    for (size_t i = fnv1a(question) & mask; q->slots[i]; i = (i + 1) & mask) {
+        uint32_t idx = q->slots[i] - 1;
+        if (strcmp(wc_str(db, db->items[idx].question), question) == 0) {
+            *out = (int)idx;
+            return 1;
+        }
+    }
+    return 0;
+}
+
+static void qindex_put_slot(qindex_t *q, size_t hash, uint32_t idx) {
+    size_t mask = q->size - 1;
+    size_t i = hash & mask;
+    while (q->slots[i]) i = (i + 1) & mask;
+    q->slots[i] = idx + 1;
+    q->count++;
+}
+
+/* 重建到 new_size 个槽位（2 的幂） */
+static int qindex_resize(wordcard_db_t *db, size_t new_size) {
+    qindex_t *q = db->question_hash;
+    uint32_t *slots = calloc(new_size, sizeof(uint32_t));
+    if (!slots) return 0;
+    uint32_t *old = q->slots;
+    size_t old_size = q->size;
+    q->slots = slots;
+    q->size = new_size;
+    q->count = 0;
+    for (size_t i = 0; i < old_size; i++) {
+        if (old[i]) {
+            uint32_t j = old[i] - 1;
+            qindex_put_slot(q, fnv1a(wc_str(db, db->items[j].question)), j);
+        }
+    }
+    free(old);
+    return 1;
+}
+
+/* 预留 extra 个新键的空间，批量插入期间不再翻倍 */
+static int qindex_reserve(wordcard_db_t *db, size_t extra) {
+    qindex_t *q = db->question_hash;
+    size_t new_size = q->size;
+    while ((q->count + extra) * 2 > new_size) new_size *= 2;
+    return new_size == q->size || qindex_resize(db, new_size);
+}
+
+/* 插入 items[idx]（调用方保证问题不重复）；负载超过 1/2 时翻倍 */
+static int qindex_insert(wordcard_db_t *db, uint32_t idx) {
+    qindex_t *q = db->question_hash;
+    if ((q->count + 1) * 2 > q->size && !qindex_resize(db, q->size * 2)) return 0;
+    qindex_put_slot(q, fnv1a(wc_str(db, db->items[idx].question)), idx);
+    return 1;
+}
+
+/* ========================================================================
+ * 锁（线程安全）
+ *
+ * 全局读写锁：只读查询持共享锁（RDLOCK）；追加/扩容数组、建哈希项、
+ * 快照与重放等结构性修改持独占锁（LOCK）。
+ * 用户分片锁：持共享锁时，某用户自己的掌握度行、到期堆、位图/计数和
+ * 当日统计行只能在该用户的分片锁内改写，不同用户的复习因此可以并行。
+ * 日志锁：保护 WAL 追加与 wal_size。
+ * 加锁顺序固定为 全局 → 用户分片 → 日志。
  * ======================================================================== */
 
-static pthread_mutex_t g_db_mutex = PTHREAD_MUTEX_INITIALIZER;
+static pthread_rwlock_t g_db_lock = PTHREAD_RWLOCK_WRITER_NONRECURSIVE_INITIALIZER_NP;
+static pthread_mutex_t g_user_locks[WC_USER_SHARDS] = {
+    [0 ... WC_USER_SHARDS - 1] = PTHREAD_MUTEX_INITIALIZER
+};
+static pthread_mutex_t g_wal_mutex = PTHREAD_MUTEX_INITIALIZER;
 
-#define LOCK()   pthread_mutex_lock(&g_db_mutex)
-#define UNLOCK() pthread_mutex_unlock(&g_db_mutex)
+#define LOCK()            pthread_rwlock_wrlock(&g_db_lock)
+#define RDLOCK()          pthread_rwlock_rdlock(&g_db_lock)
+#define UNLOCK()          pthread_rwlock_unlock(&g_db_lock)
+#define USER_LOCK(uid)    pthread_mutex_lock(&g_user_locks[(uid) % WC_USER_SHARDS])
+#define USER_UNLOCK(uid)  pthread_mutex_unlock(&g_user_locks[(uid) % WC_USER_SHARDS])
+
+/* 共享锁 + 用户分片锁：读写单个用户自己的行与索引 */
+#define USER_RDLOCK(uid)    do { RDLOCK(); USER_LOCK(uid); } while (0)
+#define USER_RDUNLOCK(uid)  do { USER_UNLOCK(uid); UNLOCK(); } while (0)
 
 /* ========================================================================
  * 内部辅助函数
  * ======================================================================== */
 
-static void* ensure_array(void *arr, size_t count, size_t *cap, size_t elem_size) {
-    if (count >= *cap) {
-        size_t new_cap = *cap * WC_GROWTH_FACTOR;
-        if (new_cap < WC_INIT_CAPACITY) new_cap = WC_INIT_CAPACITY;
-        void *new_arr = realloc(arr, new_cap * elem_size);
-        if (!new_arr) return NULL;
+/* 数组是否直接指向只读映射的快照文件（wc_map_db） */
+static int is_mapped(const wordcard_db_t *db, const void *arr) {
+    const char *p = arr;
+    const char *base = db->map_base;
+    return base && p >= base && p < base + db->map_size;
+}
+
+static void free_array(wordcard_db_t *db, void *arr) {
+    if (!is_mapped(db, arr)) free(arr);
+}
+
+/* 保证容量至少 count + extra；映射区首次增长时拷到堆上 */
+static void* reserve_array(wordcard_db_t *db, void *arr, size_t count, size_t extra,
+                           size_t *cap, size_t elem_size) {
+    if (count + extra <= *cap) return arr;
+    size_t new_cap = *cap * WC_GROWTH_FACTOR;
+    if (new_cap < WC_INIT_CAPACITY) new_cap = WC_INIT_CAPACITY;
+    while (new_cap < count + extra) new_cap *= WC_GROWTH_FACTOR;
+    void *new_arr;
+    if (is_mapped(db, arr)) {
+        /* 映射区不能 realloc */
+        new_arr = malloc(new_cap * elem_size);
+        if (new_arr) memcpy(new_arr, arr, count * elem_size);
+    } else {
+        new_arr = realloc(arr, new_cap * elem_size);
+    }
+    if (!new_arr) return NULL;
+    *cap = new_cap;
+    return new_arr;
+}
+
+static void* ensure_array(wordcard_db_t *db, void *arr, size_t count, size_t *cap,
+                          size_t elem_size) {
+    return reserve_array(db, arr, count, 1, cap, elem_size);
+}
+
+/* 已写入 WAL 的修改无需完整快照；未启用日志或写入失败时退回标脏 */
+static void journal_or_dirty(wordcard_db_t *db, uint16_t type,
+                             const void *payload, size_t size);
+static size_t journal_frame(char *buf, uint16_t type, const void *payload, size_t size);
+static void journal_write(wordcard_db_t *db, const char *buf, size_t len);
+
+static item_row_t* item_store_locked(wordcard_db_t *db, const item_entry_t *entry,
+                                     uint32_t id);
+
+/* ========================================================================
+ * 用户索引：每个用户一份，首次出现时创建
+ *   rows  该用户全部 mastery 下标
+ *   heap  非 NEW 记录按 next_review 的二叉最小堆（mastery_heap_pos 记录反向位置），
+ *         复习时增量调整，取 k 条到期项只触及该用户的堆顶部分
+ *   seen  按学习项下标的位图，已有掌握度记录的项置 1，找新项时逐字扫描
+ *   计数  已学项数与各 SM-2 状态的记录数，随每次状态迁移增减
+ * ======================================================================== */
+
+#define HEAP_NONE UINT32_MAX
+
+typedef struct {
+    uint32_t user_id;
+    uint32_t *rows;
+    size_t row_count;
+    size_t row_capacity;
+    uint32_t *heap;
+    size_t heap_count;
+    size_t heap_capacity;
+    uint32_t generation;            /* 不等于 db->due_generation 时需重建堆 */
+    uint64_t *seen;
+    size_t seen_words;              /* 超出部分视为未学 */
+    uint32_t seen_count;            /* seen 中置位数 */
+    uint32_t status_count[SM2_MASTERED + 1];    /* 与 generation 同步有效 */
+} user_index_t;
+
+typedef struct {
+    int_hash_t *by_id;              /* user_id → v 下标 */
+    user_index_t *v;
+    size_t count;
+    size_t capacity;
+} user_index_set_t;
+
+static void user_index_set_free(user_index_set_t *set) {
+    if (!set) return;
+    for (size_t i = 0; i < set->count; i++) {
+        free(set->v[i].rows);
+        free(set->v[i].heap);
+        free(set->v[i].seen);
+    }
+    free(set->v);
+    int_hash_free(set->by_id);
+    free(set);
+}
+
+static user_index_set_t* user_index_set_new(void) {
+    user_index_set_t *set = calloc(1, sizeof(user_index_set_t));
+    if (!set) return NULL;
+    set->by_id = int_hash_new(128);
+    if (!set->by_id) { free(set); return NULL; }
+    return set;
+}
+
+static int push_u32(uint32_t **arr, size_t *count, size_t *cap, uint32_t v) {
+    if (*count >= *cap) {
+        size_t new_cap = *cap ? *cap * WC_GROWTH_FACTOR : 16;
+        uint32_t *p = realloc(*arr, new_cap * sizeof(uint32_t));
+        if (!p) return 0;
+        *arr = p;
         *cap = new_cap;
-        return new_arr;
     }
-    return arr;
+    (*arr)[(*count)++] = v;
+    return 1;
+}
+
+/* 查找用户索引；create 时不存在则新建。返回的指针在下次新建前有效 */
+static user_index_t* user_index_get(wordcard_db_t *db, uint32_t user_id, int create) {
+    user_index_set_t *set = db->user_index;
+    int idx;
+    if (int_hash_get(set->by_id, user_id, &idx)) return &set->v[idx];
+    if (!create) return NULL;
+    
+    if (set->count >= set->capacity) {
+        size_t new_cap = set->capacity ? set->capacity * WC_GROWTH_FACTOR : 16;
+        user_index_t *p = realloc(set->v, new_cap * sizeof(user_index_t));
+        if (!p) return NULL;
+        set->v = p;
+        set->capacity = new_cap;
+    }
+    user_index_t *u = &set->v[set->count];
+    memset(u, 0, sizeof(user_index_t));
+    u->user_id = user_id;
+    u->generation = db->due_generation;
+    int_hash_set(set->by_id, user_id, (int)set->count);
+    set->count++;
+    return u;
 }
 
-static wordcard_db_t *g_sort_db = NULL;
+static inline int due_less(const wordcard_db_t *db, uint32_t a, uint32_t b) {
+    uint32_t da = db->mastery[a].next_review, dbv = db->mastery[b].next_review;
+    return da < dbv || (da == dbv && a < b);
+}
 
-static int compare_mastery_by_due(const void *a, const void *b) {
-    uint32_t idx_a = *(const uint32_t*)a;
-    uint32_t idx_b = *(const uint32_t*)b;
-    uint32_t due_a = g_sort_db->mastery[idx_a].next_review;
-    uint32_t due_b = g_sort_db->mastery[idx_b].next_review;
-    if (due_a < due_b) return -1;
-    if (due_a > due_b) return 1;
-    return 0;
+static inline void heap_set(wordcard_db_t *db, user_index_t *u, size_t pos, uint32_t m_idx) {
+    u->heap[pos] = m_idx;
+    db->mastery_heap_pos[m_idx] = (uint32_t)pos;
 }
 
-static void rebuild_due_index(wordcard_db_t *db) {
-    if (!db->mastery_due_dirty && db->mastery_due_sorted_count == db->mastery_count) {
-        return;
+static void heap_sift_up(wordcard_db_t *db, user_index_t *u, size_t pos) {
+    uint32_t m_idx = u->heap[pos];
+    while (pos > 0) {
+        size_t parent = (pos - 1) / 2;
+        if (!due_less(db, m_idx, u->heap[parent])) break;
+        heap_set(db, u, pos, u->heap[parent]);
+        pos = parent;
     }
-    
-    if (db->mastery_capacity > 0 && !db->mastery_due_sorted) {
-        db->mastery_due_sorted = malloc(db->mastery_capacity * sizeof(uint32_t));
+    heap_set(db, u, pos, m_idx);
+}
+
+static void heap_sift_down(wordcard_db_t *db, user_index_t *u, size_t pos) {
+    uint32_t m_idx = u->heap[pos];
+    for (;;) {
+        size_t child = pos * 2 + 1;
+        if (child >= u->heap_count) break;
+        if (child + 1 < u->heap_count && due_less(db, u->heap[child + 1], u->heap[child])) {
+            child++;
+        }
+        if (!due_less(db, u->heap[child], m_idx)) break;
+        heap_set(db, u, pos, u->heap[child]);
+        pos = child;
     }
-    if (!db->mastery_due_sorted) return;
-    
-    db->mastery_due_sorted_count = db->mastery_count;
-    for (size_t i = 0; i < db->mastery_count; i++) {
-        db->mastery_due_sorted[i] = (uint32_t)i;
+    heap_set(db, u, pos, m_idx);
+}
+
+/* 从 rows 重新建堆：O(该用户记录数) */
+static int due_heap_rebuild(wordcard_db_t *db, user_index_t *u) {
+    u->heap_count = 0;
+    memset(u->status_count, 0, sizeof(u->status_count));
+    for (size_t i = 0; i < u->row_count; i++) {
+        uint32_t m_idx = u->rows[i];
+        uint8_t status = db->mastery[m_idx].sm2_status;
+        db->mastery_heap_pos[m_idx] = HEAP_NONE;
+        if (status <= SM2_MASTERED) u->status_count[status]++;
+        if (status == SM2_NEW) continue;
+        if (!push_u32(&u->heap, &u->heap_count, &u->heap_capacity, m_idx)) return 0;
+        db->mastery_heap_pos[m_idx] = (uint32_t)(u->heap_count - 1);
+    }
+    for (size_t i = u->heap_count / 2; i-- > 0; ) heap_sift_down(db, u, i);
+    u->generation = db->due_generation;
+    return 1;
+}
+
+/* mastery[m_idx] 经过一次 SM-2 迁移后调用（调用方须持有锁） */
+static void mastery_changed_locked(wordcard_db_t *db, uint32_t m_idx, uint8_t old_status) {
+    user_index_t *u = user_index_get(db, db->mastery[m_idx].user_id, 0);
+    if (!u || u->generation != db->due_generation) return;   /* 查询时整堆重建 */
+    
+    uint8_t status = db->mastery[m_idx].sm2_status;
+    if (old_status <= SM2_MASTERED) u->status_count[old_status]--;
+    if (status <= SM2_MASTERED) u->status_count[status]++;
+    
+    uint32_t pos = db->mastery_heap_pos[m_idx];
+    int want = status != SM2_NEW;
+    if (pos == HEAP_NONE) {
+        if (!want) return;
+        if (!push_u32(&u->heap, &u->heap_count, &u->heap_capacity, m_idx)) {
+            u->generation = db->due_generation - 1;
+            return;
+        }
+        heap_sift_up(db, u, u->heap_count - 1);
+    } else if (!want) {
+        db->mastery_heap_pos[m_idx] = HEAP_NONE;
+        uint32_t last = u->heap[--u->heap_count];
+        if (pos < u->heap_count) {
+            heap_set(db, u, pos, last);
+            heap_sift_up(db, u, pos);
+            heap_sift_down(db, u, db->mastery_heap_pos[last]);
+        }
+    } else {
+        heap_sift_up(db, u, pos);
+        heap_sift_down(db, u, db->mastery_heap_pos[m_idx]);
+    }
+}
+
+/* 标记 items[item_idx] 已学；位图按学习项容量扩展 */
+static int seen_set(wordcard_db_t *db, user_index_t *u, size_t item_idx) {
+    size_t w = item_idx / 64;
+    if (w >= u->seen_words) {
+        size_t words = (db->item_capacity + 63) / 64;
+        if (words <= w) words = w + 1;
+        uint64_t *p = realloc(u->seen, words * sizeof(uint64_t));
+        if (!p) return 0;
+        memset(p + u->seen_words, 0, (words - u->seen_words) * sizeof(uint64_t));
+        u->seen = p;
+        u->seen_words = words;
+    }
+    uint64_t bit = 1ULL << (item_idx % 64);
+    if (!(u->seen[w] & bit)) {
+        u->seen[w] |= bit;
+        u->seen_count++;
+    }
+    return 1;
+}
+
+/* 新建 mastery 行后登记到所属用户（调用方须持有锁） */
+static int user_index_add_row(wordcard_db_t *db, uint32_t m_idx) {
+    user_index_t *u = user_index_get(db, db->mastery[m_idx].user_id, 1);
+    if (!u) return 0;
+    db->mastery_heap_pos[m_idx] = HEAP_NONE;
+    if (db->mastery[m_idx].sm2_status <= SM2_MASTERED) {
+        u->status_count[db->mastery[m_idx].sm2_status]++;
     }
     
-    if (db->mastery_count > 1) {
-        g_sort_db = db;
-        qsort(db->mastery_due_sorted, db->mastery_count, sizeof(uint32_t), compare_mastery_by_due);
-        g_sort_db = NULL;
+    /* 学习项尚不存在时不置位，找新项时按 mastery_hash 兜底 */
+    int item_idx;
+    if (int_hash_get((int_hash_t*)db->id_hash, db->mastery[m_idx].item_id, &item_idx) &&
+        !seen_set(db, u, (size_t)item_idx)) {
+        return 0;
     }
+    return push_u32(&u->rows, &u->row_count, &u->row_capacity, m_idx);
+}
+
+/* 重建全部用户索引；到期堆留待首次查询时再建 */
+static int rebuild_user_index(wordcard_db_t *db) {
+    user_index_set_free(db->user_index);
+    db->user_index = user_index_set_new();
+    if (!db->user_index) return 0;
     
-    db->mastery_due_dirty = 0;
+    free(db->mastery_heap_pos);
+    db->mastery_heap_pos = malloc((db->mastery_capacity ? db->mastery_capacity : 1) *
+                                  sizeof(uint32_t));
+    if (!db->mastery_heap_pos) return 0;
+    
+    db->due_generation++;
+    for (size_t i = 0; i < db->mastery_count; i++) {
+        if (!user_index_add_row(db, (uint32_t)i)) return 0;
+    }
+    return 1;
 }
 
 static void rebuild_indexes(wordcard_db_t *db) {
@@ -347,10 +692,10 @@ static void rebuild_indexes(wordcard_db_t *db) {
     }
     
     /* 重建 question_hash */
-    str_hash_free((str_hash_t*)db->question_hash);
-    db->question_hash = str_hash_new(db->item_capacity * 2 + 1);
+    qindex_free((qindex_t*)db->question_hash);
+    db->question_hash = qindex_new(db->item_count);
     for (size_t i = 0; i < db->item_count; i++) {
-        str_hash_set((str_hash_t*)db->question_hash, db->items[i].question, (int)i);
+        qindex_insert(db, (uint32_t)i);
     }
     
     /* 重建 source_hash */
@@ -390,9 +735,8 @@ static void rebuild_indexes(wordcard_db_t *db) {
                       db->stats[i].user_id, db->stats[i].date, (int)i);
     }
     
-    /* 重建到期复习索引 */
-    db->mastery_due_dirty = 1;
-    rebuild_due_index(db);
+    /* 重建按用户的复习索引 */
+    rebuild_user_index(db);
 }
 
 /* ========================================================================
@@ -404,7 +748,12 @@ wordcard_db_t* wc_db_init(void) {
     if (!db) return NULL;
     
     db->item_capacity = WC_INIT_CAPACITY;
-    db->items = calloc(db->item_capacity, sizeof(item_entry_t));
+    db->items = calloc(db->item_capacity, sizeof(item_row_t));
+    
+    /* 字符串堆：偏移 0 固定为空串 */
+    db->string_capacity = 4096;
+    db->strings = calloc(db->string_capacity, 1);
+    db->string_size = 1;
     
     db->source_capacity = 64;
     db->sources = calloc(db->source_capacity, sizeof(content_source_t));
@@ -426,16 +775,16 @@ wordcard_db_t* wc_db_init(void) {
     
     db->dirty = 0;
     db->db_path[0] = '\0';
-    db->mastery_due_dirty = 1;
+    db->wal_fd = -1;
     
-    if (!db->items || !db->sources || !db->chapters || 
+    if (!db->items || !db->strings || !db->sources || !db->chapters || 
         !db->users || !db->mastery || !db->progress || !db->stats) {
         wc_db_free(db);
         return NULL;
     }
     
     /* 创建空哈希表 */
-    db->question_hash = str_hash_new(1024);
+    db->question_hash = qindex_new(0);
     db->id_hash = int_hash_new(1024);
     db->source_hash = int_hash_new(128);
     db->user_hash = str_hash_new(1024);
@@ -443,8 +792,12 @@ wordcard_db_t* wc_db_init(void) {
     db->mastery_hash = pair_hash_new(1024);
     db->stat_hash = pair_hash_new(1024);
     
-    /* 分配到期复习排序数组 */
-    db->mastery_due_sorted = malloc(db->mastery_capacity * sizeof(uint32_t));
+    db->user_index = user_index_set_new();
+    db->mastery_heap_pos = malloc(db->mastery_capacity * sizeof(uint32_t));
+    if (!db->user_index || !db->mastery_heap_pos) {
+        wc_db_free(db);
+        return NULL;
+    }
     
     return db;
 }
@@ -452,7 +805,9 @@ wordcard_db_t* wc_db_init(void) {
 void wc_db_free(wordcard_db_t *db) {
     if (!db) return;
     
-    str_hash_free((str_hash_t*)db->question_hash);
+    if (db->wal_fd >= 0) close(db->wal_fd);
+    
+    qindex_free((qindex_t*)db->question_hash);
     int_hash_free((int_hash_t*)db->id_hash);
     int_hash_free((int_hash_t*)db->source_hash);
     str_hash_free((str_hash_t*)db->user_hash);
@@ -460,15 +815,18 @@ void wc_db_free(wordcard_db_t *db) {
     pair_hash_free((pair_hash_t*)db->mastery_hash);
     pair_hash_free((pair_hash_t*)db->stat_hash);
     
-    free(db->mastery_due_sorted);
-    
-    free(db->items);
-    free(db->sources);
-    free(db->chapters);
-    free(db->users);
-    free(db->mastery);
-    free(db->progress);
-    free(db->stats);
+    user_index_set_free(db->user_index);
+    free(db->mastery_heap_pos);
+    
+    free_array(db, db->items);
+    free_array(db, db->strings);
+    free_array(db, db->sources);
+    free_array(db, db->chapters);
+    free_array(db, db->users);
+    free_array(db, db->mastery);
+    free_array(db, db->progress);
+    free_array(db, db->stats);
+    if (db->map_base) munmap(db->map_base, db->map_size);
     free(db);
 }
 
@@ -476,6 +834,100 @@ void wc_db_free(wordcard_db_t *db) {
  * 磁盘加载与保存（结构体直写磁盘）
  * ======================================================================== */
 
+/* rename 之后同步父目录，使目录项本身也持久化 */
+static void fsync_parent_dir(const char *path) {
+    char dir[512];
+    const char *slash = strrchr(path, '/');
+    if (!slash) {
+        strcpy(dir, ".");
+    } else if (slash == path) {
+        strcpy(dir, "/");
+    } else {
+        size_t n = (size_t)(slash - path);
+        if (n >= sizeof(dir)) return;
+        memcpy(dir, path, n);
+        dir[n] = '\0';
+    }
+    int fd = open(dir, O_RDONLY | O_DIRECTORY);
+    if (fd < 0) return;
+    fsync(fd);
+    close(fd);
+}
+
+static int header_is_v3(const wc_file_header_t *header) {
+    return memcmp(header->magic, WC_MAGIC_V3, 4) == 0 && header->version == WC_VERSION_V3;
+}
+
+static int header_is_v4(const wc_file_header_t *header) {
+    return memcmp(header->magic, WC_MAGIC_V4, 4) == 0 && header->version == WC_VERSION_V4;
+}
+
+static int header_is_current(const wc_file_header_t *header) {
+    return memcmp(header->magic, WC_MAGIC, 4) == 0 && header->version == WC_VERSION;
+}
+
+/* v3 定长学习项逐块转换为紧凑行 */
+static int load_items_v3(wordcard_db_t *db, FILE *fp, size_t count) {
+    enum { CHUNK = 64 };
+    item_entry_t *buf = malloc(CHUNK * sizeof(item_entry_t));
+    if (!buf) return 0;
+    
+    int ok = 1;
+    size_t done = 0;
+    while (ok && done < count) {
+        size_t n = count - done < CHUNK ? count - done : CHUNK;
+        if (fread(buf, sizeof(item_entry_t), n, fp) != n) { ok = 0; break; }
+        for (size_t i = 0; i < n; i++) {
+            if (!item_store_locked(db, &buf[i], buf[i].id)) { ok = 0; break; }
+        }
+        done += n;
+    }
+    free(buf);
+    return ok;
+}
+
+/* 字符串堆须以 NUL 结尾，且所有行的偏移都落在堆内 */
+static int items_valid(const wordcard_db_t *db) {
+    if (db->string_size == 0 || db->strings[0] != '\0' ||
+        db->strings[db->string_size - 1] != '\0') return 0;
+    for (size_t i = 0; i < db->item_count; i++) {
+        const item_row_t *r = &db->items[i];
+        if (r->question >= db->string_size || r->answer >= db->string_size ||
+            r->explanation >= db->string_size || r->hint >= db->string_size ||
+            r->tags >= db->string_size) return 0;
+    }
+    for (size_t i = 0; i < db->source_count; i++) {
+        if (db->sources[i].page_hashes >= db->string_size) return 0;
+    }
+    return 1;
+}
+
+/* v3/v4 载体行 → v5（指纹字段清零） */
+static void source_upgrade(const content_source_v4_t *old, content_source_t *out) {
+    memset(out, 0, sizeof(*out));
+    out->id = old->id;
+    out->type = old->type;
+    memcpy(out->name, old->name, sizeof(out->name));
+    memcpy(out->file_path, old->file_path, sizeof(out->file_path));
+    out->item_start = old->item_start;
+    out->item_count = old->item_count;
+    out->created_at = old->created_at;
+}
+
+static int load_sources_v4(wordcard_db_t *db, FILE *fp, size_t count) {
+    enum { CHUNK = 64 };
+    content_source_v4_t buf[CHUNK];
+    size_t done = 0;
+    while (done < count) {
+        size_t n = count - done < CHUNK ? count - done : CHUNK;
+        if (fread(buf, sizeof(content_source_v4_t), n, fp) != n) return 0;
+        for (size_t i = 0; i < n; i++)
+            source_upgrade(&buf[i], &db->sources[done + i]);
+        done += n;
+    }
+    return 1;
+}
+
 wordcard_db_t* wc_load_db(const char *path) {
     FILE *fp = fopen(path, "rb");
     if (!fp) return NULL;
@@ -486,8 +938,10 @@ wordcard_db_t* wc_load_db(const char *path) {
         return NULL;
     }
     
-    /* 验证魔数和版本 */
-    if (memcmp(header.magic, WC_MAGIC, 4) != 0 || header.version != WC_VERSION) {
+    /* 验证魔数和版本（v3 加载时转换为紧凑格式，v3/v4 的载体行补齐指纹字段） */
+    int is_v3 = header_is_v3(&header);
+    int is_v4 = header_is_v4(&header);
+    if (!is_v3 && !is_v4 && !header_is_current(&header)) {
         fclose(fp);
         return NULL;
     }
@@ -502,13 +956,33 @@ wordcard_db_t* wc_load_db(const char *path) {
     
     /* 加载学习项表 */
     if (ok && header.item_count > 0) {
-        db->item_count = header.item_count;
-        while (db->item_capacity < db->item_count) {
+        while (db->item_capacity < header.item_count) {
             db->item_capacity *= WC_GROWTH_FACTOR;
         }
-        db->items = realloc(db->items, db->item_capacity * sizeof(item_entry_t));
-        if (!db->items || fread(db->items, sizeof(item_entry_t), db->item_count, fp) != db->item_count) {
+        db->items = realloc(db->items, db->item_capacity * sizeof(item_row_t));
+        if (!db->items) {
             ok = 0;
+        } else if (is_v3) {
+            ok = load_items_v3(db, fp, header.item_count);
+        } else {
+            db->item_count = header.item_count;
+            if (fread(db->items, sizeof(item_row_t), db->item_count, fp) != db->item_count)
+                ok = 0;
+        }
+    }
+    
+    /* 加载字符串堆（v4） */
+    if (ok && !is_v3) {
+        if (header.string_size > db->string_capacity) {
+            db->string_capacity = header.string_size;
+            char *p = realloc(db->strings, db->string_capacity);
+            if (!p) ok = 0; else db->strings = p;
+        }
+        if (ok) {
+            db->string_size = header.string_size;
+            if (db->string_size > 0 &&
+                fread(db->strings, 1, db->string_size, fp) != db->string_size)
+                ok = 0;
         }
     }
     
@@ -519,10 +993,15 @@ wordcard_db_t* wc_load_db(const char *path) {
             db->source_capacity *= WC_GROWTH_FACTOR;
         }
         db->sources = realloc(db->sources, db->source_capacity * sizeof(content_source_t));
-        if (!db->sources || fread(db->sources, sizeof(content_source_t), db->source_count, fp) != db->source_count) {
+        if (!db->sources) {
+            ok = 0;
+        } else if (is_v3 || is_v4) {
+            ok = load_sources_v4(db, fp, db->source_count);
+        } else if (fread(db->sources, sizeof(content_source_t), db->source_count, fp) != db->source_count) {
             ok = 0;
         }
     }
+    if (ok && !is_v3 && !items_valid(db)) ok = 0;
     
     /* 加载章节表 */
     if (ok && header.chapter_count > 0) {
@@ -598,9 +1077,87 @@ wordcard_db_t* wc_load_db(const char *path) {
     return db;
 }
 
-int wc_save_db(wordcard_db_t *db, const char *path) {
-    if (!db) return WC_ERR_INVALID;
+/* 把一张表指向映射区；空表保留 wc_db_init 分配的堆数组 */
+static int map_table(wordcard_db_t *db, size_t *offset, uint32_t count, size_t elem_size,
+                     void **arr, size_t *out_count, size_t *out_cap) {
+    if (count == 0) return 1;
+    size_t bytes = (size_t)count * elem_size;
+    if (*offset + bytes > db->map_size) return 0;
+    free(*arr);
+    *arr = (char*)db->map_base + *offset;
+    *out_count = count;
+    *out_cap = count;
+    *offset += bytes;
+    return 1;
+}
+
+wordcard_db_t* wc_map_db(const char *path) {
+    int fd = open(path, O_RDONLY);
+    if (fd < 0) return NULL;
+    
+    struct stat st;
+    if (fstat(fd, &st) != 0 || (size_t)st.st_size < sizeof(wc_file_header_t)) {
+        close(fd);
+        return NULL;
+    }
+    
+    /* MAP_PRIVATE：多进程共享同一份页缓存，原地修改只在本进程写时复制 */
+    size_t size = (size_t)st.st_size;
+    void *base = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (base == MAP_FAILED) return NULL;
+    
+    const wc_file_header_t *header = base;
+    if (header_is_v3(header) || header_is_v4(header)) {
+        /* 旧格式的行布局与当前不同，无法直接映射：走拷贝转换 */
+        munmap(base, size);
+        return wc_load_db(path);
+    }
+    if (!header_is_current(header)) {
+        munmap(base, size);
+        return NULL;
+    }
+    
+    wordcard_db_t *db = wc_db_init();
+    if (!db) { munmap(base, size); return NULL; }
+    db->map_base = base;
+    db->map_size = size;
     
+    strncpy(db->db_path, path, sizeof(db->db_path)-1);
+    db->db_path[sizeof(db->db_path)-1] = '\0';
+    
+    size_t off = sizeof(wc_file_header_t);
+    int ok =
+        map_table(db, &off, header->item_count, sizeof(item_row_t),
+                  (void**)&db->items, &db->item_count, &db->item_capacity) &&
+        map_table(db, &off, header->string_size, 1,
+                  (void**)&db->strings, &db->string_size, &db->string_capacity) &&
+        map_table(db, &off, header->source_count, sizeof(content_source_t),
+                  (void**)&db->sources, &db->source_count, &db->source_capacity) &&
+        map_table(db, &off, header->chapter_count, sizeof(chapter_t),
+                  (void**)&db->chapters, &db->chapter_count, &db->chapter_capacity) &&
+        map_table(db, &off, header->user_count, sizeof(user_t),
+                  (void**)&db->users, &db->user_count, &db->user_capacity) &&
+        map_table(db, &off, header->mastery_count, sizeof(user_item_mastery_t),
+                  (void**)&db->mastery, &db->mastery_count, &db->mastery_capacity) &&
+        map_table(db, &off, header->progress_count, sizeof(reading_progress_t),
+                  (void**)&db->progress, &db->progress_count, &db->progress_capacity) &&
+        map_table(db, &off, header->stat_count, sizeof(daily_stat_t),
+                  (void**)&db->stats, &db->stat_count, &db->stat_capacity);
+    
+    if (!ok || !items_valid(db)) {
+        wc_db_free(db);
+        return NULL;
+    }
+    
+    rebuild_indexes(db);
+    db->dirty = 0;
+    return db;
+}
+
+/* 写完整快照（调用方须持有独占锁：复习线程在共享锁下原地改行，
+ * 不排除它们会写出半条记录） */
+static int save_db_locked(wordcard_db_t *db, const char *path) {
     const char *target = path ? path : db->db_path;
     if (!target || !target[0]) return WC_ERR_INVALID;
     
@@ -622,6 +1179,9 @@ int wc_save_db(wordcard_db_t *db, const char *path) {
     header.mastery_count = (uint32_t)db->mastery_count;
     header.progress_count = (uint32_t)db->progress_count;
     header.stat_count = (uint32_t)db->stat_count;
+    /* 堆补齐到 8 字节，保证映射后其后各表对齐 */
+    size_t heap_padded = (db->string_size + 7) & ~(size_t)7;
+    header.string_size = (uint32_t)heap_padded;
     
     if (fwrite(&header, sizeof(header), 1, fp) != 1) {
         fclose(fp); remove(tmp_path); return WC_ERR_FILE;
@@ -629,9 +1189,16 @@ int wc_save_db(wordcard_db_t *db, const char *path) {
     
     /* 按顺序写入各数组 */
     if (db->item_count > 0) {
-        if (fwrite(db->items, sizeof(item_entry_t), db->item_count, fp) != db->item_count)
+        if (fwrite(db->items, sizeof(item_row_t), db->item_count, fp) != db->item_count)
             goto fail;
     }
+    if (fwrite(db->strings, 1, db->string_size, fp) != db->string_size)
+        goto fail;
+    if (heap_padded > db->string_size) {
+        static const char zeros[8] = {0};
+        size_t pad = heap_padded - db->string_size;
+        if (fwrite(zeros, 1, pad, fp) != pad) goto fail;
+    }
     if (db->source_count > 0) {
         if (fwrite(db->sources, sizeof(content_source_t), db->source_count, fp) != db->source_count)
             goto fail;
@@ -657,7 +1224,11 @@ int wc_save_db(wordcard_db_t *db, const char *path) {
             goto fail;
     }
     
-    if (fflush(fp) != 0 || fclose(fp) != 0) {
+    /* 落盘后再替换，保证 rename 之后的文件内容完整 */
+    int rc = fflush(fp);
+    if (rc == 0) rc = fsync(fileno(fp));
+    if (fclose(fp) != 0) rc = -1;
+    if (rc != 0) {
         remove(tmp_path); return WC_ERR_FILE;
     }
     
@@ -665,6 +1236,7 @@ int wc_save_db(wordcard_db_t *db, const char *path) {
     if (rename(tmp_path, target) != 0) {
         remove(tmp_path); return WC_ERR_FILE;
     }
+    fsync_parent_dir(target);
     
     db->dirty = 0;
     return WC_OK;
@@ -675,55 +1247,271 @@ fail:
     return WC_ERR_FILE;
 }
 
+int wc_save_db(wordcard_db_t *db, const char *path) {
+    if (!db) return WC_ERR_INVALID;
+    LOCK();
+    int ret = save_db_locked(db, path);
+    UNLOCK();
+    return ret;
+}
+
 void wc_mark_dirty(wordcard_db_t *db) {
-    if (db) db->dirty = 1;
+    /* 持共享锁的路径也会标脏，用原子写避免数据竞争 */
+    if (db) __atomic_store_n(&db->dirty, 1, __ATOMIC_RELAXED);
 }
 
 /* ========================================================================
  * 学习项操作
  * ======================================================================== */
 
+/* 保证字符串堆还能追加 extra 字节；调用方须持有锁 */
+static int heap_reserve(wordcard_db_t *db, size_t extra) {
+    size_t need = db->string_size + extra;
+    if (need > UINT32_MAX) return 0;
+    if (need <= db->string_capacity) return 1;
+    
+    size_t cap = db->string_capacity ? db->string_capacity : 4096;
+    while (cap < need) cap *= WC_GROWTH_FACTOR;
+    char *p;
+    if (is_mapped(db, db->strings)) {
+        p = malloc(cap);
+        if (p) memcpy(p, db->strings, db->string_size);
+    } else {
+        p = realloc(db->strings, cap);
+    }
+    if (!p) return 0;
+    db->strings = p;
+    db->string_capacity = cap;
+    return 1;
+}
+
+/* 追加字符串到堆，返回偏移（空串固定为 0）；调用方须持有锁 */
+static int heap_append(wordcard_db_t *db, const char *str, size_t max_len, uint32_t *out) {
+    size_t len = strnlen(str, max_len);
+    if (len == 0) { *out = 0; return 1; }
+    if (!heap_reserve(db, len + 1)) return 0;
+    
+    *out = (uint32_t)db->string_size;
+    memcpy(db->strings + db->string_size, str, len);
+    db->strings[db->string_size + len] = '\0';
+    db->string_size += len + 1;
+    return 1;
+}
+
+/* 定长字段最多存 sizeof-1 字节：与查重用的副本、item_expand/item_decode 的上限一致 */
+#define FIELD_MAX(type, field) (sizeof(((type*)0)->field) - 1)
+
+/* 查重键：定长 question 未必以 NUL 结尾，截到 FIELD_MAX 与存储一致 */
+static void item_question_key(const item_entry_t *e, char out[sizeof(e->question)]) {
+    size_t len = strnlen(e->question, FIELD_MAX(item_entry_t, question));
+    memcpy(out, e->question, len);
+    out[len] = '\0';
+}
+
+/* 完整学习项 → 紧凑行（只存储，不更新索引）；失败时回滚字符串堆 */
+static item_row_t* item_store_locked(wordcard_db_t *db, const item_entry_t *entry,
+                                     uint32_t id) {
+    void *new_arr = ensure_array(db, db->items, db->item_count, &db->item_capacity, 
+                                  sizeof(item_row_t));
+    if (!new_arr) return NULL;
+    db->items = new_arr;
+    
+    size_t heap_mark = db->string_size;
+    item_row_t row;
+    memset(&row, 0, sizeof(row));
+    if (!heap_append(db, entry->question, FIELD_MAX(item_entry_t, question), &row.question) ||
+        !heap_append(db, entry->answer, FIELD_MAX(item_entry_t, answer), &row.answer) ||
+        !heap_append(db, entry->explanation, FIELD_MAX(item_entry_t, explanation), &row.explanation) ||
+        !heap_append(db, entry->hint, FIELD_MAX(item_entry_t, hint), &row.hint) ||
+        !heap_append(db, entry->tags, FIELD_MAX(item_entry_t, tags), &row.tags)) {
+        db->string_size = heap_mark;
+        return NULL;
+    }
+    row.id = id;
+    row.difficulty = entry->difficulty;
+    row.source_id = entry->source_id;
+    row.category = entry->category;
+    row.frequency = entry->frequency;
+    
+    item_row_t *v = &db->items[db->item_count++];
+    *v = row;
+    return v;
+}
+
+/* 以指定 ID 追加学习项（调用方须持有锁，且已查重） */
+static item_row_t* item_append_locked(wordcard_db_t *db, const item_entry_t *entry,
+                                      uint32_t id) {
+    item_row_t *v = item_store_locked(db, entry, id);
+    if (!v) return NULL;
+    
+    /* 更新索引 */
+    qindex_insert(db, (uint32_t)(db->item_count - 1));
+    int_hash_set((int_hash_t*)db->id_hash, v->id, (int)(db->item_count - 1));
+    return v;
+}
+
+/* 紧凑行 → 完整学习项 */
+static void item_expand(const wordcard_db_t *db, const item_row_t *r, item_entry_t *out) {
+    memset(out, 0, sizeof(item_entry_t));
+    out->id = r->id;
+    strncpy(out->question, wc_str(db, r->question), sizeof(out->question) - 1);
+    strncpy(out->answer, wc_str(db, r->answer), sizeof(out->answer) - 1);
+    strncpy(out->explanation, wc_str(db, r->explanation), sizeof(out->explanation) - 1);
+    strncpy(out->hint, wc_str(db, r->hint), sizeof(out->hint) - 1);
+    strncpy(out->tags, wc_str(db, r->tags), sizeof(out->tags) - 1);
+    out->difficulty = r->difficulty;
+    out->source_id = r->source_id;
+    out->category = r->category;
+    out->frequency = r->frequency;
+}
+
+/* 学习项日志记录：行 + 问题/答案/解析/提示/标签五个 NUL 结尾字符串 */
+static size_t item_encode(const wordcard_db_t *db, const item_row_t *r, char *buf) {
+    memcpy(buf, r, sizeof(item_row_t));
+    size_t pos = sizeof(item_row_t);
+    const uint32_t offs[5] = { r->question, r->answer, r->explanation, r->hint, r->tags };
+    for (int i = 0; i < 5; i++) {
+        const char *str = wc_str(db, offs[i]);
+        size_t len = strlen(str) + 1;
+        memcpy(buf + pos, str, len);
+        pos += len;
+    }
+    return pos;
+}
+
+static int item_decode(const char *buf, size_t size, item_entry_t *out) {
+    if (size < sizeof(item_row_t) + 5) return 0;
+    item_row_t r;
+    memcpy(&r, buf, sizeof(r));
+    memset(out, 0, sizeof(item_entry_t));
+    
+    char *fields[5] = { out->question, out->answer, out->explanation, out->hint, out->tags };
+    const size_t caps[5] = {
+        sizeof(out->question), sizeof(out->answer), sizeof(out->explanation),
+        sizeof(out->hint), sizeof(out->tags),
+    };
+    size_t pos = sizeof(item_row_t);
+    for (int i = 0; i < 5; i++) {
+        const char *end = memchr(buf + pos, '\0', size - pos);
+        if (!end) return 0;
+        size_t len = (size_t)(end - (buf + pos));
+        if (len >= caps[i]) return 0;
+        memcpy(fields[i], buf + pos, len);
+        pos += len + 1;
+    }
+    out->id = r.id;
+    out->difficulty = r.difficulty;
+    out->source_id = r.source_id;
+    out->category = r.category;
+    out->frequency = r.frequency;
+    return 1;
+}
+
 uint32_t wc_add_item(wordcard_db_t *db, const item_entry_t *entry) {
     if (!db || !entry) return 0;
     
+    char question[sizeof(entry->question)];
+    item_question_key(entry, question);
+    
     LOCK();
     
     /* 检查是否已存在 */
     int idx;
-    if (str_hash_get((str_hash_t*)db->question_hash, entry->question, &idx)) {
+    if (qindex_get(db, question, &idx)) {
         UNLOCK();
         return 0; /* 已存在 */
     }
     
-    /* 扩容 */
-    void *new_arr = ensure_array(db->items, db->item_count, &db->item_capacity, 
-                                  sizeof(item_entry_t));
-    if (!new_arr) { UNLOCK(); return 0; }
-    db->items = new_arr;
-    
     /* 分配新ID */
     uint32_t new_id = (db->item_count > 0) ? db->items[db->item_count - 1].id + 1 : 1;
     
-    /* 复制数据 */
-    item_entry_t *v = &db->items[db->item_count];
-    memcpy(v, entry, sizeof(item_entry_t));
-    v->id = new_id;
-    db->item_count++;
-    
-    /* 更新索引 */
-    str_hash_set((str_hash_t*)db->question_hash, v->question, (int)(db->item_count - 1));
-    int_hash_set((int_hash_t*)db->id_hash, v->id, (int)(db->item_count - 1));
+    item_row_t *v = item_append_locked(db, entry, new_id);
+    if (!v) { UNLOCK(); return 0; }
     
-    wc_mark_dirty(db);
+    char rec[WC_WAL_MAX_PAYLOAD];
+    journal_or_dirty(db, WAL_ITEM_ROW, rec, item_encode(db, v, rec));
     UNLOCK();
     return new_id;
 }
 
-item_entry_t* wc_find_item_by_question(wordcard_db_t *db, const char *question) {
-    if (!db || !question) return NULL;
+/* 批量日志缓冲：攒满后一次 write */
+#define WC_WAL_BATCH_SIZE (64 * 1024)
+
+int wc_add_items_bulk(wordcard_db_t *db, const item_entry_t *entries, size_t n,
+                      uint32_t *out_ids) {
+    if (!db || (!entries && n > 0)) return WC_ERR_INVALID;
+    if (n == 0) return 0;
+    
+    /* 字符串堆按上界一次预留（含重复项），插入过程中不再扩容 */
+    size_t heap_need = 0;
+    for (size_t i = 0; i < n; i++) {
+        const item_entry_t *e = &entries[i];
+        heap_need += strnlen(e->question, FIELD_MAX(item_entry_t, question)) + 1
+                   + strnlen(e->answer, FIELD_MAX(item_entry_t, answer)) + 1
+                   + strnlen(e->explanation, FIELD_MAX(item_entry_t, explanation)) + 1
+                   + strnlen(e->hint, FIELD_MAX(item_entry_t, hint)) + 1
+                   + strnlen(e->tags, FIELD_MAX(item_entry_t, tags)) + 1;
+    }
+    
     LOCK();
+    void *new_arr = reserve_array(db, db->items, db->item_count, n,
+                                  &db->item_capacity, sizeof(item_row_t));
+    if (!new_arr) { UNLOCK(); return WC_ERR_MEMORY; }
+    db->items = new_arr;
+    if (!heap_reserve(db, heap_need) || !qindex_reserve(db, n)) {
+        UNLOCK();
+        return WC_ERR_MEMORY;
+    }
+    int_hash_t *ids = db->id_hash;
+    size_t id_need = (size_t)((float)(ids->count + n) / HASH_LOAD_FACTOR) + 1;
+    if (id_need > ids->size) int_hash_resize(ids, id_need);
+    
+    char *batch = (db->wal_fd >= 0) ? malloc(WC_WAL_BATCH_SIZE) : NULL;
+    size_t batch_len = 0;
+    char rec[WC_WAL_MAX_PAYLOAD];
+    
+    uint32_t next_id = (db->item_count > 0) ? db->items[db->item_count - 1].id + 1 : 1;
+    int added = 0;
+    for (size_t i = 0; i < n; i++) {
+        if (out_ids) out_ids[i] = 0;
+        
+        char question[sizeof(entries[i].question)];
+        item_question_key(&entries[i], question);
+        
+        /* 与已有项及本批前面的项查重（插入即入索引） */
+        int idx;
+        if (qindex_get(db, question, &idx)) continue;
+        
+        item_row_t *v = item_append_locked(db, &entries[i], next_id);
+        if (!v) break;                          /* 已预留，不应发生 */
+        if (out_ids) out_ids[i] = next_id;
+        next_id++;
+        added++;
+        
+        size_t size = item_encode(db, v, rec);
+        if (batch) {
+            if (batch_len + sizeof(wc_wal_record_t) + size > WC_WAL_BATCH_SIZE) {
+                journal_write(db, batch, batch_len);
+                batch_len = 0;
+            }
+            batch_len += journal_frame(batch + batch_len, WAL_ITEM_ROW, rec, size);
+        } else {
+            journal_or_dirty(db, WAL_ITEM_ROW, rec, size);
+        }
+    }
+    if (batch) {
+        if (batch_len > 0) journal_write(db, batch, batch_len);
+        free(batch);
+    }
+    UNLOCK();
+    return added;
+}
+
+item_row_t* wc_find_item_by_question(wordcard_db_t *db, const char *question) {
+    if (!db || !question) return NULL;
+    RDLOCK();
     int idx;
-    if (str_hash_get((str_hash_t*)db->question_hash, question, &idx)) {
+    if (qindex_get(db, question, &idx)) {
         UNLOCK();
         return &db->items[idx];
     }
@@ -731,9 +1519,9 @@ item_entry_t* wc_find_item_by_question(wordcard_db_t *db, const char *question)
     return NULL;
 }
 
-item_entry_t* wc_find_item_by_id(wordcard_db_t *db, uint32_t item_id) {
+item_row_t* wc_find_item_by_id(wordcard_db_t *db, uint32_t item_id) {
     if (!db) return NULL;
-    LOCK();
+    RDLOCK();
     int idx;
     if (int_hash_get((int_hash_t*)db->id_hash, item_id, &idx)) {
         UNLOCK();
@@ -743,10 +1531,112 @@ item_entry_t* wc_find_item_by_id(wordcard_db_t *db, uint32_t item_id) {
     return NULL;
 }
 
+int wc_get_item(wordcard_db_t *db, uint32_t item_id, item_entry_t *out) {
+    if (!db || !out) return WC_ERR_INVALID;
+    RDLOCK();
+    int idx;
+    if (!int_hash_get((int_hash_t*)db->id_hash, item_id, &idx)) {
+        UNLOCK();
+        return WC_ERR_NOT_FOUND;
+    }
+    item_expand(db, &db->items[idx], out);
+    UNLOCK();
+    return WC_OK;
+}
+
+int wc_get_item_by_question(wordcard_db_t *db, const char *question, item_entry_t *out) {
+    if (!db || !question || !out) return WC_ERR_INVALID;
+    RDLOCK();
+    int idx;
+    if (!qindex_get(db, question, &idx)) {
+        UNLOCK();
+        return WC_ERR_NOT_FOUND;
+    }
+    item_expand(db, &db->items[idx], out);
+    UNLOCK();
+    return WC_OK;
+}
+
+size_t wc_daily_queue_items(wordcard_db_t *db, uint32_t user_id, uint32_t now,
+                            uint32_t fields, uint32_t *out_ids, uint8_t *out_modes,
+                            uint32_t *out_offsets, char *buf, size_t buf_cap,
+                            size_t *buf_used, size_t max_count) {
+    if (buf_used) *buf_used = 0;
+    if (!db || !out_ids || !out_modes || max_count == 0) return 0;
+    fields &= WC_FIELD_QUESTION | WC_FIELD_ANSWER | WC_FIELD_EXPLANATION |
+              WC_FIELD_HINT | WC_FIELD_TAGS;
+    if (fields && (!out_offsets || !buf_used)) return 0;
+
+    size_t n = wc_generate_daily_queue(db, user_id, now, out_ids, out_modes, max_count);
+    if (!fields) return n;
+
+    /* 队列生成内部各自加锁；这里再锁一次读字符串堆，期间删除的学习项直接略过 */
+    RDLOCK();
+    size_t count = 0, used = 0, k = 0;
+    for (size_t i = 0; i < n; i++) {
+        int idx;
+        if (!int_hash_get((int_hash_t*)db->id_hash, out_ids[i], &idx)) continue;
+        const item_row_t *r = &db->items[idx];
+        const uint32_t offs[5] = { r->question, r->answer, r->explanation, r->hint, r->tags };
+        out_ids[count] = out_ids[i];
+        out_modes[count] = out_modes[i];
+        for (int f = 0; f < 5; f++) {
+            if (!(fields & (1u << f))) continue;
+            const char *str = wc_str(db, offs[f]);
+            size_t len = strlen(str);
+            out_offsets[k++] = (uint32_t)used;
+            if (used + len <= buf_cap && buf) memcpy(buf + used, str, len);
+            used += len;
+        }
+        count++;
+    }
+    UNLOCK();
+    out_offsets[k] = (uint32_t)used;
+    *buf_used = used;
+    return count;
+}
+
+int wc_item_frequencies(wordcard_db_t *db, const char *const *questions, size_t n,
+                        uint32_t *out_freq, uint64_t *total) {
+    if (!db || (n && (!questions || !out_freq))) return WC_ERR_INVALID;
+    RDLOCK();
+    for (size_t i = 0; i < n; i++) {
+        int idx;
+        out_freq[i] = questions[i] && qindex_get(db, questions[i], &idx)
+                    ? db->items[idx].frequency : 0;
+    }
+    if (total) {
+        uint64_t sum = 0;
+        for (size_t i = 0; i < db->item_count; i++)
+            sum += db->items[i].frequency;
+        *total = sum;
+    }
+    UNLOCK();
+    return WC_OK;
+}
+
 /* ========================================================================
  * 载体/内容源操作
  * ======================================================================== */
 
+/* 调用方须持有锁 */
+static content_source_t* source_append_locked(wordcard_db_t *db,
+                                              const content_source_t *source,
+                                              uint32_t id) {
+    void *new_arr = ensure_array(db, db->sources, db->source_count, &db->source_capacity, 
+                                  sizeof(content_source_t));
+    if (!new_arr) return NULL;
+    db->sources = new_arr;
+    
+    content_source_t *s = &db->sources[db->source_count];
+    memcpy(s, source, sizeof(content_source_t));
+    s->id = id;
+    db->source_count++;
+    
+    int_hash_set((int_hash_t*)db->source_hash, s->id, (int)(db->source_count - 1));
+    return s;
+}
+
 uint32_t wc_add_source(wordcard_db_t *db, const content_source_t *source) {
     if (!db || !source) return 0;
     
@@ -760,28 +1650,20 @@ uint32_t wc_add_source(wordcard_db_t *db, const content_source_t *source) {
         }
     }
     
-    void *new_arr = ensure_array(db->sources, db->source_count, &db->source_capacity, 
-                                  sizeof(content_source_t));
-    if (!new_arr) { UNLOCK(); return 0; }
-    db->sources = new_arr;
-    
     uint32_t new_id = (db->source_count > 0) ? db->sources[db->source_count - 1].id + 1 : 1;
     
-    content_source_t *s = &db->sources[db->source_count];
-    memcpy(s, source, sizeof(content_source_t));
-    s->id = new_id;
-    db->source_count++;
+    content_source_t *s = source_append_locked(db, source, new_id);
+    if (!s) { UNLOCK(); return 0; }
     
-    int_hash_set((int_hash_t*)db->source_hash, s->id, (int)(db->source_count - 1));
-    
-    wc_mark_dirty(db);
+    s->page_hashes = 0;     /* 堆偏移只能由 wc_update_source 设置 */
+    journal_or_dirty(db, WAL_SOURCE, s, sizeof(content_source_t));
     UNLOCK();
     return new_id;
 }
 
 content_source_t* wc_find_source_by_id(wordcard_db_t *db, uint32_t source_id) {
     if (!db) return NULL;
-    LOCK();
+    RDLOCK();
     int idx;
     if (int_hash_get((int_hash_t*)db->source_hash, source_id, &idx)) {
         UNLOCK();
@@ -794,7 +1676,7 @@ content_source_t* wc_find_source_by_id(wordcard_db_t *db, uint32_t source_id) {
 content_source_t* wc_find_source_by_name(wordcard_db_t *db, const char *name) {
     if (!db || !name) return NULL;
     /* 线性查找（source 数量通常很少） */
-    LOCK();
+    RDLOCK();
     for (size_t i = 0; i < db->source_count; i++) {
         if (strcmp(db->sources[i].name, name) == 0) {
             UNLOCK();
@@ -805,10 +1687,153 @@ content_source_t* wc_find_source_by_name(wordcard_db_t *db, const char *name) {
     return NULL;
 }
 
+/* 调用方须持有锁 */
+static content_source_t* source_by_path_locked(wordcard_db_t *db, const char *file_path) {
+    for (size_t i = 0; i < db->source_count; i++) {
+        if (strncmp(db->sources[i].file_path, file_path,
+                    sizeof(db->sources[i].file_path)) == 0)
+            return &db->sources[i];
+    }
+    return NULL;
+}
+
+int wc_get_source(wordcard_db_t *db, uint32_t source_id, content_source_t *out) {
+    if (!db || !out) return WC_ERR_INVALID;
+    RDLOCK();
+    int idx;
+    if (!int_hash_get((int_hash_t*)db->source_hash, source_id, &idx)) {
+        UNLOCK();
+        return WC_ERR_NOT_FOUND;
+    }
+    *out = db->sources[idx];
+    UNLOCK();
+    return WC_OK;
+}
+
+int wc_get_source_by_path(wordcard_db_t *db, const char *file_path, content_source_t *out) {
+    if (!db || !file_path || !file_path[0] || !out) return WC_ERR_INVALID;
+    RDLOCK();
+    const content_source_t *s = source_by_path_locked(db, file_path);
+    if (s) *out = *s;
+    UNLOCK();
+    return s ? WC_OK : WC_ERR_NOT_FOUND;
+}
+
+/* 按 id 覆盖已有载体或追加新载体，页指纹串写入字符串堆；调用方须持有锁。
+ * 指纹串不变时沿用原偏移，新串不比旧串长时原地覆盖，只有变长才追加，
+ * 反复重新导入不会让字符串堆和快照无限增长 */
+static content_source_t* source_put_locked(wordcard_db_t *db, const content_source_t *source,
+                                           const char *page_hashes) {
+    uint32_t off = 0;
+    int idx;
+    content_source_t *s = int_hash_get((int_hash_t*)db->source_hash, source->id, &idx)
+                        ? &db->sources[idx] : NULL;
+    if (s) off = s->page_hashes;
+    if (page_hashes) {
+        const char *old = wc_str(db, off);
+        size_t len = strlen(page_hashes);
+        if (strcmp(old, page_hashes) == 0) {
+            /* 未变 */
+        } else if (off && len && len <= strlen(old)) {
+            memcpy(db->strings + off, page_hashes, len + 1);
+        } else if (!heap_append(db, page_hashes, SIZE_MAX, &off)) {
+            return NULL;
+        }
+    }
+    if (!s) {
+        s = source_append_locked(db, source, source->id);
+        if (!s) return NULL;
+    } else {
+        memcpy(s, source, sizeof(content_source_t));
+    }
+    s->page_hashes = off;
+    return s;
+}
+
+/* 载体日志记录：行 + 页指纹串；只有行时表示指纹未变 */
+static int source_decode(const char *buf, size_t size, content_source_t *out,
+                         const char **page_hashes) {
+    if (size == sizeof(content_source_t)) {
+        memcpy(out, buf, sizeof(content_source_t));
+        *page_hashes = NULL;
+        return 1;
+    }
+    if (size < sizeof(content_source_t) + 1 || buf[size - 1] != '\0') return 0;
+    memcpy(out, buf, sizeof(content_source_t));
+    *page_hashes = buf + sizeof(content_source_t);
+    return 1;
+}
+
+int wc_update_source(wordcard_db_t *db, const content_source_t *source,
+                     const char *page_hashes) {
+    if (!db || !source) return WC_ERR_INVALID;
+    LOCK();
+    int idx;
+    if (!int_hash_get((int_hash_t*)db->source_hash, source->id, &idx)) {
+        UNLOCK();
+        return WC_ERR_NOT_FOUND;
+    }
+    /* 指纹未变时日志只记行，不因指纹串过长而退回完整快照 */
+    if (page_hashes && strcmp(wc_str(db, db->sources[idx].page_hashes), page_hashes) == 0)
+        page_hashes = NULL;
+    content_source_t *s = source_put_locked(db, source, page_hashes);
+    if (!s) { UNLOCK(); return WC_ERR_MEMORY; }
+    
+    /* 页数多时超出单条日志上限：标脏，由下次提交写完整快照 */
+    size_t len = page_hashes ? strlen(page_hashes) + 1 : 0;
+    size_t size = sizeof(content_source_t) + len;
+    if (db->wal_fd >= 0 && size <= WC_WAL_MAX_PAYLOAD) {
+        char rec[WC_WAL_MAX_PAYLOAD];
+        memcpy(rec, s, sizeof(content_source_t));
+        if (len) memcpy(rec + sizeof(content_source_t), wc_str(db, s->page_hashes), len);
+        journal_or_dirty(db, WAL_SOURCE_ROW, rec, size);
+    } else {
+        wc_mark_dirty(db);
+    }
+    UNLOCK();
+    return WC_OK;
+}
+
+int wc_get_source_page_hashes(wordcard_db_t *db, uint32_t source_id,
+                              char *buf, size_t cap, size_t *out_len) {
+    if (!db || !out_len || (cap && !buf)) return WC_ERR_INVALID;
+    RDLOCK();
+    int idx;
+    if (!int_hash_get((int_hash_t*)db->source_hash, source_id, &idx)) {
+        UNLOCK();
+        return WC_ERR_NOT_FOUND;
+    }
+    const char *str = wc_str(db, db->sources[idx].page_hashes);
+    size_t len = strlen(str);
+    *out_len = len;
+    if (len >= cap) {
+        UNLOCK();
+        return WC_ERR_MEMORY;
+    }
+    memcpy(buf, str, len + 1);
+    UNLOCK();
+    return WC_OK;
+}
+
 /* ========================================================================
  * 用户操作
  * ======================================================================== */
 
+/* 调用方须持有锁 */
+static user_t* user_append_locked(wordcard_db_t *db, const user_t *user) {
+    void *new_arr = ensure_array(db, db->users, db->user_count, &db->user_capacity, sizeof(user_t));
+    if (!new_arr) return NULL;
+    db->users = new_arr;
+    
+    user_t *u = &db->users[db->user_count];
+    memcpy(u, user, sizeof(user_t));
+    
+    db->user_count++;
+    str_hash_set((str_hash_t*)db->user_hash, u->dingtalk_uid, (int)(db->user_count - 1));
+    int_hash_set((int_hash_t*)db->user_id_hash, u->id, (int)(db->user_count - 1));
+    return u;
+}
+
 uint32_t wc_create_user(wordcard_db_t *db, const char *dingtalk_uid, const char *name) {
     if (!db || !dingtalk_uid) return 0;
     
@@ -821,34 +1846,29 @@ uint32_t wc_create_user(wordcard_db_t *db, const char *dingtalk_uid, const char
         return 0;
     }
     
-    void *new_arr = ensure_array(db->users, db->user_count, &db->user_capacity, sizeof(user_t));
-    if (!new_arr) { UNLOCK(); return 0; }
-    db->users = new_arr;
-    
     uint32_t new_id = (db->user_count > 0) ? db->users[db->user_count - 1].id + 1 : 1;
     
-    user_t *u = &db->users[db->user_count];
-    memset(u, 0, sizeof(user_t));
-    u->id = new_id;
-    strncpy(u->dingtalk_uid, dingtalk_uid, sizeof(u->dingtalk_uid) - 1);
-    if (name) strncpy(u->name, name, sizeof(u->name) - 1);
-    u->daily_new_limit = WC_DAILY_NEW_LIMIT;
-    u->daily_review_limit = WC_DAILY_REVIEW_LIMIT;
-    u->created_at = wc_now();
-    u->last_active = u->created_at;
+    user_t nu;
+    memset(&nu, 0, sizeof(user_t));
+    nu.id = new_id;
+    strncpy(nu.dingtalk_uid, dingtalk_uid, sizeof(nu.dingtalk_uid) - 1);
+    if (name) strncpy(nu.name, name, sizeof(nu.name) - 1);
+    nu.daily_new_limit = WC_DAILY_NEW_LIMIT;
+    nu.daily_review_limit = WC_DAILY_REVIEW_LIMIT;
+    nu.created_at = wc_now();
+    nu.last_active = nu.created_at;
     
-    db->user_count++;
-    str_hash_set((str_hash_t*)db->user_hash, u->dingtalk_uid, (int)(db->user_count - 1));
-    int_hash_set((int_hash_t*)db->user_id_hash, u->id, (int)(db->user_count - 1));
+    user_t *u = user_append_locked(db, &nu);
+    if (!u) { UNLOCK(); return 0; }
     
-    wc_mark_dirty(db);
+    journal_or_dirty(db, WAL_USER, u, sizeof(user_t));
     UNLOCK();
     return new_id;
 }
 
 user_t* wc_find_user(wordcard_db_t *db, const char *dingtalk_uid) {
     if (!db || !dingtalk_uid) return NULL;
-    LOCK();
+    RDLOCK();
     int idx;
     if (str_hash_get((str_hash_t*)db->user_hash, dingtalk_uid, &idx)) {
         UNLOCK();
@@ -860,7 +1880,7 @@ user_t* wc_find_user(wordcard_db_t *db, const char *dingtalk_uid) {
 
 user_t* wc_find_user_by_id(wordcard_db_t *db, uint32_t user_id) {
     if (!db) return NULL;
-    LOCK();
+    RDLOCK();
     int idx;
     if (int_hash_get((int_hash_t*)db->user_id_hash, user_id, &idx)) {
         UNLOCK();
@@ -870,34 +1890,58 @@ user_t* wc_find_user_by_id(wordcard_db_t *db, uint32_t user_id) {
     return NULL;
 }
 
+int wc_get_user(wordcard_db_t *db, uint32_t user_id, user_t *out) {
+    if (!db || !out) return WC_ERR_INVALID;
+    RDLOCK();
+    int idx;
+    if (!int_hash_get((int_hash_t*)db->user_id_hash, user_id, &idx)) {
+        UNLOCK();
+        return WC_ERR_NOT_FOUND;
+    }
+    *out = db->users[idx];
+    UNLOCK();
+    return WC_OK;
+}
+
+int wc_get_user_by_uid(wordcard_db_t *db, const char *dingtalk_uid, user_t *out) {
+    if (!db || !dingtalk_uid || !out) return WC_ERR_INVALID;
+    RDLOCK();
+    int idx;
+    if (!str_hash_get((str_hash_t*)db->user_hash, dingtalk_uid, &idx)) {
+        UNLOCK();
+        return WC_ERR_NOT_FOUND;
+    }
+    *out = db->users[idx];
+    UNLOCK();
+    return WC_OK;
+}
+
 /* ========================================================================
  * 掌握度操作
  * ======================================================================== */
 
-user_item_mastery_t* wc_get_or_create_mastery(wordcard_db_t *db, 
-                                               uint32_t user_id, 
-                                               uint32_t item_id) {
-    if (!db) return NULL;
-    
-    LOCK();
-    
+/* 调用方须持有锁 */
+static user_item_mastery_t* mastery_get_or_create_locked(wordcard_db_t *db,
+                                                         uint32_t user_id,
+                                                         uint32_t item_id) {
     int idx;
     if (pair_hash_get((pair_hash_t*)db->mastery_hash, user_id, item_id, &idx)) {
-        UNLOCK();
         return &db->mastery[idx];
     }
     
     /* 创建新记录 */
-    size_t old_cap = db->mastery_capacity;
-    void *new_arr = ensure_array(db->mastery, db->mastery_count, 
-                                  &db->mastery_capacity, sizeof(user_item_mastery_t));
-    if (!new_arr) { UNLOCK(); return NULL; }
+    size_t cap = db->mastery_capacity;
+    void *new_arr = ensure_array(db, db->mastery, db->mastery_count, 
+                                  &cap, sizeof(user_item_mastery_t));
+    if (!new_arr) return NULL;
     db->mastery = new_arr;
     
-    /* 同步扩容 due_sorted 数组 */
-    if (db->mastery_capacity > old_cap && db->mastery_due_sorted) {
-        uint32_t *new_due = realloc(db->mastery_due_sorted, db->mastery_capacity * sizeof(uint32_t));
-        if (new_due) db->mastery_due_sorted = new_due;
+    /* 同步扩容堆位置数组；失败时保留旧容量，下次重试 */
+    if (cap > db->mastery_capacity) {
+        uint32_t *pos = realloc(db->mastery_heap_pos, cap * sizeof(uint32_t));
+        if (!pos) return NULL;
+        db->mastery_heap_pos = pos;
+        db->mastery_capacity = cap;
     }
     
     user_item_mastery_t *m = &db->mastery[db->mastery_count];
@@ -907,11 +1951,21 @@ user_item_mastery_t* wc_get_or_create_mastery(wordcard_db_t *db,
     m->ease_factor = WC_DEFAULT_EF;
     m->first_seen = wc_now();
     
+    if (!user_index_add_row(db, (uint32_t)db->mastery_count)) return NULL;
     pair_hash_set((pair_hash_t*)db->mastery_hash, user_id, item_id, (int)db->mastery_count);
     db->mastery_count++;
-    db->mastery_due_dirty = 1; /* 新记录可能影响排序 */
+    return m;
+}
+
+user_item_mastery_t* wc_get_or_create_mastery(wordcard_db_t *db, 
+                                               uint32_t user_id, 
+                                               uint32_t item_id) {
+    if (!db) return NULL;
     
-    wc_mark_dirty(db);
+    LOCK();
+    size_t before = db->mastery_count;
+    user_item_mastery_t *m = mastery_get_or_create_locked(db, user_id, item_id);
+    if (m && db->mastery_count != before) wc_mark_dirty(db);
     UNLOCK();
     return m;
 }
@@ -920,7 +1974,7 @@ user_item_mastery_t* wc_find_mastery(wordcard_db_t *db,
                                       uint32_t user_id, 
                                       uint32_t item_id) {
     if (!db) return NULL;
-    LOCK();
+    RDLOCK();
     int idx;
     if (pair_hash_get((pair_hash_t*)db->mastery_hash, user_id, item_id, &idx)) {
         UNLOCK();
@@ -930,15 +1984,70 @@ user_item_mastery_t* wc_find_mastery(wordcard_db_t *db,
     return NULL;
 }
 
+int wc_get_mastery(wordcard_db_t *db, uint32_t user_id, uint32_t item_id,
+                   user_item_mastery_t *out) {
+    if (!db || !out) return WC_ERR_INVALID;
+    /* 复习在共享锁 + 用户分片锁下原地改行，拷贝也要持分片锁 */
+    USER_RDLOCK(user_id);
+    int idx;
+    int found = pair_hash_get((pair_hash_t*)db->mastery_hash, user_id, item_id, &idx);
+    if (found) *out = db->mastery[idx];
+    USER_RDUNLOCK(user_id);
+    return found ? WC_OK : WC_ERR_NOT_FOUND;
+}
+
+user_item_mastery_t* wc_mastery_acquire(wordcard_db_t *db, size_t *count) {
+    if (!db) return NULL;
+    LOCK();
+    if (count) *count = db->mastery_count;
+    return db->mastery;
+}
+
+void wc_mastery_release(wordcard_db_t *db, int changed) {
+    if (!db) return;
+    if (changed) {
+        db->due_generation++;
+        wc_mark_dirty(db);
+    }
+    UNLOCK();
+}
+
+int wc_mastery_rows(wordcard_db_t *db, const uint32_t *user_ids, const uint32_t *item_ids,
+                    size_t n, int create, int64_t *out_rows) {
+    if (!db || !out_rows || (n > 0 && (!user_ids || !item_ids))) return WC_ERR_INVALID;
+    
+    LOCK();
+    size_t before = db->mastery_count;
+    int missing = 0;
+    for (size_t i = 0; i < n; i++) {
+        int idx;
+        if (pair_hash_get((pair_hash_t*)db->mastery_hash, user_ids[i], item_ids[i], &idx)) {
+            out_rows[i] = idx;
+            continue;
+        }
+        user_item_mastery_t *m = create ?
+            mastery_get_or_create_locked(db, user_ids[i], item_ids[i]) : NULL;
+        out_rows[i] = m ? (int64_t)(m - db->mastery) : -1;
+        if (!m) missing++;
+    }
+    if (db->mastery_count != before) wc_mark_dirty(db);
+    UNLOCK();
+    return missing;
+}
+
 /* ========================================================================
  * SM-2 算法
  * ======================================================================== */
 
 void wc_sm2_update(user_item_mastery_t *mastery, uint8_t quality) {
+    wc_sm2_update_at(mastery, quality, wc_now());
+}
+
+void wc_sm2_update_at(user_item_mastery_t *mastery, uint8_t quality, uint32_t at) {
     if (!mastery || quality > 5) return;
     
     mastery->total_reviews++;
-    mastery->last_review = wc_now();
+    mastery->last_review = at;
     
     if (quality >= 3) {
         /* 记住了 */
@@ -965,7 +2074,7 @@ void wc_sm2_update(user_item_mastery_t *mastery, uint8_t quality) {
         mastery->wrong_count++;
         mastery->streak_days = 0;
         mastery->forget_count++;
-        mastery->last_wrong = wc_now();
+        mastery->last_wrong = at;
         mastery->repetitions = 0;
         mastery->interval_days = 1;
     }
@@ -983,6 +2092,28 @@ void wc_sm2_update(user_item_mastery_t *mastery, uint8_t quality) {
     }
 }
 
+void wc_sm2_update_db(wordcard_db_t *db, user_item_mastery_t *mastery, uint8_t quality) {
+    if (!db || !mastery) return;
+    RDLOCK();
+    if (mastery >= db->mastery && mastery < db->mastery + db->mastery_count) {
+        /* 表内的行只属于一个用户：持该用户的分片锁即可 */
+        uint32_t user_id = mastery->user_id;
+        USER_LOCK(user_id);
+        uint8_t old_status = mastery->sm2_status;
+        wc_sm2_update(mastery, quality);
+        mastery_changed_locked(db, (uint32_t)(mastery - db->mastery), old_status);
+        USER_UNLOCK(user_id);
+        UNLOCK();
+    } else {
+        UNLOCK();
+        LOCK();
+        wc_sm2_update(mastery, quality);
+        db->due_generation++;                   /* 不在表内的副本：整体重建 */
+        UNLOCK();
+    }
+    wc_mark_dirty(db);
+}
+
 /* ========================================================================
  * 多维度掌握度更新
  * ======================================================================== */
@@ -1036,26 +2167,73 @@ void wc_recalc_overall(user_item_mastery_t *mastery) {
  * 查询接口
  * ======================================================================== */
 
+/* 候选集（元素为用户堆位置）的小顶堆操作 */
+static void cand_sift_up(const wordcard_db_t *db, const user_index_t *u,
+                         uint32_t *cand, size_t pos) {
+    uint32_t v = cand[pos];
+    while (pos > 0) {
+        size_t parent = (pos - 1) / 2;
+        if (!due_less(db, u->heap[v], u->heap[cand[parent]])) break;
+        cand[pos] = cand[parent];
+        pos = parent;
+    }
+    cand[pos] = v;
+}
+
+static void cand_sift_down(const wordcard_db_t *db, const user_index_t *u,
+                           uint32_t *cand, size_t n, size_t pos) {
+    uint32_t v = cand[pos];
+    for (;;) {
+        size_t child = pos * 2 + 1;
+        if (child >= n) break;
+        if (child + 1 < n && due_less(db, u->heap[cand[child + 1]], u->heap[cand[child]])) {
+            child++;
+        }
+        if (!due_less(db, u->heap[cand[child]], u->heap[v])) break;
+        cand[pos] = cand[child];
+        pos = child;
+    }
+    cand[pos] = v;
+}
+
 size_t wc_get_due_items(wordcard_db_t *db, uint32_t user_id, uint32_t now,
                          uint32_t *out_ids, size_t max_count) {
     if (!db || !out_ids || max_count == 0) return 0;
     
-    LOCK();
-    rebuild_due_index(db);
+    USER_RDLOCK(user_id);
+    user_index_t *u = user_index_get(db, user_id, 0);
+    if (!u || (u->generation != db->due_generation && !due_heap_rebuild(db, u)) ||
+        u->heap_count == 0) {
+        USER_RDUNLOCK(user_id);
+        return 0;
+    }
+    
+    /* 最佳优先遍历：候选集是堆位置的小顶堆，每弹出一个到期结点再放入其两个子结点，
+     * 按 next_review 升序输出前 k 个，代价 O(k log k)，不改动用户堆本身 */
+    size_t limit = max_count < u->heap_count ? max_count : u->heap_count;
+    uint32_t *cand = malloc((limit + 1) * sizeof(uint32_t));
+    if (!cand) { USER_RDUNLOCK(user_id); return 0; }
+    size_t n_cand = 0;
+    cand[n_cand++] = 0;
     
     size_t count = 0;
-    for (size_t i = 0; i < db->mastery_due_sorted_count && count < max_count; i++) {
-        uint32_t m_idx = db->mastery_due_sorted[i];
-        user_item_mastery_t *m = &db->mastery[m_idx];
-        
-        /* 按 next_review 排序，遇到未来时间直接退出 */
-        if (m->next_review > now) break;
+    while (n_cand > 0 && count < max_count) {
+        uint32_t top = cand[0];
+        user_item_mastery_t *m = &db->mastery[u->heap[top]];
+        if (m->next_review > now) break;          /* 其余候选都更晚 */
+        out_ids[count++] = m->item_id;
         
-        if (m->user_id == user_id && m->sm2_status != SM2_NEW) {
-            out_ids[count++] = m->item_id;
+        /* 弹出 top，放入其子结点 */
+        cand[0] = cand[--n_cand];
+        if (n_cand > 0) cand_sift_down(db, u, cand, n_cand, 0);
+        for (size_t c = 2 * (size_t)top + 1; c <= 2 * (size_t)top + 2; c++) {
+            if (c >= u->heap_count) break;
+            cand[n_cand++] = (uint32_t)c;
+            cand_sift_up(db, u, cand, n_cand - 1);
         }
     }
-    UNLOCK();
+    free(cand);
+    USER_RDUNLOCK(user_id);
     return count;
 }
 
@@ -1063,46 +2241,161 @@ size_t wc_get_new_items(wordcard_db_t *db, uint32_t user_id, uint32_t source_id,
                          uint32_t *out_ids, size_t max_count) {
     if (!db || !out_ids || max_count == 0) return 0;
     
-    LOCK();
+    USER_RDLOCK(user_id);
+    user_index_t *u = user_index_get(db, user_id, 0);
+    size_t words = (db->item_count + 63) / 64;
     size_t count = 0;
     
-    /* 遍历学习项库，找到用户未学过的项 */
-    for (size_t i = 0; i < db->item_count && count < max_count; i++) {
-        uint32_t vid = db->items[i].id;
-        
-        /* 如果指定了载体，过滤 */
-        if (source_id != 0 && db->items[i].source_id != source_id) continue;
-        
-        /* 检查用户是否已有掌握度记录 */
-        int idx;
-        if (!pair_hash_get((pair_hash_t*)db->mastery_hash, user_id, vid, &idx)) {
+    /* 逐字扫描未学位：已学满的字整体跳过 */
+    for (size_t w = 0; w < words && count < max_count; w++) {
+        uint64_t bits = ~((u && w < u->seen_words) ? u->seen[w] : 0);
+        if (w == words - 1 && db->item_count % 64) {
+            bits &= (1ULL << (db->item_count % 64)) - 1;
+        }
+        while (bits && count < max_count) {
+            size_t i = w * 64 + (size_t)__builtin_ctzll(bits);
+            bits &= bits - 1;
+            
+            /* 如果指定了载体，过滤 */
+            if (source_id != 0 && db->items[i].source_id != source_id) continue;
+            
+            /* 学习项晚于掌握度记录加入时位图未置位，这里补上 */
+            uint32_t vid = db->items[i].id;
+            int idx;
+            if (pair_hash_get((pair_hash_t*)db->mastery_hash, user_id, vid, &idx)) {
+                if (u) seen_set(db, u, i);
+                continue;
+            }
             out_ids[count++] = vid;
         }
     }
-    UNLOCK();
+    USER_RDUNLOCK(user_id);
     return count;
 }
 
+/* 统计堆中 next_review ≤ t 的结点：超过 t 的子树整棵剪掉，代价 O(到期数) */
+static void count_due(const wordcard_db_t *db, const user_index_t *u, size_t pos,
+                      uint32_t now, uint32_t day_end, user_counts_t *out) {
+    while (pos < u->heap_count) {
+        uint32_t due = db->mastery[u->heap[pos]].next_review;
+        if (due > day_end) return;
+        out->due_today++;
+        if (due <= now) out->due_now++;
+        count_due(db, u, pos * 2 + 1, now, day_end, out);
+        pos = pos * 2 + 2;
+    }
+}
+
+/* now 所在本地日期的 23:59:59 */
+static uint32_t local_day_end(uint32_t now) {
+    time_t t = (time_t)now;
+    struct tm tm_info;
+    localtime_r(&t, &tm_info);
+    tm_info.tm_hour = 23;
+    tm_info.tm_min = 59;
+    tm_info.tm_sec = 59;
+    tm_info.tm_isdst = -1;          /* 切换日的夏令时状态以当天结束时为准 */
+    time_t end = mktime(&tm_info);
+    return (end == (time_t)-1 || (uint32_t)end < now) ? now : (uint32_t)end;
+}
+
+int wc_get_user_counts(wordcard_db_t *db, uint32_t user_id, uint32_t now,
+                       user_counts_t *out) {
+    if (!db || !out) return WC_ERR_INVALID;
+    memset(out, 0, sizeof(user_counts_t));
+    uint32_t day_end = local_day_end(now);
+    
+    USER_RDLOCK(user_id);
+    user_index_t *u = user_index_get(db, user_id, 0);
+    if (!u) {
+        out->new_available = (uint32_t)db->item_count;
+        USER_RDUNLOCK(user_id);
+        return WC_OK;
+    }
+    if (u->generation != db->due_generation && !due_heap_rebuild(db, u)) {
+        USER_RDUNLOCK(user_id);
+        return WC_ERR_MEMORY;
+    }
+    count_due(db, u, 0, now, day_end, out);
+    out->new_available = db->item_count > u->seen_count ?
+                         (uint32_t)(db->item_count - u->seen_count) : 0;
+    out->learning = u->status_count[SM2_LEARNING];
+    out->mastered = u->status_count[SM2_MASTERED];
+    USER_RDUNLOCK(user_id);
+    return WC_OK;
+}
+
+int wc_day_ends(uint32_t now, uint32_t days, uint32_t *out_ends) {
+    if (!out_ends || days == 0 || days > 3650) return WC_ERR_INVALID;
+    /* 逐日取本地自然日的最后一秒，跨夏令时切换不漂移 */
+    out_ends[0] = local_day_end(now);
+    for (uint32_t d = 1; d < days; d++) {
+        uint32_t prev = out_ends[d - 1];
+        out_ends[d] = prev == UINT32_MAX ? prev : local_day_end(prev + 1);
+    }
+    return WC_OK;
+}
+
+/* next_review 所在的天：第一个 ends[d] ≥ due 的 d */
+static uint32_t forecast_day(const uint32_t *ends, uint32_t days, uint32_t due) {
+    uint32_t lo = 0, hi = days - 1;
+    while (lo < hi) {
+        uint32_t mid = lo + (hi - lo) / 2;
+        if (due <= ends[mid]) hi = mid; else lo = mid + 1;
+    }
+    return lo;
+}
+
+/* 按天累加堆中 next_review ≤ 窗口末尾的结点，超出的子树整棵剪掉 */
+static void forecast_walk(const wordcard_db_t *db, const user_index_t *u, size_t pos,
+                          const uint32_t *ends, uint32_t days, uint32_t *counts) {
+    while (pos < u->heap_count) {
+        uint32_t due = db->mastery[u->heap[pos]].next_review;
+        if (due > ends[days - 1]) return;
+        counts[forecast_day(ends, days, due)]++;
+        forecast_walk(db, u, pos * 2 + 1, ends, days, counts);
+        pos = pos * 2 + 2;
+    }
+}
+
+int wc_forecast(wordcard_db_t *db, uint32_t user_id, uint32_t now,
+                uint32_t days, uint32_t *out_counts) {
+    if (!db || !out_counts || days == 0 || days > 3650) return WC_ERR_INVALID;
+    memset(out_counts, 0, days * sizeof(uint32_t));
+    uint32_t *ends = malloc(days * sizeof(uint32_t));
+    if (!ends) return WC_ERR_MEMORY;
+    wc_day_ends(now, days, ends);
+    
+    int rc = WC_OK;
+    USER_RDLOCK(user_id);
+    user_index_t *u = user_index_get(db, user_id, 0);
+    if (u && u->generation != db->due_generation && !due_heap_rebuild(db, u)) {
+        rc = WC_ERR_MEMORY;
+    } else if (u) {
+        forecast_walk(db, u, 0, ends, days, out_counts);
+    }
+    USER_RDUNLOCK(user_id);
+    free(ends);
+    return rc;
+}
+
 /* ========================================================================
  * 每日统计
  * ======================================================================== */
 
-daily_stat_t* wc_get_or_create_daily_stat(wordcard_db_t *db, 
-                                            uint32_t user_id, 
-                                            uint32_t date) {
-    if (!db) return NULL;
-    
-    LOCK();
+/* 调用方须持有锁 */
+static daily_stat_t* daily_stat_get_or_create_locked(wordcard_db_t *db,
+                                                     uint32_t user_id,
+                                                     uint32_t date) {
     /* O(1) 哈希查找 */
     int idx;
     if (pair_hash_get((pair_hash_t*)db->stat_hash, user_id, date, &idx)) {
-        UNLOCK();
         return &db->stats[idx];
     }
     
-    void *new_arr = ensure_array(db->stats, db->stat_count, 
+    void *new_arr = ensure_array(db, db->stats, db->stat_count, 
                                   &db->stat_capacity, sizeof(daily_stat_t));
-    if (!new_arr) { UNLOCK(); return NULL; }
+    if (!new_arr) return NULL;
     db->stats = new_arr;
     
     daily_stat_t *s = &db->stats[db->stat_count];
@@ -1112,19 +2405,11 @@ daily_stat_t* wc_get_or_create_daily_stat(wordcard_db_t *db,
     
     pair_hash_set((pair_hash_t*)db->stat_hash, user_id, date, (int)db->stat_count);
     db->stat_count++;
-    
-    wc_mark_dirty(db);
-    UNLOCK();
     return s;
 }
 
-void wc_record_activity(wordcard_db_t *db, uint32_t user_id, 
-                         int is_new, int is_correct, uint32_t time_spent) {
-    if (!db) return;
-    
-    daily_stat_t *s = wc_get_or_create_daily_stat(db, user_id, wc_today());
-    if (!s) return;
-    
+static void apply_activity(daily_stat_t *s, int is_new, int is_correct,
+                           uint32_t time_spent) {
     if (is_new) {
         s->new_items++;
     } else {
@@ -1138,7 +2423,397 @@ void wc_record_activity(wordcard_db_t *db, uint32_t user_id,
     }
     
     s->study_time_sec += time_spent;
-    wc_mark_dirty(db);
+}
+
+daily_stat_t* wc_get_or_create_daily_stat(wordcard_db_t *db, 
+                                            uint32_t user_id, 
+                                            uint32_t date) {
+    if (!db) return NULL;
+    
+    LOCK();
+    size_t before = db->stat_count;
+    daily_stat_t *s = daily_stat_get_or_create_locked(db, user_id, date);
+    if (s && db->stat_count != before) wc_mark_dirty(db);
+    UNLOCK();
+    return s;
+}
+
+void wc_record_activity(wordcard_db_t *db, uint32_t user_id, 
+                         int is_new, int is_correct, uint32_t time_spent) {
+    if (!db) return;
+    
+    /* 统计行可能被并发的复习快路径改写，累加也须在锁内 */
+    LOCK();
+    daily_stat_t *s = daily_stat_get_or_create_locked(db, user_id, wc_today());
+    if (s) apply_activity(s, is_new, is_correct, time_spent);
+    UNLOCK();
+    if (s) wc_mark_dirty(db);
+}
+
+/* ========================================================================
+ * 复习提交（单次加锁完成建档 + SM-2 + 统计 + 日志）
+ *
+ * 掌握度行与当日统计行都已存在时（绝大多数复习），持共享锁 + 用户分片锁
+ * 原地改写，不同分片的用户互不阻塞；需要新建行时改持独占锁。
+ * 日志记录在分片锁内追加，同一行的后像按修改顺序落盘。
+ * ======================================================================== */
+
+/* 快路径（调用方持共享锁与 user_id 的分片锁）；不新建任何行，
+ * 缺行时返回 WC_ERR_NOT_FOUND，由调用方改走 review_locked */
+static int review_shared(wordcard_db_t *db, uint32_t user_id, uint32_t item_id,
+                         uint8_t quality, uint32_t at, uint32_t time_spent,
+                         user_item_mastery_t *out, wc_wal_review_t *rec) {
+    int m_idx, s_idx;
+    if (!pair_hash_get((pair_hash_t*)db->mastery_hash, user_id, item_id, &m_idx) ||
+        !pair_hash_get((pair_hash_t*)db->stat_hash, user_id, wc_date_of(at), &s_idx)) {
+        return WC_ERR_NOT_FOUND;
+    }
+    user_item_mastery_t *m = &db->mastery[m_idx];
+    daily_stat_t *s = &db->stats[s_idx];
+    
+    int is_new = (m->total_reviews == 0);
+    uint8_t old_status = m->sm2_status;
+    wc_sm2_update_at(m, quality, at);
+    mastery_changed_locked(db, (uint32_t)m_idx, old_status);
+    apply_activity(s, is_new, quality >= 3, time_spent);
+    
+    memcpy(&rec->mastery, m, sizeof(user_item_mastery_t));
+    memcpy(&rec->stat, s, sizeof(daily_stat_t));
+    if (out) memcpy(out, m, sizeof(user_item_mastery_t));
+    return WC_OK;
+}
+
+/* 单次复习（调用方须持有独占锁）；日志记录写入 rec，由调用方追加 */
+static int review_locked(wordcard_db_t *db, uint32_t user_id, uint32_t item_id,
+                         uint8_t quality, uint32_t at, uint32_t time_spent,
+                         user_item_mastery_t *out, wc_wal_review_t *rec) {
+    if (quality > 5) return WC_ERR_INVALID;
+    /* 只为已存在的用户与学习项建档，不留孤儿行 */
+    int idx;
+    if (!pair_hash_get((pair_hash_t*)db->mastery_hash, user_id, item_id, &idx) &&
+        (!int_hash_get((int_hash_t*)db->user_id_hash, user_id, &idx) ||
+         !int_hash_get((int_hash_t*)db->id_hash, item_id, &idx))) {
+        return WC_ERR_NOT_FOUND;
+    }
+    user_item_mastery_t *m = mastery_get_or_create_locked(db, user_id, item_id);
+    if (!m) return WC_ERR_MEMORY;
+    
+    int is_new = (m->total_reviews == 0);
+    uint8_t old_status = m->sm2_status;
+    wc_sm2_update_at(m, quality, at);
+    mastery_changed_locked(db, (uint32_t)(m - db->mastery), old_status);
+    
+    /* 统计表扩容可能移动 mastery 以外的数组，m 仍然有效 */
+    daily_stat_t *s = daily_stat_get_or_create_locked(db, user_id, wc_date_of(at));
+    if (!s) { wc_mark_dirty(db); return WC_ERR_MEMORY; }
+    apply_activity(s, is_new, quality >= 3, time_spent);
+    
+    memcpy(&rec->mastery, m, sizeof(user_item_mastery_t));
+    memcpy(&rec->stat, s, sizeof(daily_stat_t));
+    if (out) memcpy(out, m, sizeof(user_item_mastery_t));
+    return WC_OK;
+}
+
+int wc_review(wordcard_db_t *db, uint32_t user_id, uint32_t item_id,
+              uint8_t quality, uint32_t time_spent, user_item_mastery_t *out) {
+    if (!db || quality > 5) return WC_ERR_INVALID;
+    
+    uint32_t at = wc_now();
+    wc_wal_review_t rec;
+    USER_RDLOCK(user_id);
+    int rc = review_shared(db, user_id, item_id, quality, at, time_spent, out, &rec);
+    if (rc == WC_OK) journal_or_dirty(db, WAL_REVIEW, &rec, sizeof(rec));
+    USER_RDUNLOCK(user_id);
+    if (rc != WC_ERR_NOT_FOUND) return rc;
+    
+    /* 首次复习该项或当天首次复习：要追加行，改持独占锁 */
+    LOCK();
+    rc = review_locked(db, user_id, item_id, quality, at, time_spent, out, &rec);
+    if (rc == WC_OK) journal_or_dirty(db, WAL_REVIEW, &rec, sizeof(rec));
+    UNLOCK();
+    return rc;
+}
+
+int wc_submit_reviews(wordcard_db_t *db, const review_req_t *reqs, size_t n,
+                      user_item_mastery_t *out, int32_t *out_rc) {
+    if (!db || (!reqs && n > 0)) return WC_ERR_INVALID;
+    
+    uint32_t now = wc_now();
+    char *batch = NULL;
+    size_t batch_len = 0;
+    int applied = 0;
+    
+    LOCK();
+    if (db->wal_fd >= 0) batch = malloc(WC_WAL_BATCH_SIZE);
+    for (size_t i = 0; i < n; i++) {
+        /* 缺省或晚于服务器时间的时间戳按当前时间处理 */
+        uint32_t at = reqs[i].reviewed_at;
+        if (at == 0 || at > now) at = now;
+        
+        wc_wal_review_t rec;
+        int rc = review_locked(db, reqs[i].user_id, reqs[i].item_id, reqs[i].quality,
+                               at, reqs[i].time_spent, out ? &out[i] : NULL, &rec);
+        if (out_rc) out_rc[i] = rc;
+        if (rc != WC_OK) {
+            if (out) memset(&out[i], 0, sizeof(user_item_mastery_t));
+            continue;
+        }
+        applied++;
+        
+        if (!batch) {
+            journal_or_dirty(db, WAL_REVIEW, &rec, sizeof(rec));
+            continue;
+        }
+        if (batch_len + sizeof(wc_wal_record_t) + sizeof(rec) > WC_WAL_BATCH_SIZE) {
+            journal_write(db, batch, batch_len);
+            batch_len = 0;
+        }
+        batch_len += journal_frame(batch + batch_len, WAL_REVIEW, &rec, sizeof(rec));
+    }
+    if (batch) {
+        if (batch_len > 0) journal_write(db, batch, batch_len);
+        free(batch);
+    }
+    UNLOCK();
+    return applied;
+}
+
+/* ========================================================================
+ * 预写日志（WAL）
+ * 快照（wc_save_db）之后的新增学习项/载体/用户与每次复习以后像记录
+ * 追加到 <db>.wal；打开时在快照之上重放，wc_checkpoint 折叠进新快照。
+ * ======================================================================== */
+
+static int write_all(int fd, const void *buf, size_t len) {
+    const char *p = buf;
+    while (len > 0) {
+        ssize_t n = write(fd, p, len);
+        if (n < 0) return -1;
+        p += n;
+        len -= (size_t)n;
+    }
+    return 0;
+}
+
+/* 在 buf 中组装一条记录（头 + payload），返回总长度 */
+static size_t journal_frame(char *buf, uint16_t type, const void *payload, size_t size) {
+    wc_wal_record_t *rec = (wc_wal_record_t*)buf;
+    rec->crc = mydb_crc32(payload, size);
+    rec->type = type;
+    rec->size = (uint16_t)size;
+    memcpy(buf + sizeof(wc_wal_record_t), payload, size);
+    return sizeof(wc_wal_record_t) + size;
+}
+
+/* 追加已组装的若干条记录；O_APPEND 保证一次 write 整段追加。
+ * 持共享锁的多个复习线程会并发追加，由日志锁串行 */
+static void journal_write(wordcard_db_t *db, const char *buf, size_t len) {
+    pthread_mutex_lock(&g_wal_mutex);
+    if (write_all(db->wal_fd, buf, len) != 0) {
+        /* 可能写了半条：标脏，下次提交走完整快照并截断日志 */
+        pthread_mutex_unlock(&g_wal_mutex);
+        wc_mark_dirty(db);
+        return;
+    }
+    db->wal_size += len;
+    pthread_mutex_unlock(&g_wal_mutex);
+}
+
+static void journal_or_dirty(wordcard_db_t *db, uint16_t type,
+                             const void *payload, size_t size) {
+    if (db->wal_fd < 0 || size > WC_WAL_MAX_PAYLOAD) {
+        wc_mark_dirty(db);
+        return;
+    }
+    char buf[sizeof(wc_wal_record_t) + WC_WAL_MAX_PAYLOAD];
+    journal_write(db, buf, journal_frame(buf, type, payload, size));
+}
+
+/* 重放一条记录（调用方须持有锁）；按主键覆盖，重复重放无副作用 */
+static int journal_apply_locked(wordcard_db_t *db, uint16_t type,
+                                const void *payload, size_t size) {
+    int idx;
+    switch (type) {
+        case WAL_ITEM: {
+            if (size != sizeof(item_entry_t)) return WC_ERR_CORRUPT;
+            const item_entry_t *v = payload;
+            if (int_hash_get((int_hash_t*)db->id_hash, v->id, &idx)) return WC_OK;
+            return item_append_locked(db, v, v->id) ? WC_OK : WC_ERR_MEMORY;
+        }
+        case WAL_ITEM_ROW: {
+            item_entry_t v;
+            if (!item_decode(payload, size, &v)) return WC_ERR_CORRUPT;
+            if (int_hash_get((int_hash_t*)db->id_hash, v.id, &idx)) return WC_OK;
+            return item_append_locked(db, &v, v.id) ? WC_OK : WC_ERR_MEMORY;
+        }
+        case WAL_SOURCE: {
+            content_source_t src;
+            if (size == sizeof(content_source_t)) {
+                memcpy(&src, payload, sizeof(src));
+            } else if (size == sizeof(content_source_v4_t)) {
+                source_upgrade(payload, &src);
+            } else {
+                return WC_ERR_CORRUPT;
+            }
+            src.page_hashes = 0;
+            if (int_hash_get((int_hash_t*)db->source_hash, src.id, &idx)) return WC_OK;
+            return source_append_locked(db, &src, src.id) ? WC_OK : WC_ERR_MEMORY;
+        }
+        case WAL_SOURCE_ROW: {
+            content_source_t src;
+            const char *page_hashes;
+            if (!source_decode(payload, size, &src, &page_hashes)) return WC_ERR_CORRUPT;
+            return source_put_locked(db, &src, page_hashes) ? WC_OK : WC_ERR_MEMORY;
+        }
+        case WAL_USER: {
+            if (size != sizeof(user_t)) return WC_ERR_CORRUPT;
+            const user_t *u = payload;
+            if (int_hash_get((int_hash_t*)db->user_id_hash, u->id, &idx)) return WC_OK;
+            return user_append_locked(db, u) ? WC_OK : WC_ERR_MEMORY;
+        }
+        case WAL_REVIEW: {
+            if (size != sizeof(wc_wal_review_t)) return WC_ERR_CORRUPT;
+            const wc_wal_review_t *r = payload;
+            user_item_mastery_t *m = mastery_get_or_create_locked(
+                db, r->mastery.user_id, r->mastery.item_id);
+            if (!m) return WC_ERR_MEMORY;
+            uint8_t old_status = m->sm2_status;
+            memcpy(m, &r->mastery, sizeof(user_item_mastery_t));
+            daily_stat_t *s = daily_stat_get_or_create_locked(
+                db, r->stat.user_id, r->stat.date);
+            if (!s) return WC_ERR_MEMORY;
+            memcpy(s, &r->stat, sizeof(daily_stat_t));
+            mastery_changed_locked(db, (uint32_t)(m - db->mastery), old_status);
+            return WC_OK;
+        }
+        default:
+            return WC_ERR_CORRUPT;
+    }
+}
+
+/* 重放 fd 中的日志；返回最后一条完整记录的结束偏移，遇到残缺/校验失败即停 */
+static int64_t journal_replay_locked(wordcard_db_t *db, int fd) {
+    char header[WC_WAL_HEADER_SIZE];
+    ssize_t n = pread(fd, header, sizeof(header), 0);
+    if (n == 0) return 0;                          /* 新文件 */
+    if (n != (ssize_t)sizeof(header) || memcmp(header, WC_WAL_MAGIC, 4) != 0)
+        return -1;
+    
+    FILE *fp = fdopen(dup(fd), "rb");
+    if (!fp) return -1;
+    fseek(fp, WC_WAL_HEADER_SIZE, SEEK_SET);
+    
+    int64_t good = WC_WAL_HEADER_SIZE;
+    char *payload = malloc(UINT16_MAX);
+    if (!payload) { fclose(fp); return -1; }
+    
+    wc_wal_record_t rec;
+    while (fread(&rec, sizeof(rec), 1, fp) == 1) {
+        if (rec.size > 0 && fread(payload, rec.size, 1, fp) != 1) break;
+        if (mydb_crc32(payload, rec.size) != rec.crc) break;
+        if (journal_apply_locked(db, rec.type, payload, rec.size) != WC_OK) break;
+        good += (int64_t)(sizeof(rec) + rec.size);
+    }
+    
+    free(payload);
+    fclose(fp);
+    return good;
+}
+
+int wc_journal_open(wordcard_db_t *db, const char *db_path) {
+    if (!db || !db_path || !db_path[0]) return WC_ERR_INVALID;
+    
+    char wal_path[512];
+    snprintf(wal_path, sizeof(wal_path), "%s.wal", db_path);
+    
+    LOCK();
+    if (db->wal_fd >= 0) { UNLOCK(); return WC_ERR_EXISTS; }
+    
+    strncpy(db->db_path, db_path, sizeof(db->db_path) - 1);
+    db->db_path[sizeof(db->db_path) - 1] = '\0';
+    
+    int fd = open(wal_path, O_RDWR | O_CREAT | O_APPEND, 0644);
+    if (fd < 0) { UNLOCK(); return WC_ERR_FILE; }
+    
+    int64_t good = journal_replay_locked(db, fd);
+    if (good < 0) { close(fd); UNLOCK(); return WC_ERR_CORRUPT; }
+    
+    if (good == 0) {
+        char header[WC_WAL_HEADER_SIZE] = {0};
+        memcpy(header, WC_WAL_MAGIC, 4);
+        if (write_all(fd, header, sizeof(header)) != 0 || fsync(fd) != 0) {
+            close(fd); UNLOCK(); return WC_ERR_FILE;
+        }
+        good = WC_WAL_HEADER_SIZE;
+    } else if (ftruncate(fd, (off_t)good) != 0) {
+        /* 丢弃崩溃时写了一半的尾部记录 */
+        close(fd); UNLOCK(); return WC_ERR_FILE;
+    }
+    
+    db->wal_fd = fd;
+    db->wal_size = (uint64_t)good;
+    UNLOCK();
+    return WC_OK;
+}
+
+int wc_journal_replay(wordcard_db_t *db, const char *db_path) {
+    if (!db || !db_path || !db_path[0]) return WC_ERR_INVALID;
+    
+    char wal_path[512];
+    snprintf(wal_path, sizeof(wal_path), "%s.wal", db_path);
+    int fd = open(wal_path, O_RDONLY);
+    if (fd < 0) return errno == ENOENT ? WC_OK : WC_ERR_FILE;
+    
+    /* 写者可能正在追加：尾部半条记录校验不过，到此为止 */
+    LOCK();
+    int64_t good = journal_replay_locked(db, fd);
+    UNLOCK();
+    close(fd);
+    return good < 0 ? WC_ERR_CORRUPT : WC_OK;
+}
+
+int wc_journal_sync(wordcard_db_t *db) {
+    if (!db) return WC_ERR_INVALID;
+    if (db->wal_fd < 0) return WC_OK;
+    return fdatasync(db->wal_fd) == 0 ? WC_OK : WC_ERR_FILE;
+}
+
+int wc_checkpoint(wordcard_db_t *db) {
+    if (!db) return WC_ERR_INVALID;
+    
+    LOCK();
+    /* 新快照持久化之后才能截断日志；两步之间崩溃只会多重放一遍（幂等） */
+    int ret = save_db_locked(db, NULL);
+    if (ret == WC_OK && db->wal_fd >= 0) {
+        if (ftruncate(db->wal_fd, WC_WAL_HEADER_SIZE) != 0 || fdatasync(db->wal_fd) != 0) {
+            ret = WC_ERR_FILE;
+        } else {
+            db->wal_size = WC_WAL_HEADER_SIZE;
+        }
+    }
+    UNLOCK();
+    return ret;
+}
+
+int wc_commit(wordcard_db_t *db, uint64_t compact_size) {
+    if (!db) return WC_ERR_INVALID;
+    if (compact_size == 0) compact_size = WC_WAL_COMPACT_SIZE;
+    
+    RDLOCK();
+    int wal_fd = db->wal_fd;
+    int dirty = db->dirty;
+    pthread_mutex_lock(&g_wal_mutex);
+    uint64_t wal_size = db->wal_size;
+    pthread_mutex_unlock(&g_wal_mutex);
+    UNLOCK();
+    
+    if (wal_fd < 0) {
+        return dirty ? wc_save_db(db, NULL) : WC_OK;
+    }
+    if (dirty || wal_size >= compact_size) {
+        return wc_checkpoint(db);
+    }
+    return wc_journal_sync(db);
 }
 
 /* ========================================================================
@@ -1146,7 +2821,10 @@ void wc_record_activity(wordcard_db_t *db, uint32_t user_id,
  * ======================================================================== */
 
 void wc_notify_mastery_changed(wordcard_db_t *db) {
-    if (db) db->mastery_due_dirty = 1;
+    if (!db) return;
+    LOCK();
+    db->due_generation++;
+    UNLOCK();
 }
 
 uint32_t wc_now(void) {
@@ -1154,11 +2832,16 @@ uint32_t wc_now(void) {
 }
 
 uint32_t wc_today(void) {
-    time_t t = time(NULL);
-    struct tm *tm_info = localtime(&t);
-    return (uint32_t)((tm_info->tm_year + 1900) * 10000 + 
-                      (tm_info->tm_mon + 1) * 100 + 
-                      tm_info->tm_mday);
+    return wc_date_of(wc_now());
+}
+
+uint32_t wc_date_of(uint32_t ts) {
+    time_t t = (time_t)ts;
+    struct tm tm_info;
+    localtime_r(&t, &tm_info);
+    return (uint32_t)((tm_info.tm_year + 1900) * 10000 + 
+                      (tm_info.tm_mon + 1) * 100 + 
+                      tm_info.tm_mday);
 }
 
 const char* wc_version_string(void) {
@@ -12,14 +12,27 @@ extern "C" {
  * 常量定义
  * ======================================================================== */
 
-#define WC_MAGIC            "WCD\x03"        /* 文件魔数，版本3（通用学习项） */
-#define WC_VERSION          3
+#define WC_MAGIC            "WCD\x05"        /* 文件魔数，版本5（v4 + 载体内容指纹） */
+#define WC_VERSION          5
+#define WC_MAGIC_V4         "WCD\x04"        /* 版本4（紧凑学习项 + 字符串堆，旧载体行），只读兼容 */
+#define WC_VERSION_V4       4
+#define WC_MAGIC_V3         "WCD\x03"        /* 版本3（定长学习项），只读兼容 */
+#define WC_VERSION_V3       3
 #define WC_HEADER_SIZE      64               /* 文件头固定64字节 */
 
+/* 预写日志（WAL）：<db>.wal，快照之后的增量记录 */
+#define WC_WAL_MAGIC        "WCL\x01"
+#define WC_WAL_HEADER_SIZE  8                /* 魔数 + 预留 */
+#define WC_WAL_COMPACT_SIZE (16u * 1024 * 1024) /* 超过则折叠进新快照 */
+#define WC_WAL_MAX_PAYLOAD  4096             /* 单条记录 payload 上限 */
+
 /* 数组初始容量和增长因子 */
 #define WC_INIT_CAPACITY    1024
 #define WC_GROWTH_FACTOR    2
 
+/* 用户分片锁数：不同分片的用户复习可并行 */
+#define WC_USER_SHARDS      64
+
 /* 默认值 */
 #define WC_DEFAULT_EF       2.5f             /* SM-2 默认 ease factor */
 #define WC_MIN_EF           1.3f             /* SM-2 最低 ease factor */
@@ -93,10 +106,30 @@ typedef struct {
     uint32_t item_start;            /* 在全局学习项表中的起始索引 */
     uint32_t item_count;            /* 包含的学习项数量 */
     uint32_t created_at;            /* 创建时间戳 */
+    /* v5：增量导入用的内容指纹 */
+    uint32_t page_count;            /* 页数（仅 PDF，其它为 0） */
+    uint32_t page_hashes;           /* 字符串堆偏移：每页 8 位十六进制指纹按页序拼接 */
+    uint32_t updated_at;            /* 上次导入时间 */
+    uint64_t content_hash;          /* 整个文件的内容指纹 */
+    uint64_t file_size;             /* 上次导入时的文件大小 */
+    uint32_t file_mtime;            /* 上次导入时的修改时间 */
+    uint32_t reserved;
 } content_source_t;
 
+/* v3/v4 磁盘格式的载体行（加载及旧日志重放时转换） */
+typedef struct {
+    uint32_t id;
+    source_type_t type;
+    char name[128];
+    char file_path[256];
+    uint32_t item_start;
+    uint32_t item_count;
+    uint32_t created_at;
+} content_source_v4_t;
+
 /* 通用学习项（知识卡片）
  * 适用于任何学习内容：单词、法条、数学题、口语话题等
+ * 定长完整形式：作为 wc_add_item/wc_get_item 的入参出参，也是 v3 磁盘格式
  */
 typedef struct {
     uint32_t id;                    /* 唯一ID */
@@ -111,6 +144,24 @@ typedef struct {
     uint32_t frequency;             /* 出现频率统计 */
 } item_entry_t;
 
+/* 学习项紧凑行（内存与 v4 磁盘格式）
+ * 文本字段为字符串堆 wordcard_db_t.strings 中的偏移（0 = 空串），
+ * 用 wc_str(db, off) 取出；数值列定长，整表扫描只触及 40 字节/项
+ */
+typedef struct {
+    uint32_t id;                    /* 唯一ID */
+    uint32_t question;              /* 问题（堆偏移） */
+    uint32_t answer;                /* 答案（堆偏移） */
+    uint32_t explanation;           /* 解析/例句（堆偏移） */
+    uint32_t hint;                  /* 提示（堆偏移） */
+    uint32_t tags;                  /* 标签（堆偏移） */
+    uint32_t source_id;             /* 关联载体ID */
+    uint32_t category;              /* 内容类型（item_category_t） */
+    uint32_t frequency;             /* 出现频率统计 */
+    uint8_t difficulty;             /* 难度等级 1-5 */
+    uint8_t reserved[3];
+} item_row_t;
+
 /* 段落/章节（PDF精读模式用） */
 typedef struct {
     uint32_t id;                    /* 唯一ID */
@@ -199,13 +250,32 @@ typedef struct {
     uint32_t study_time_sec;        /* 学习时长（秒） */
 } daily_stat_t;
 
+/* 用户计数汇总（运行时查询结果，不落盘） */
+typedef struct {
+    uint32_t due_now;               /* 当前到期 */
+    uint32_t due_today;             /* 今日结束前到期（含当前） */
+    uint32_t new_available;         /* 尚无掌握度记录的学习项 */
+    uint32_t learning;              /* 学习中 */
+    uint32_t mastered;              /* 已掌握 */
+} user_counts_t;
+
+/* 批量复习请求（wc_submit_reviews 入参） */
+typedef struct {
+    uint32_t user_id;
+    uint32_t item_id;
+    uint32_t reviewed_at;           /* 复习时间，0 = 服务器当前时间 */
+    uint32_t time_spent;            /* 用时（秒） */
+    uint8_t quality;                /* 0-5 */
+    uint8_t reserved[3];
+} review_req_t;
+
 /* ========================================================================
  * 文件头结构（64字节，磁盘格式）
  * ======================================================================== */
 
 typedef struct {
-    char magic[4];                  /* "WCD\x03" */
-    uint32_t version;               /* 版本号 = 3 */
+    char magic[4];                  /* "WCD\x05" */
+    uint32_t version;               /* 版本号 = 5 */
     uint32_t item_count;            /* 学习项数量 */
     uint32_t source_count;          /* 载体数量 */
     uint32_t chapter_count;         /* 章节数量 */
@@ -213,19 +283,51 @@ typedef struct {
     uint32_t mastery_count;         /* 掌握度记录数 */
     uint32_t progress_count;        /* 阅读进度记录数 */
     uint32_t stat_count;            /* 统计记录数 */
-    char reserved[28];              /* 预留 */
+    uint32_t string_size;           /* 字符串堆字节数（v4，紧跟学习项表） */
+    char reserved[24];              /* 预留 */
 } wc_file_header_t;
 
+/* ========================================================================
+ * 预写日志记录（磁盘格式）
+ * 每条记录 = 记录头 + payload，payload 为对应行的后像（after-image），
+ * 重放时按主键覆盖写入，天然幂等
+ * ======================================================================== */
+
+typedef enum {
+    WAL_ITEM = 1,           /* payload: item_entry_t（旧日志，仅重放） */
+    WAL_SOURCE = 2,         /* payload: content_source_t（或旧版 content_source_v4_t） */
+    WAL_USER = 3,           /* payload: user_t */
+    WAL_REVIEW = 4,         /* payload: wc_wal_review_t */
+    WAL_ITEM_ROW = 5,       /* payload: item_row_t + 5 个以 NUL 结尾的字符串 */
+    WAL_SOURCE_ROW = 6,     /* payload: content_source_t + 以 NUL 结尾的页指纹串 */
+} wal_record_type_t;
+
+typedef struct {
+    uint32_t crc;                   /* payload 的 CRC32 */
+    uint16_t type;                  /* wal_record_type_t */
+    uint16_t size;                  /* payload 字节数 */
+} wc_wal_record_t;
+
+/* 一次复习：掌握度行 + 当日统计行 */
+typedef struct {
+    user_item_mastery_t mastery;
+    daily_stat_t stat;
+} wc_wal_review_t;
+
 /* ========================================================================
  * 内存数据库主结构
  * ======================================================================== */
 
 typedef struct {
     /* ====== 全局共享数据（只读/少写）====== */
-    item_entry_t *items;            /* 学习项库（原 vocab） */
+    item_row_t *items;              /* 学习项库（紧凑行） */
     size_t item_count;
     size_t item_capacity;
     
+    char *strings;                  /* 字符串堆：UTF-8，NUL 结尾，偏移 0 为空串 */
+    size_t string_size;
+    size_t string_capacity;
+    
     content_source_t *sources;      /* 载体列表 */
     size_t source_count;
     size_t source_capacity;
@@ -252,7 +354,7 @@ typedef struct {
     size_t stat_capacity;
     
     /* ====== 运行时索引（不保存到磁盘）====== */
-    void *question_hash;            /* question(string) → item_index */
+    void *question_hash;            /* question → item_index（开放寻址，键在字符串堆） */
     void *id_hash;                  /* item_id → item_index */
     void *source_hash;              /* source_id → source_index */
     void *user_hash;                /* dingtalk_uid → user_index */
@@ -260,14 +362,22 @@ typedef struct {
     void *mastery_hash;             /* (user_id,item_id) → mastery_index */
     void *stat_hash;                /* (user_id,date) → stat_index (O(1)) */
     
-    /* ====== 到期复习索引（惰性重建）====== */
-    uint32_t *mastery_due_sorted;   /* 按 next_review 排序的 mastery 索引 */
-    size_t mastery_due_sorted_count;
-    int mastery_due_dirty;          /* 1 = 需要重建排序 */
+    /* ====== 按用户的复习索引（按需创建）====== */
+    void *user_index;               /* user_id → 该用户的 mastery 行与到期堆 */
+    uint32_t *mastery_heap_pos;     /* 与 mastery 平行：在所属用户到期堆中的位置 */
+    uint32_t due_generation;        /* 外部改动掌握度后递增，到期堆惰性重建 */
     
     /* ====== 异步保存状态 ====== */
-    int dirty;                      /* 数据是否被修改 */
+    int dirty;                      /* 是否有未写入 WAL 的修改（需完整快照） */
     char db_path[256];              /* 数据库文件路径 */
+    
+    /* ====== 预写日志 ====== */
+    int wal_fd;                     /* -1 = 未启用 */
+    uint64_t wal_size;              /* 当前日志字节数（含文件头） */
+    
+    /* ====== 只读映射（wc_map_db）====== */
+    void *map_base;                 /* 快照文件的 MAP_PRIVATE 映射，NULL = 未映射 */
+    size_t map_size;
 } wordcard_db_t;
 
 /* ========================================================================
@@ -293,26 +403,70 @@ typedef enum {
 wordcard_db_t* wc_db_init(void);
 void wc_db_free(wordcard_db_t *db);
 wordcard_db_t* wc_load_db(const char *path);
+wordcard_db_t* wc_map_db(const char *path);   /* 映射快照，表直接指向文件页（写时复制） */
 int wc_save_db(wordcard_db_t *db, const char *path);
 void wc_mark_dirty(wordcard_db_t *db);
 
+/* -------- 预写日志 -------- */
+
+int wc_journal_open(wordcard_db_t *db, const char *db_path);  /* 重放 <db_path>.wal 并开始追加 */
+int wc_journal_replay(wordcard_db_t *db, const char *db_path); /* 只重放不追加（只读打开） */
+int wc_journal_sync(wordcard_db_t *db);                       /* fdatasync 日志 */
+int wc_checkpoint(wordcard_db_t *db);                         /* 写快照并清空日志 */
+int wc_commit(wordcard_db_t *db, uint64_t compact_size);      /* 组提交：同步日志，必要时折叠 */
+
 /* -------- 学习项操作 -------- */
 
 uint32_t wc_add_item(wordcard_db_t *db, const item_entry_t *entry);
-item_entry_t* wc_find_item_by_question(wordcard_db_t *db, const char *question);
-item_entry_t* wc_find_item_by_id(wordcard_db_t *db, uint32_t item_id);
+/* 批量添加：一次预留容量、一次加锁；与已有项及批内查重。
+ * out_ids[i] 为新 ID，重复项为 0（out_ids 可为 NULL）。返回新增条数或错误码 */
+int wc_add_items_bulk(wordcard_db_t *db, const item_entry_t *entries, size_t n,
+                      uint32_t *out_ids);
+/* wc_find_* 返回指向内部数组的指针，返回前已释放锁：其他线程插入引起的扩容会使其
+ * 失效，并发复习会改写掌握度行。只能在单线程或确知没有并发写者时使用，
+ * 多线程一律用对应的 wc_get_*，在锁内拷出副本。
+ * ABI 变更：v5 起 wc_find_item_* 返回紧凑行 item_row_t*（文本为字符串堆偏移），
+ * 不再是 item_entry_t*；按旧原型编译的调用方须改用 wc_get_item* */
+item_row_t* wc_find_item_by_question(wordcard_db_t *db, const char *question);
+item_row_t* wc_find_item_by_id(wordcard_db_t *db, uint32_t item_id);
+/* 展开为完整学习项副本（不受后续扩容影响） */
+int wc_get_item(wordcard_db_t *db, uint32_t item_id, item_entry_t *out);
+int wc_get_item_by_question(wordcard_db_t *db, const char *question, item_entry_t *out);
+/* 批量查词频：out_freq[i] 为 questions[i] 已存的 frequency（不存在为 0），
+ * *total 为全库 frequency 之和（可为 NULL）。frequency 为首次入库时的频次，
+ * 重复插入不更新，不是文档频率；导入时 rank=rarity 用它估计库里已有多少 */
+int wc_item_frequencies(wordcard_db_t *db, const char *const *questions, size_t n,
+                        uint32_t *out_freq, uint64_t *total);
+
+/* 字符串堆偏移 → C 字符串 */
+static inline const char* wc_str(const wordcard_db_t *db, uint32_t off) {
+    return db->strings + off;
+}
 
 /* -------- 载体/内容源操作 -------- */
 
 uint32_t wc_add_source(wordcard_db_t *db, const content_source_t *source);
 content_source_t* wc_find_source_by_id(wordcard_db_t *db, uint32_t source_id);
 content_source_t* wc_find_source_by_name(wordcard_db_t *db, const char *name);
+/* 载体行副本；不存在返回 WC_ERR_NOT_FOUND */
+int wc_get_source(wordcard_db_t *db, uint32_t source_id, content_source_t *out);
+int wc_get_source_by_path(wordcard_db_t *db, const char *file_path, content_source_t *out);
+/* 按 id 覆盖载体行（指纹、计数等）；page_hashes 为 NULL 时保留原页指纹 */
+int wc_update_source(wordcard_db_t *db, const content_source_t *source,
+                     const char *page_hashes);
+/* 载体的页指纹串拷入 buf（无则为空串）；*out_len 为串长（不含 NUL）。
+ * cap 不足 *out_len + 1 时不拷贝、返回 WC_ERR_MEMORY，按 *out_len 扩大后重试 */
+int wc_get_source_page_hashes(wordcard_db_t *db, uint32_t source_id,
+                              char *buf, size_t cap, size_t *out_len);
 
 /* -------- 用户操作 -------- */
 
 uint32_t wc_create_user(wordcard_db_t *db, const char *dingtalk_uid, const char *name);
 user_t* wc_find_user(wordcard_db_t *db, const char *dingtalk_uid);
 user_t* wc_find_user_by_id(wordcard_db_t *db, uint32_t user_id);
+/* 用户行副本；不存在返回 WC_ERR_NOT_FOUND */
+int wc_get_user(wordcard_db_t *db, uint32_t user_id, user_t *out);
+int wc_get_user_by_uid(wordcard_db_t *db, const char *dingtalk_uid, user_t *out);
 
 /* -------- 掌握度操作 -------- */
 
@@ -322,7 +476,25 @@ user_item_mastery_t* wc_get_or_create_mastery(wordcard_db_t *db,
 user_item_mastery_t* wc_find_mastery(wordcard_db_t *db, 
                                       uint32_t user_id, 
                                       uint32_t item_id);
+/* 掌握度行副本（持该用户分片锁拷贝）；不存在返回 WC_ERR_NOT_FOUND */
+int wc_get_mastery(wordcard_db_t *db, uint32_t user_id, uint32_t item_id,
+                   user_item_mastery_t *out);
+/* 持独占锁取掌握度表首地址与行数，供零拷贝批量读写。持锁期间复习等引擎
+ * 调用都会等待、表不会扩容；须由同一线程以 wc_mastery_release 配对释放，
+ * 期间不能再调用其他加锁的引擎函数（锁不可重入） */
+user_item_mastery_t* wc_mastery_acquire(wordcard_db_t *db, size_t *count);
+/* 释放 wc_mastery_acquire 的锁；changed 非 0 时让到期堆/计数重建并标脏
+ * （直接改写不入预写日志，下次 commit 写完整快照） */
+void wc_mastery_release(wordcard_db_t *db, int changed);
+/* 批量定位 (user_id, item_id) 的行号；create 时不存在则建档，找不到/失败为 -1。
+ * 返回 -1 的条数（负数为错误码） */
+int wc_mastery_rows(wordcard_db_t *db, const uint32_t *user_ids, const uint32_t *item_ids,
+                    size_t n, int create, int64_t *out_rows);
 void wc_sm2_update(user_item_mastery_t *mastery, uint8_t quality);
+/* 以指定复习时间执行 SM-2（离线同步的历史复习） */
+void wc_sm2_update_at(user_item_mastery_t *mastery, uint8_t quality, uint32_t at);
+/* 对库内掌握度执行 SM-2，并增量调整所属用户的到期堆 */
+void wc_sm2_update_db(wordcard_db_t *db, user_item_mastery_t *mastery, uint8_t quality);
 void wc_update_mastery_dimension(wordcard_db_t *db,
                                   user_item_mastery_t *mastery,
                                   char dimension,
@@ -330,16 +502,53 @@ void wc_update_mastery_dimension(wordcard_db_t *db,
                                   uint8_t score);
 void wc_recalc_overall(user_item_mastery_t *mastery);
 
+/* 一次完整复习：建档 + SM-2 + 当日统计 + 写日志，结果拷入 out（可为 NULL）。
+ * 已有掌握度与当日统计行时只持共享锁 + 用户分片锁，不同用户可并行。
+ * 用户或学习项不存在时返回 WC_ERR_NOT_FOUND，不建档 */
+int wc_review(wordcard_db_t *db, uint32_t user_id, uint32_t item_id,
+              uint8_t quality, uint32_t time_spent, user_item_mastery_t *out);
+/* 按顺序提交一批复习：一次独占加锁、日志合并写入。out[i]/out_rc[i] 为逐条结果
+ * （均可为 NULL；不存在的用户/学习项为 WC_ERR_NOT_FOUND），返回成功条数 */
+int wc_submit_reviews(wordcard_db_t *db, const review_req_t *reqs, size_t n,
+                      user_item_mastery_t *out, int32_t *out_rc);
+
 /* -------- 查询接口 -------- */
 
 size_t wc_get_due_items(wordcard_db_t *db, uint32_t user_id, uint32_t now,
                          uint32_t *out_ids, size_t max_count);
 size_t wc_get_new_items(wordcard_db_t *db, uint32_t user_id, uint32_t source_id,
                          uint32_t *out_ids, size_t max_count);
+/* 用户计数汇总：到期数按堆剪枝统计，其余为随 SM-2 迁移维护的计数器 */
+int wc_get_user_counts(wordcard_db_t *db, uint32_t user_id, uint32_t now,
+                       user_counts_t *out);
+/* 未来 days 天每天到期的复习数：out_counts[0] 含已过期与今天到期，
+ * out_counts[d] 为第 d 个本地自然日。只遍历该用户到期堆中窗口内的部分 */
+int wc_forecast(wordcard_db_t *db, uint32_t user_id, uint32_t now,
+                uint32_t days, uint32_t *out_counts);
+/* 从 now 所在的本地自然日起连续 days 天，每天最后一秒的时间戳（预测与模拟共用的分桶） */
+int wc_day_ends(uint32_t now, uint32_t days, uint32_t *out_ends);
 size_t wc_generate_daily_queue(wordcard_db_t *db, uint32_t user_id, uint32_t now,
                                 uint32_t *out_ids, uint8_t *out_modes, 
                                 size_t max_count);
 
+/* wc_daily_queue_items 的字段位，打包顺序即位序 */
+#define WC_FIELD_QUESTION     0x01
+#define WC_FIELD_ANSWER       0x02
+#define WC_FIELD_EXPLANATION  0x04
+#define WC_FIELD_HINT         0x08
+#define WC_FIELD_TAGS         0x10
+
+/* 生成队列并一次取回所需文本字段（免去逐项 wc_get_item）。
+ * fields 中每个字段依次写入 buf（UTF-8，不含 NUL），第 i 项第 k 个所选字段为
+ * buf[out_offsets[i*nf+k] .. out_offsets[i*nf+k+1])，nf 为 fields 置位数，
+ * out_offsets 需 max_count*nf+1 个元素。已不存在的学习项被跳过。
+ * *buf_used 为全部文本所需字节数；大于 buf_cap 时文本不完整，应按该大小重试。
+ * 返回项数 */
+size_t wc_daily_queue_items(wordcard_db_t *db, uint32_t user_id, uint32_t now,
+                            uint32_t fields, uint32_t *out_ids, uint8_t *out_modes,
+                            uint32_t *out_offsets, char *buf, size_t buf_cap,
+                            size_t *buf_used, size_t max_count);
+
 /* -------- 推荐算法 -------- */
 
 study_mode_t wc_recommend_mode(const user_item_mastery_t *mastery, uint32_t now);
@@ -354,9 +563,11 @@ void wc_record_activity(wordcard_db_t *db, uint32_t user_id,
 
 /* -------- 通知与工具函数 -------- */
 
+/* 绕过 wc_review/wc_sm2_update_db 直接改写掌握度后调用：到期堆下次查询时重建 */
 void wc_notify_mastery_changed(wordcard_db_t *db);
 uint32_t wc_now(void);
 uint32_t wc_today(void);
+uint32_t wc_date_of(uint32_t ts);       /* 时间戳 → 本地日期 YYYYMMDD */
 const char* wc_version_string(void);
 
 /* ======================================================================== */
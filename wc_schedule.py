@@ -0,0 +1,256 @@
+"""批量调度 — 掌握度表的 NumPy 视图与向量化 SM-2
+
+NumPy 按需导入，只在调用本模块函数时才需要安装。
+
+视图直接指向 C 端 mastery 数组（零拷贝），只在 ``with mastery_table(db) as t:``
+块内有效：块内持 C 端独占锁，复习等引擎调用都会等待、表不会扩容。
+直接改写不会写预写日志，改写后调 ``t.mark_changed()``，退出时让到期堆重建
+并把库标脏，下次 commit 写完整快照。只读用 ``mastery_copy(db)`` 取副本。
+"""
+
+import ctypes
+from ctypes import c_float, c_int64, c_size_t, c_uint8, c_uint16, c_uint32
+
+from engine import Mastery
+
+DAY = 86400
+SM2_NEW, SM2_LEARNING, SM2_MASTERED = 0, 1, 2
+MIN_EF = 1.3
+MAX_INTERVAL = 3650
+
+_np = None
+
+def _numpy():
+    global _np
+    if _np is None:
+        import numpy
+        _np = numpy
+    return _np
+
+# ── 视图 ───────────────────────────────────────────────────
+
+_CTYPE_FORMATS = {c_uint8: 'u1', c_uint16: 'u2', c_uint32: 'u4', c_float: 'f4'}
+
+def mastery_dtype():
+    """与 C 端 user_item_mastery_t 逐字节对齐的结构化 dtype"""
+    np = _numpy()
+    names, formats, offsets = [], [], []
+    for name, ctype in Mastery._fields_:
+        names.append(name)
+        formats.append(_CTYPE_FORMATS[ctype])
+        offsets.append(getattr(Mastery, name).offset)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                     'itemsize': ctypes.sizeof(Mastery)})
+
+class MasteryTable:
+    """``with`` 块内持 C 端独占锁，view 为整张掌握度表的可写视图。
+    块内本线程不能再调用其他引擎函数（C 锁不可重入），须在同一线程内退出；
+    退出后 view 置为只读并丢弃，之前切出的视图也不能再用"""
+
+    def __init__(self, db):
+        self.db = db
+        self.view = None
+        self._changed = False
+
+    def __enter__(self):
+        np = _numpy()
+        dt = mastery_dtype()
+        count = c_size_t()
+        ptr = self.db._lib.wc_mastery_acquire(self.db._handle, ctypes.byref(count))
+        if not ptr or count.value == 0:
+            self.view = np.zeros(0, dtype=dt)
+        else:
+            buf = (ctypes.c_char * (count.value * dt.itemsize)).from_address(ptr)
+            self.view = np.frombuffer(buf, dtype=dt, count=count.value)
+        self._changed = False
+        return self
+
+    def mark_changed(self):
+        """直接改写了表：退出时让到期堆/计数重建并标脏"""
+        self._changed = True
+
+    def __exit__(self, exc_type, exc, tb):
+        self.view.flags.writeable = False
+        self.view = None
+        # 异常退出时可能已改了一半，按已改处理
+        changed = self._changed or exc_type is not None
+        self.db._lib.wc_mastery_release(self.db._handle, 1 if changed else 0)
+
+def mastery_table(db):
+    """零拷贝访问掌握度表：``with mastery_table(db) as t: t.view ...``"""
+    return MasteryTable(db)
+
+def mastery_copy(db):
+    """整张掌握度表的副本（结构化数组），不受之后扩容/复习影响"""
+    with mastery_table(db) as t:
+        return t.view.copy()
+
+def mastery_rows(db, user_ids, item_ids, create=True):
+    """(user_id, item_id) → 行号数组；create=False 时不存在的为 -1"""
+    np = _numpy()
+    uids = np.ascontiguousarray(user_ids, dtype=np.uint32)
+    iids = np.ascontiguousarray(item_ids, dtype=np.uint32)
+    uids, iids = np.broadcast_arrays(uids, iids)
+    uids = np.ascontiguousarray(uids)
+    iids = np.ascontiguousarray(iids)
+    rows = np.empty(uids.size, dtype=np.int64)
+    ret = db._lib.wc_mastery_rows(
+        db._handle,
+        uids.ctypes.data_as(ctypes.POINTER(c_uint32)),
+        iids.ctypes.data_as(ctypes.POINTER(c_uint32)),
+        uids.size, 1 if create else 0,
+        rows.ctypes.data_as(ctypes.POINTER(c_int64)))
+    if ret < 0:
+        raise ValueError(f'wc_mastery_rows failed ({ret})')
+    if create and ret:
+        raise MemoryError(f'wc_mastery_rows: {ret} rows not created')
+    return rows
+
+# ── SM-2 ───────────────────────────────────────────────────
+
+def sm2_apply(m, quality, now):
+    """对结构化数组 m 逐元素执行 SM-2（原地），与 wc_sm2_update_at 结果一致"""
+    np = _numpy()
+    q = np.broadcast_to(np.asarray(quality, dtype=np.int32), m.shape)
+    now = np.broadcast_to(np.asarray(now, dtype=np.uint32), m.shape)
+    good = q >= 3
+
+    m['total_reviews'] += 1
+    m['last_review'] = now
+
+    # 记住了
+    m['correct_count'] += good
+    m['streak_days'] = np.where(good, m['streak_days'] + 1, 0)
+    m['forget_count'] = np.where(good, 0, m['forget_count'] + 1)
+    m['sm2_status'] = np.where(good & (m['sm2_status'] == SM2_NEW),
+                               SM2_LEARNING, m['sm2_status'])
+    reps = m['repetitions']
+    grown = m['interval_days'].astype(np.float32) * m['ease_factor']
+    grown = np.minimum(grown, 65535).astype(np.uint16)
+    interval = np.where(reps == 0, 1, np.where(reps == 1, 6, grown))
+    interval = np.minimum(interval, MAX_INTERVAL)
+
+    # 忘记了
+    bad = ~good
+    m['wrong_count'] += bad
+    m['last_wrong'] = np.where(bad, now, m['last_wrong'])
+    m['repetitions'] = np.where(good, reps + 1, 0)
+    m['interval_days'] = np.where(good, interval, 1)
+
+    lapse = (5 - q).astype(np.float32)
+    ef = m['ease_factor'] + (np.float32(0.1) - lapse * (np.float32(0.08) + lapse * np.float32(0.02)))
+    m['ease_factor'] = np.maximum(ef, np.float32(MIN_EF))
+
+    m['next_review'] = m['last_review'] + m['interval_days'].astype(np.uint32) * DAY
+    mastered = (m['repetitions'] >= 5) & (m['interval_days'] >= 21)
+    m['sm2_status'] = np.where(mastered, SM2_MASTERED, m['sm2_status'])
+    return m
+
+def sm2_update_many(db, user_ids, item_ids, qualities, now=None):
+    """批量 SM-2：按输入顺序生效（同一行出现多次时依次应用），不存在的记录自动建档。
+    返回更新后各条对应的掌握度副本（结构化数组）"""
+    np = _numpy()
+    if now is None:
+        now = db.now()
+    q = np.asarray(qualities, dtype=np.int32)
+    if q.size and (q.min() < 0 or q.max() > 5):
+        raise ValueError('quality must be 0-5')
+    with db.lock:
+        rows = mastery_rows(db, user_ids, item_ids, create=True)
+        q = np.broadcast_to(q, rows.shape)
+        now = np.broadcast_to(np.asarray(now, dtype=np.uint32), rows.shape)
+        out = np.empty(rows.size, dtype=mastery_dtype())
+        # 行号建档后不变；建档可能扩容，之后再取视图
+        with mastery_table(db) as t:
+            view = t.view
+            # 每轮取各行的第一次出现，保证同一行的多次复习按顺序叠加
+            pending = np.arange(rows.size)
+            while pending.size:
+                _, first = np.unique(rows[pending], return_index=True)
+                sel = pending[np.sort(first)]
+                m = view[rows[sel]]
+                sm2_apply(m, q[sel], now[sel])
+                view[rows[sel]] = m
+                out[sel] = m
+                pending = np.setdiff1d(pending, sel, assume_unique=True)
+            if rows.size:
+                t.mark_changed()
+    return out
+
+# ── 批量调整 ────────────────────────────────────────────────
+
+def _user_mask(view, user_id, learned_only=True):
+    mask = view['user_id'] == user_id
+    if learned_only:
+        mask &= view['sm2_status'] != SM2_NEW
+    return mask
+
+def reschedule_after_break(db, user_id, spread_days=7, now=None):
+    """假期回来：把已过期的卡片按过期先后均匀摊到接下来 spread_days 天。
+    返回调整的条数"""
+    np = _numpy()
+    if now is None:
+        now = db.now()
+    with db.lock, mastery_table(db) as t:
+        view = t.view
+        idx = np.flatnonzero(_user_mask(view, user_id) & (view['next_review'] <= now))
+        if idx.size == 0:
+            return 0
+        idx = idx[np.argsort(view['next_review'][idx], kind='stable')]
+        day = np.arange(idx.size) * max(spread_days, 1) // idx.size
+        view['next_review'][idx] = now + day.astype(np.uint32) * DAY
+        t.mark_changed()
+    return int(idx.size)
+
+def shift_due(db, user_id, days):
+    """把用户全部已学卡片的到期时间整体平移 days 天（可为负）"""
+    np = _numpy()
+    with db.lock, mastery_table(db) as t:
+        view = t.view
+        mask = _user_mask(view, user_id)
+        due = view['next_review'][mask].astype(np.int64) + int(days) * DAY
+        view['next_review'][mask] = np.clip(due, 0, 0xFFFFFFFF).astype(np.uint32)
+        if mask.any():
+            t.mark_changed()
+        return int(mask.sum())
+
+def scale_intervals(db, factor, user_id=None):
+    """参数调整后按比例缩放间隔，并以上次复习时间重算到期时间。
+    user_id 为 None 时作用于全部用户"""
+    np = _numpy()
+    with db.lock, mastery_table(db) as t:
+        view = t.view
+        mask = view['sm2_status'] != SM2_NEW
+        if user_id is not None:
+            mask &= view['user_id'] == user_id
+        interval = np.rint(view['interval_days'][mask] * float(factor))
+        interval = np.clip(interval, 1, MAX_INTERVAL).astype(np.uint16)
+        view['interval_days'][mask] = interval
+        view['next_review'][mask] = (view['last_review'][mask]
+                                     + interval.astype(np.uint32) * DAY)
+        if mask.any():
+            t.mark_changed()
+        return int(mask.sum())
+
+# ── 工作量模拟 ──────────────────────────────────────────────
+
+def simulate_workload(db, user_id, days=30, quality=4, now=None):
+    """在副本上逐日模拟：当天到期的卡片都以 quality 复习一次，
+    返回长度为 days 的每日复习量数组（不修改数据库）。
+    按本地自然日分桶，与 db.forecast 相同：[0] 含已过期与今天到期"""
+    np = _numpy()
+    if now is None:
+        now = db.now()
+    ends = db.day_ends(now, days)
+    with mastery_table(db) as t:
+        sim = t.view[_user_mask(t.view, user_id)]     # 花式索引即副本
+    counts = np.zeros(days, dtype=np.int64)
+    for d, day_end in enumerate(ends):
+        due = sim['next_review'] <= day_end
+        n = int(due.sum())
+        counts[d] = n
+        if n:
+            m = sim[due]
+            sm2_apply(m, quality, now if d == 0 else ends[d - 1] + 1)
+            sim[due] = m
+    return counts